@@ -0,0 +1,1074 @@
+# fakeBlpapi.py
+
+'''
+A local stand-in for the blpapi module, answering //blp/rankapi Query and GroupQuery and
+//blp/refdata ReferenceDataRequest requests with synthetic but schema-faithful messages, so
+that the samples and rankDemoReport can be exercised and benchmarked without a Bloomberg
+connection.
+
+Either install it programmatically before the code under test imports blpapi:
+
+    import fakeBlpapi
+    fakeBlpapi.install(latency=0.05, jitter=0.02, partial_size=100)
+
+or run a script through it:
+
+    python fakeBlpapi.py --latency 0.05 rankDemoReport.py -s security_universe_30.csv -b ABCD
+
+Responses are deterministic for a given seed, date and universe. Latency, jitter, error
+injection, the number of records per partial response, the number of brokers and the size
+of an exchange-wide universe are all configurable through configure()/install().
+'''
+
+import sys
+import getopt
+import heapq
+import itertools
+import os
+import queue
+import random
+import runpy
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+
+class Options():
+
+    def __init__(self):
+        self.latency = 0.0              # seconds before the first message of a response
+        self.jitter = 0.0               # extra uniform random delay, in seconds
+        self.partial_interval = 0.0     # seconds between successive messages of a response
+        self.partial_size = 500         # records per Report / ReferenceData message
+        self.error_rate = 0.0           # probability of answering a request with an Exception
+        self.missing_field_rate = 0.0   # probability of dropping a refdata field from fieldData
+        self.brokers = 40               # number of synthetic brokers
+        self.universe_size = 3000       # number of securities returned for an exchange
+        self.seed = 1
+        self.event_queue_size = None    # overrides SessionOptions.setMaxEventQueueSize, for slow consumer tests
+
+
+options = Options()
+
+
+def configure(**kwargs):
+
+    for name, value in kwargs.items():
+        if not hasattr(options, name):
+            raise TypeError("Unknown fake blpapi option: %s" % name)
+        setattr(options, name, value)
+
+    return options
+
+
+def install(**kwargs):
+
+    # Makes 'import blpapi' resolve to this module.
+    configure(**kwargs)
+    sys.modules["blpapi"] = sys.modules[__name__]
+    return sys.modules[__name__]
+
+
+# ---------------------------------------------------------------------------------------------
+# Core types
+# ---------------------------------------------------------------------------------------------
+
+class Exception(Exception):
+    pass
+
+class NotFoundException(Exception):
+    pass
+
+class InvalidArgumentException(Exception):
+    pass
+
+class InvalidStateException(Exception):
+    pass
+
+
+class Name():
+
+    __slots__ = ("_s",)
+
+    def __init__(self, s):
+        self._s = str(s)
+
+    def __str__(self):
+        return self._s
+
+    def __repr__(self):
+        return "Name(%r)" % self._s
+
+    def __eq__(self, other):
+        if isinstance(other, Name):
+            return self._s == other._s
+        if isinstance(other, str):
+            return self._s == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self._s)
+
+
+def _str(name):
+    return name._s if isinstance(name, Name) else name
+
+
+class CorrelationId():
+
+    _auto = itertools.count(1 << 32)
+
+    def __init__(self, value=None, classId=0):
+        self._value = next(CorrelationId._auto) if value is None else value
+
+    def value(self):
+        return self._value
+
+    def __eq__(self, other):
+        return isinstance(other, CorrelationId) and self._value == other._value
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __str__(self):
+        return "CorrelationId(%s)" % (self._value,)
+
+    __repr__ = __str__
+
+
+class Event():
+
+    ADMIN = 1
+    SESSION_STATUS = 2
+    SUBSCRIPTION_STATUS = 3
+    REQUEST_STATUS = 4
+    RESPONSE = 5
+    PARTIAL_RESPONSE = 6
+    SUBSCRIPTION_DATA = 8
+    SERVICE_STATUS = 9
+    TIMEOUT = 10
+    AUTHORIZATION_STATUS = 11
+    RESOLUTION_STATUS = 12
+    TOPIC_STATUS = 13
+    TOKEN_STATUS = 14
+    REQUEST = 15
+
+    def __init__(self, event_type, messages=()):
+        self._type = event_type
+        self._messages = list(messages)
+
+    def eventType(self):
+        return self._type
+
+    def __iter__(self):
+        return iter(self._messages)
+
+
+# ---------------------------------------------------------------------------------------------
+# Elements and messages
+# ---------------------------------------------------------------------------------------------
+
+# Request elements that are arrays in the real schemas.
+ARRAY_ELEMENTS = {"brokers", "securities", "fields", "exchanges", "overrides", "topBrokers", "records", "securityData", "fieldExceptions"}
+
+
+class Element():
+
+    __slots__ = ("_name", "_value")
+
+    def __init__(self, name, value):
+        self._name = _str(name)
+        self._value = value
+
+    def name(self):
+        return Name(self._name)
+
+    def isArray(self):
+        return isinstance(self._value, list)
+
+    def isComplexType(self):
+        return isinstance(self._value, dict)
+
+    def isNull(self):
+        return self._value is None
+
+    def numValues(self):
+        return len(self._value) if isinstance(self._value, list) else (0 if self._value is None else 1)
+
+    def numElements(self):
+        return len(self._value) if isinstance(self._value, dict) else 0
+
+    def hasElement(self, name, excludeNullElements=False):
+        return isinstance(self._value, dict) and _str(name) in self._value
+
+    def getElement(self, name):
+
+        if isinstance(name, int):
+            return self.getValueAsElement(name)
+
+        name = _str(name)
+
+        if not isinstance(self._value, dict):
+            raise InvalidStateException("Element '%s' is not a sequence or choice" % self._name)
+
+        if name not in self._value:
+            raise NotFoundException("Sub-element '%s' does not exist in '%s'" % (name, self._name))
+
+        return Element(name, self._value[name])
+
+    def elements(self):
+        return [Element(name, value) for name, value in self._value.items()] if isinstance(self._value, dict) else []
+
+    def values(self):
+        if not isinstance(self._value, list):
+            return [self.getValue()]
+        return [Element(self._name, value) if isinstance(value, (dict, list)) else value for value in self._value]
+
+    def getValueAsElement(self, index=0):
+        value = self._value[index]
+        return Element(self._name, value)
+
+    def getValue(self, index=0):
+        value = self._value[index] if isinstance(self._value, list) else self._value
+        return Element(self._name, value) if isinstance(value, (dict, list)) else value
+
+    def getValueAsString(self, index=0):
+        value = self.getValue(index)
+        return value if isinstance(value, str) else str(value)
+
+    def getValueAsInteger(self, index=0):
+        return int(self.getValue(index))
+
+    def getValueAsFloat(self, index=0):
+        return float(self.getValue(index))
+
+    def getValueAsBool(self, index=0):
+        return bool(self.getValue(index))
+
+    def getValueAsDatetime(self, index=0):
+        return self.getValue(index)
+
+    def getElementValue(self, name):
+        return self.getElement(name).getValue()
+
+    def getElementAsString(self, name):
+        return self.getElement(name).getValueAsString()
+
+    def getElementAsInteger(self, name):
+        return self.getElement(name).getValueAsInteger()
+
+    def getElementAsFloat(self, name):
+        return self.getElement(name).getValueAsFloat()
+
+    def getElementAsBool(self, name):
+        return self.getElement(name).getValueAsBool()
+
+    def getElementAsDatetime(self, name):
+        return self.getElement(name).getValueAsDatetime()
+
+    def toPy(self):
+        return self._value
+
+    def toString(self, level=0, spacesPerLevel=4):
+        return _format(self._name, self._value, level, spacesPerLevel)
+
+    def __str__(self):
+        return self.toString()
+
+    # Request building
+
+    def _child(self, name):
+
+        name = _str(name)
+
+        if not isinstance(self._value, dict):
+            raise InvalidStateException("Element '%s' is not a sequence or choice" % self._name)
+
+        if name not in self._value:
+            self._value[name] = [] if name in ARRAY_ELEMENTS else {}
+
+        return Element(name, self._value[name])
+
+    def setElement(self, name, value):
+        self._value[_str(name)] = value
+
+    def setChoice(self, name):
+        self._value.clear()
+        return self._child(name)
+
+    def appendElement(self):
+        if not isinstance(self._value, list):
+            raise InvalidStateException("Element '%s' is not an array" % self._name)
+        value = {}
+        self._value.append(value)
+        return Element(self._name, value)
+
+    def appendValue(self, value):
+        if not isinstance(self._value, list):
+            raise InvalidStateException("Element '%s' is not an array" % self._name)
+        self._value.append(value)
+
+    def setValue(self, value):
+        raise InvalidStateException("Cannot replace the value of '%s' in place" % self._name)
+
+
+def _format(name, value, level, spaces):
+
+    indent = " " * (level * spaces)
+
+    if isinstance(value, dict):
+        lines = [indent + name + " = {"]
+        for child, child_value in value.items():
+            lines.append(_format(child, child_value, level + 1, spaces))
+        lines.append(indent + "}")
+        return "\n".join(lines)
+
+    if isinstance(value, list):
+        lines = [indent + name + "[] = {"]
+        for item in value:
+            lines.append(_format(name, item, level + 1, spaces))
+        lines.append(indent + "}")
+        return "\n".join(lines)
+
+    if isinstance(value, str):
+        return indent + '%s = "%s"' % (name, value)
+
+    return indent + "%s = %s" % (name, value)
+
+
+class Message():
+
+    def __init__(self, message_type, data, correlation_ids=(), service=None):
+        self._type = Name(message_type) if not isinstance(message_type, Name) else message_type
+        self._data = data
+        self._correlation_ids = list(correlation_ids)
+        self._service = service
+
+    def messageType(self):
+        return self._type
+
+    def correlationIds(self):
+        return self._correlation_ids
+
+    def correlationId(self, index=0):
+        return self._correlation_ids[index] if self._correlation_ids else None
+
+    def service(self):
+        return self._service
+
+    def asElement(self):
+        return Element(self._type, self._data)
+
+    def hasElement(self, name, excludeNullElements=False):
+        return _str(name) in self._data
+
+    def getElement(self, name):
+        return self.asElement().getElement(name)
+
+    def getElementValue(self, name):
+        return self.asElement().getElementValue(name)
+
+    def getElementAsString(self, name):
+        return self.asElement().getElementAsString(name)
+
+    def getElementAsInteger(self, name):
+        return self.asElement().getElementAsInteger(name)
+
+    def getElementAsFloat(self, name):
+        return self.asElement().getElementAsFloat(name)
+
+    def getElementAsBool(self, name):
+        return self.asElement().getElementAsBool(name)
+
+    def getElementAsDatetime(self, name):
+        return self.asElement().getElementAsDatetime(name)
+
+    def numElements(self):
+        return len(self._data)
+
+    def toPy(self):
+        return self._data
+
+    def toString(self, level=0, spacesPerLevel=4):
+        return _format(str(self._type), self._data, level, spacesPerLevel)
+
+    tostring = toString
+
+    def __str__(self):
+        return self.toString()
+
+
+# ---------------------------------------------------------------------------------------------
+# Requests and services
+# ---------------------------------------------------------------------------------------------
+
+UNITS = ("Shares", "Local", "USD", "EUR", "GBP")
+SOURCES = ("Broker Contributed",)
+GROUP_BY = ("Broker", "Security")
+
+OPERATIONS = {
+    "//blp/rankapi": ("Query", "GroupQuery"),
+    "//blp/refdata": ("ReferenceDataRequest",),
+    "//blp/apiauth": ("AuthorizationRequest",),
+}
+
+
+class Request(Element):
+
+    __slots__ = ("_service",)
+
+    def __init__(self, service, operation):
+        super().__init__(operation, {})
+        self._service = service
+
+    def operation(self):
+        return self._name
+
+    def asElement(self):
+        return Element(self._name, self._value)
+
+    def set(self, name, value):
+
+        name = _str(name)
+
+        if name == "units" and value not in UNITS:
+            raise InvalidArgumentException("Invalid units '%s'" % value)
+        if name == "source" and value not in SOURCES:
+            raise InvalidArgumentException("Invalid source '%s'" % value)
+        if name == "groupBy" and value not in GROUP_BY:
+            raise InvalidArgumentException("Invalid groupBy '%s'" % value)
+
+        self._value[name] = value
+
+    def append(self, name, value):
+        self._child(name).appendValue(value)
+
+    def getElement(self, name):
+        return self._child(name)
+
+    def toString(self, level=0, spacesPerLevel=4):
+        return _format(self._name, self._value, level, spacesPerLevel)
+
+
+class Service():
+
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def numOperations(self):
+        return len(OPERATIONS[self._name])
+
+    def hasOperation(self, name):
+        return _str(name) in OPERATIONS[self._name]
+
+    def createRequest(self, operation):
+        operation = _str(operation)
+        if operation not in OPERATIONS[self._name]:
+            raise NotFoundException("Operation '%s' not found in service '%s'" % (operation, self._name))
+        return Request(self, operation)
+
+    def createAuthorizationRequest(self, authorizationOperation=None):
+        return Request(self, "AuthorizationRequest")
+
+
+class SessionOptions():
+
+    def __init__(self):
+        self._host = "localhost"
+        self._port = 8194
+        self._max_pending = 1024
+        self._max_queue = 10000
+        self._hi_water = 0.75
+        self._lo_water = 0.5
+
+    def setServerHost(self, host):
+        self._host = host
+
+    def setServerPort(self, port):
+        self._port = port
+
+    def serverHost(self):
+        return self._host
+
+    def serverPort(self):
+        return self._port
+
+    def setMaxPendingRequests(self, n):
+        self._max_pending = n
+
+    def setMaxEventQueueSize(self, n):
+        self._max_queue = n
+
+    def setSlowConsumerWarningHiWaterMark(self, mark):
+        self._hi_water = mark
+
+    def setSlowConsumerWarningLoWaterMark(self, mark):
+        self._lo_water = mark
+
+    def setAutoRestartOnDisconnection(self, value):
+        pass
+
+    def setNumStartAttempts(self, n):
+        pass
+
+
+class Identity():
+
+    def __init__(self):
+        self._authorized = False
+
+    def getSeatType(self):
+        return 0 if self._authorized else -1
+
+    def isAuthorized(self, service):
+        return self._authorized
+
+
+class EventDispatcher():
+
+    def __init__(self, numDispatcherThreads=1):
+        self._threads = max(1, numDispatcherThreads)
+
+    def start(self):
+        return 0
+
+    def stop(self, async_=False):
+        return 0
+
+
+# ---------------------------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------------------------
+
+SECTORS = ["Financial", "Energy", "Technology", "Consumer, Cyclical", "Consumer, Non-cyclical",
+           "Industrial", "Communications", "Basic Materials", "Utilities"]
+
+
+def _crc(s):
+    return zlib.crc32(s.encode("utf-8"))
+
+
+def _mix(x):
+
+    # splitmix64 over a uint64 array
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _uniform(seeds, salt):
+    return (_mix(seeds ^ np.uint64(salt)) >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def broker_list(count=None):
+    count = options.brokers if count is None else count
+    return [("BK%03d" % i, "Synthetic Broker %03d" % i) for i in range(count)]
+
+
+def universe(exchange="US", size=None):
+    size = options.universe_size if size is None else size
+    return ["SYN%05d %s Equity" % (i, exchange) for i in range(size)]
+
+
+def _day_seed(*parts):
+    return np.uint64(_crc("|".join(str(p)[:10] for p in parts)) ^ (options.seed << 32))
+
+
+def broker_volumes(tickers, day_seed, units="Shares"):
+
+    # Returns a (len(tickers), brokers, 8) array of bought, sold, traded, crossed, total,
+    # highTouch, lowTouch and numReports.
+
+    with np.errstate(over="ignore"):
+
+        n_brokers = options.brokers
+        sec = np.array([_crc(t) for t in tickers], dtype=np.uint64)
+
+        seeds = (sec[:, None] << np.uint64(20)) ^ np.arange(n_brokers, dtype=np.uint64)[None, :] ^ day_seed
+
+        adv = 1e4 * np.exp(6.0 * _uniform(sec, 0x11))
+        share = 1.0 / np.power(np.arange(1, n_brokers + 1, dtype=np.float64), 0.8)
+
+        volume = np.rint(adv[:, None] * share[None, :] * (0.5 + _uniform(seeds, 0x22)))
+        volume[_uniform(seeds, 0x33) < 0.2] = 0.0
+
+        if units != "Shares":
+            volume = np.rint(volume * (5.0 + 495.0 * _uniform(sec, 0x44))[:, None])
+
+        bought = np.rint(volume * _uniform(seeds, 0x55))
+        sold = volume - bought
+        crossed = np.rint(volume * 0.05 * _uniform(seeds, 0x66))
+        traded = bought + sold
+        total = traded + crossed
+        high_touch = np.rint(total * _uniform(seeds, 0x77))
+        low_touch = total - high_touch
+        num_reports = np.where(volume > 0, 1.0 + np.floor(50.0 * _uniform(seeds, 0x88)), 0.0)
+
+    return np.stack([bought, sold, traded, crossed, total, high_touch, low_touch, num_reports], axis=2)
+
+
+VALUE_NAMES = ("bought", "sold", "traded", "crossed", "total", "highTouch", "lowTouch", "numReports")
+
+
+def _ranked_records(values, brokers, security=None, only=None):
+
+    # values is a (brokers, 8) array; brokers with no activity are left out, the rest ranked by traded.
+
+    order = np.lexsort((np.arange(len(values)), -values[:, 2]))
+    records = []
+    rank = 0
+
+    for b in order.tolist():
+
+        if values[b, 2] <= 0:
+            continue
+
+        rank += 1
+
+        if only is not None and brokers[b][0] not in only:
+            continue
+
+        record = {}
+        if security is not None:
+            record["security"] = {"ticker": security}
+        record["broker"] = {"acronym": brokers[b][0], "name": brokers[b][1], "rank": rank}
+        for name, value in zip(VALUE_NAMES, values[b].tolist()):
+            record[name] = value
+
+        records.append(record)
+
+    return records
+
+
+def _securities(request):
+
+    criteria = request._value.get("securityCriteria", {})
+
+    if "exchanges" in criteria:
+        tickers = []
+        for exchange in criteria["exchanges"]:
+            tickers.extend(universe(exchange.get("code", "US")))
+        return tickers
+
+    return [security.get("ticker") or security.get("figi", "") for security in criteria.get("securities", [])]
+
+
+def _chunks(items, size):
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)] or [[]]
+
+
+def rank_query(request):
+
+    spec = request._value
+    tickers = _securities(request)
+    brokers = broker_list()
+    only = set(b["acronym"] for b in spec.get("brokers", []) if "acronym" in b) or None
+
+    start, end = str(spec.get("start"))[:10], str(spec.get("end", spec.get("start")))[:10]
+    values = broker_volumes(tickers, _day_seed(start) if start == end else _day_seed(start, end), spec.get("units", "Shares"))
+    stamp = datetime.utcnow()
+
+    if spec.get("groupBy", "Broker") == "Broker":
+        records = _ranked_records(values.sum(axis=0), brokers, only=only)
+    else:
+        records = []
+        for i, ticker in enumerate(tickers):
+            ranked = _ranked_records(values[i], brokers)
+            if not ranked:
+                continue
+            chosen = [r for r in ranked if only is None or r["broker"]["acronym"] in only]
+            record = dict(chosen[0] if chosen else ranked[0])
+            record["security"] = {"ticker": ticker}
+            record["topBrokers"] = [r["broker"] for r in ranked[:5]]
+            records.append(record)
+
+    return [("Report", {"timestampUtc": stamp, "records": chunk}) for chunk in _chunks(records, options.partial_size)]
+
+
+def rank_group_query(request):
+
+    spec = request._value
+    tickers = _securities(request)
+    brokers = broker_list()
+
+    values = broker_volumes(tickers, _day_seed(spec.get("date")), spec.get("units", "Shares"))
+    stamp = datetime.utcnow()
+
+    messages = []
+    current = []
+    size = 0
+
+    for i, ticker in enumerate(tickers):
+
+        records = _ranked_records(values[i], brokers)
+        current.append({"security": {"ticker": ticker}, "records": records})
+        size += len(records)
+
+        if size >= options.partial_size:
+            messages.append(("GroupReport", {"timestampUtc": stamp, "securities": current}))
+            current = []
+            size = 0
+
+    if current or not messages:
+        messages.append(("GroupReport", {"timestampUtc": stamp, "securities": current}))
+
+    return messages
+
+
+def reference_data(request, rng):
+
+    spec = request._value
+    fields = spec.get("fields", [])
+    security_data = []
+
+    for sequence, ticker in enumerate(spec.get("securities", [])):
+
+        if "INVALID" in ticker.upper():
+            security_data.append({"security": ticker, "sequenceNumber": sequence,
+                                  "securityError": {"source": "fake", "code": 15, "category": "BAD_SEC", "message": "Unknown/Invalid security"}})
+            continue
+
+        h = _crc(ticker)
+        field_data = {}
+
+        for field in fields:
+            if rng.random() < options.missing_field_rate:
+                continue
+            if field == "DS199":
+                field_data[field] = SECTORS[h % len(SECTORS)]
+            elif field == "PR088":
+                field_data[field] = round(5.0 + (h % 49500) / 100.0, 2)
+            else:
+                field_data[field] = float(h % 1000)
+
+        security_data.append({"security": ticker, "sequenceNumber": sequence, "fieldExceptions": [], "fieldData": field_data})
+
+    return [("ReferenceData", {"securityData": chunk}) for chunk in _chunks(security_data, max(1, options.partial_size // 10))]
+
+
+# ---------------------------------------------------------------------------------------------
+# Session
+# ---------------------------------------------------------------------------------------------
+
+class _Scheduler():
+
+    # A single timer thread shared by all sessions.
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_at(self, when, fn):
+        with self._cond:
+            heapq.heappush(self._heap, (when, next(self._counter), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="fakeBlpapi-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                when, _, fn = self._heap[0]
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            fn()
+
+
+_scheduler = _Scheduler()
+
+
+def _reset_after_fork():
+    # The timer thread does not survive fork(), so a forked worker (e.g. a multiprocessing
+    # pool) starts with a fresh scheduler.
+    global _scheduler
+    _scheduler = _Scheduler()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+_STOP = object()
+
+
+class Session():
+
+    def __init__(self, options=None, eventHandler=None, eventDispatcher=None):
+
+        self._options = options or SessionOptions()
+        self._handler = eventHandler
+        self._events = queue.Queue()
+        self._services = {}
+        self._started = False
+        self._stopped = False
+        self._rng = random.Random(globals()["options"].seed)
+        self._rng_lock = threading.Lock()
+        self._dispatchers = []
+        self._slow = False
+        self._slow_lock = threading.Lock()
+        self._cancelled = set()
+
+        if eventHandler is not None:
+            threads = eventDispatcher._threads if eventDispatcher is not None else 1
+            for i in range(threads):
+                t = threading.Thread(target=self._dispatch, name="fakeBlpapi-dispatcher-%d" % i, daemon=True)
+                t.start()
+                self._dispatchers.append(t)
+
+    # event delivery
+
+    def _push(self, event_type, messages):
+        if not self._stopped:
+            self._events.put(Event(event_type, messages))
+            self._check_water_marks()
+
+    def _check_water_marks(self):
+
+        # Like blpapi, raise SlowConsumerWarning once the queue passes the high water mark and
+        # SlowConsumerWarningCleared once it has drained below the low water mark.
+
+        size = options.event_queue_size or self._options._max_queue
+        depth = self._events.qsize()
+
+        with self._slow_lock:
+            if not self._slow and depth >= size * self._options._hi_water:
+                self._slow = True
+                message = "SlowConsumerWarning"
+            elif self._slow and depth <= size * self._options._lo_water:
+                self._slow = False
+                message = "SlowConsumerWarningCleared"
+            else:
+                return
+
+        self._events.put(Event(Event.ADMIN, [Message(message, {})]))
+
+    def _dispatch(self):
+        while True:
+            event = self._events.get()
+            if event is _STOP:
+                return
+            self._check_water_marks()
+            try:
+                self._handler(event, self)
+            except BaseException as e:
+                print("fakeBlpapi: event handler raised %r" % (e,), file=sys.stderr)
+
+    def nextEvent(self, timeout=0):
+
+        if self._handler is not None:
+            raise InvalidStateException("nextEvent() is not available with an event handler")
+
+        try:
+            event = self._events.get(timeout=timeout / 1000.0 if timeout else None)
+        except queue.Empty:
+            return Event(Event.TIMEOUT)
+
+        self._check_water_marks()
+
+        return event
+
+    def tryNextEvent(self):
+        try:
+            return self._events.get_nowait()
+        except queue.Empty:
+            return None
+
+    # lifecycle
+
+    def _start_events(self):
+        self._started = True
+        self._push(Event.SESSION_STATUS, [Message("SessionConnectionUp", {"server": "%s:%d" % (self._options.serverHost(), self._options.serverPort())})])
+        self._push(Event.SESSION_STATUS, [Message("SessionStarted", {})])
+
+    def start(self):
+        self._start_events()
+        return True
+
+    def startAsync(self):
+        self._start_events()
+        return True
+
+    def stop(self, *args):
+
+        if self._stopped:
+            return True
+
+        self._push(Event.SESSION_STATUS, [Message("SessionTerminated", {})])
+        self._stopped = True
+
+        for _ in self._dispatchers:
+            self._events.put(_STOP)
+
+        current = threading.current_thread()
+        for t in self._dispatchers:
+            if t is not current:
+                t.join(5)
+
+        return True
+
+    stopAsync = stop
+
+    def _open(self, name, cid):
+
+        if name not in OPERATIONS:
+            self._push(Event.SERVICE_STATUS, [Message("ServiceOpenFailure", {"serviceName": name}, [cid])])
+            return False
+
+        self._services[name] = Service(name)
+        self._push(Event.SERVICE_STATUS, [Message("ServiceOpened", {"serviceName": name}, [cid])])
+        return True
+
+    def openService(self, name):
+        return self._open(name, CorrelationId())
+
+    def openServiceAsync(self, name, correlationId=None):
+        cid = correlationId or CorrelationId()
+        self._open(name, cid)
+        return cid
+
+    def getService(self, name):
+        if name not in self._services:
+            raise NotFoundException("Service '%s' has not been opened" % name)
+        return self._services[name]
+
+    def createIdentity(self):
+        return Identity()
+
+    # requests
+
+    def _delay(self):
+        with self._rng_lock:
+            return options.latency + options.jitter * self._rng.random()
+
+    def _respond(self, cid, service, messages, delay):
+
+        when = time.monotonic() + delay
+
+        for i, (message_type, data) in enumerate(messages):
+            event_type = Event.RESPONSE if i == len(messages) - 1 else Event.PARTIAL_RESPONSE
+            message = Message(message_type, data, [cid], service)
+            _scheduler.call_at(when + i * options.partial_interval, lambda e=event_type, m=message: self._deliver(cid, e, m))
+
+    def _deliver(self, cid, event_type, message):
+        if cid.value() not in self._cancelled:
+            self._push(event_type, [message])
+
+    def cancel(self, correlationId):
+        # Like blpapi, nothing more is delivered for a cancelled request.
+        self._cancelled.add(correlationId.value())
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=""):
+
+        if not self._started or self._stopped:
+            raise InvalidStateException("Session is not started")
+
+        cid = correlationId if correlationId is not None else CorrelationId()
+        service = request._service
+
+        with self._rng_lock:
+            failed = self._rng.random() < options.error_rate
+            rng = random.Random(self._rng.random())
+
+        if failed:
+            messages = [("Exception", {"reason": {"source": "fakeBlpapi", "code": 1, "category": "INJECTED_ERROR", "message": "Injected failure"}})]
+        elif request.operation() == "Query":
+            messages = rank_query(request)
+        elif request.operation() == "GroupQuery":
+            messages = rank_group_query(request)
+        elif request.operation() == "ReferenceDataRequest":
+            messages = reference_data(request, rng)
+        else:
+            raise InvalidArgumentException("Unsupported operation '%s'" % request.operation())
+
+        self._respond(cid, service, messages, self._delay())
+
+        return cid
+
+    def sendAuthorizationRequest(self, request, identity, correlationId=None, eventQueue=None):
+
+        cid = correlationId if correlationId is not None else CorrelationId()
+
+        def authorize():
+            identity._authorized = True
+            self._push(Event.RESPONSE, [Message("AuthorizationSuccess", {}, [cid])])
+
+        _scheduler.call_at(time.monotonic() + self._delay(), authorize)
+
+        return cid
+
+
+def main(argv):
+
+    usage = 'fakeBlpapi.py [--latency s] [--jitter s] [--partial-interval s] [--partial-size n] [--error-rate p] [--missing-field-rate p] [--brokers n] [--universe n] [--seed n] [--event-queue-size n] <script.py> [script args]'
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["help", "latency=", "jitter=", "partial-interval=", "partial-size=", "error-rate=", "missing-field-rate=", "brokers=", "universe=", "seed=", "event-queue-size="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    settings = {}
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt == "--universe":
+            settings["universe_size"] = int(arg)
+        elif opt in ("--partial-size", "--brokers", "--seed", "--event-queue-size"):
+            settings[opt[2:].replace("-", "_")] = int(arg)
+        else:
+            settings[opt[2:].replace("-", "_")] = float(arg)
+
+    if not args:
+        print(usage)
+        sys.exit(2)
+
+    install(**settings)
+
+    script = args[0]
+    sys.argv = args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,359 @@
+# rankBenchmark.py
+
+'''
+Benchmarks the phases of rankDemoReport (import_securities, get_rank_data, get_position_data
+and generate_output) and three ways of decoding GroupReport records: the string-keyed element
+loop of rankDataGroupRequestSync, the same walk through the pre-resolved Names of
+rankapi.schema, and the toPy based columnar decoder, against the local fakeBlpapi stand-in
+service. The decode phases report records_per_sec for the per-record comparison. The delta
+phase times rankapi.delta.rank_delta over two days of the universe's GroupReports. --brokers
+sets the size of the synthetic broker list; fakeBlpapi ranks most brokers on every security, so
+keep the universe to a few thousand names with --brokers 1000.
+
+Universes range from the bundled security_universe_1/20/30.csv files up to synthetic
+10,000 name universes by default; add 100000 with -n for the exchange-sized case (this takes
+several minutes). Results are written as JSON so that two runs (e.g. from two commits) can
+be compared:
+
+    python rankBenchmark.py -o before.json
+    python rankBenchmark.py -o after.json --compare before.json
+
+With --compare, any phase that got slower by more than the threshold is reported and the
+process exits with status 1.
+'''
+
+import sys
+import getopt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import fakeBlpapi
+
+fakeBlpapi.install()
+
+import blpapi
+import rankDemoReport
+from rankapi.decoder import decode_group_report, concat_records
+from rankapi.delta import rank_delta
+from rankapi.schema import report_schema, decode_group_report_elements
+
+
+__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+BUNDLED_UNIVERSES = {1: "security_universe_1.csv", 20: "security_universe_20.csv", 30: "security_universe_30.csv"}
+DEFAULT_SIZES = [1, 20, 30, 10000]
+PHASES = ["import_securities", "get_rank_data", "get_position_data", "generate_output", "decode_elementwise", "decode_interned", "decode_columnar", "delta"]
+
+MIN_REGRESSION_SECONDS = 0.01 # ignore timing noise on phases that only take a few milliseconds
+
+BENCH_DATE = "2021-09-29"
+BENCH_PREVIOUS_DATE = "2021-09-28"
+BENCH_BROKER = "BK003"
+
+
+def universe_file(size, directory):
+
+    if size in BUNDLED_UNIVERSES:
+        return BUNDLED_UNIVERSES[size]
+
+    path = os.path.join(directory, "security_universe_%d.csv" % size)
+
+    if not os.path.exists(path):
+        with open(path, "w") as f:
+            f.write("Ticker\n")
+            for ticker in fakeBlpapi.universe("US", size):
+                f.write(ticker + "\n")
+
+    return path
+
+
+def decode_elementwise(msg):
+
+    # The per-record loop from rankDataGroupRequestSync, without the printing.
+
+    rows = []
+
+    for security in msg.getElement("securities").values():
+
+        ticker = security.getElement("security").getElement("ticker").getValueAsString()
+
+        for record in security.getElement("records").values():
+
+            brokerAcronym = record.getElement("broker").getElement("acronym").getValueAsString()
+            brokerName = record.getElement("broker").getElement("name").getValueAsString()
+            brokerRank = record.getElement("broker").getElement("rank").getValueAsInteger()
+
+            bought = record.getElementAsFloat("bought")
+            sold = record.getElementAsFloat("sold")
+            traded = record.getElementAsFloat("traded")
+            crossed = record.getElementAsFloat("crossed")
+            total = record.getElementAsFloat("total")
+            highTouch = record.getElementAsFloat("highTouch")
+            lowTouch = record.getElementAsFloat("lowTouch")
+            numReports = record.getElementAsFloat("numReports")
+
+            rows.append((ticker, brokerAcronym, brokerName, brokerRank, bought, sold, traded, crossed, total, highTouch, lowTouch, numReports))
+
+    return rows
+
+
+def group_report_messages(session, tickers, iso_date=BENCH_DATE):
+
+    request = session.getService("//blp/rankapi").createRequest("GroupQuery")
+    request.set("date", iso_date)
+    sec_el = request.getElement("securityCriteria").setChoice("securities")
+    for ticker in tickers:
+        sec_el.appendElement().setElement("ticker", ticker)
+
+    return [blpapi.Message(message_type, data) for message_type, data in fakeBlpapi.rank_group_query(request)]
+
+
+def timed(fn):
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = fn()
+
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def run_size(session, size, phases, repeat, settings, directory):
+
+    results = []
+
+    def record(phase, samples, records=None):
+        wall = [w for w, _ in samples]
+        cpu = [c for _, c in samples]
+        result = {"phase": phase, "universe": size, "repeat": len(samples),
+                  "wall_median": statistics.median(wall), "wall_min": min(wall), "cpu_median": statistics.median(cpu)}
+        if records is not None:
+            result["records"] = records
+            result["records_per_sec"] = records / result["wall_median"] if result["wall_median"] > 0 else None
+        results.append(result)
+
+    sec_file = universe_file(size, directory)
+    securities = rankDemoReport.import_securities(sec_file)
+
+    if "import_securities" in phases:
+        samples = []
+        for _ in range(repeat):
+            _, wall, cpu = timed(lambda: rankDemoReport.import_securities(sec_file))
+            samples.append((wall, cpu))
+        record("import_securities", samples)
+
+    rank_data = position_data = None
+    overall_total = 0
+
+    if "get_rank_data" in phases:
+        samples = []
+        for _ in range(repeat):
+            (rank_data, success), wall, cpu = timed(lambda: rankDemoReport.get_rank_data(session, securities, BENCH_DATE, BENCH_BROKER, [], settings["pipeline"], settings["group_query"]))
+            if not success:
+                raise RuntimeError("get_rank_data failed")
+            samples.append((wall, cpu))
+        record("get_rank_data", samples)
+
+    if "get_position_data" in phases:
+        samples = []
+        for _ in range(repeat):
+            (position_data, overall_total, success), wall, cpu = timed(lambda: rankDemoReport.get_position_data(session, securities, BENCH_DATE, BENCH_BROKER, max_in_flight=settings["pipeline"]))
+            if not success:
+                raise RuntimeError("get_position_data failed")
+            samples.append((wall, cpu))
+        record("get_position_data", samples)
+
+    if "generate_output" in phases and rank_data is not None and position_data:
+        output_file = os.path.join(directory, "bench_%d.pdf" % size)
+        samples = []
+        for _ in range(repeat):
+            _, wall, cpu = timed(lambda: rankDemoReport.generate_output(output_file, position_data, rank_data, overall_total, BENCH_DATE))
+            samples.append((wall, cpu))
+        record("generate_output", samples)
+
+    if any(phase.startswith("decode_") for phase in phases):
+
+        messages = group_report_messages(session, [s[0] for s in securities])
+        n_records = sum(len(security["records"]) for msg in messages for security in msg.toPy()["securities"])
+
+        schema = report_schema(session.getService("//blp/rankapi"))
+        decoders = (("decode_elementwise", decode_elementwise),
+                    ("decode_interned", lambda msg: decode_group_report_elements(msg, schema)),
+                    ("decode_columnar", decode_group_report))
+
+        for phase, decode in decoders:
+            if phase not in phases:
+                continue
+            samples = []
+            for _ in range(repeat):
+                _, wall, cpu = timed(lambda: [decode(msg) for msg in messages])
+                samples.append((wall, cpu))
+            record(phase, samples, n_records)
+
+    if "delta" in phases:
+
+        tickers = [s[0] for s in securities]
+        before = concat_records([decode_group_report(msg) for msg in group_report_messages(session, tickers, BENCH_PREVIOUS_DATE)])
+        after = concat_records([decode_group_report(msg) for msg in group_report_messages(session, tickers, BENCH_DATE)])
+
+        samples = []
+        for _ in range(repeat):
+            _, wall, cpu = timed(lambda: rank_delta(before, after))
+            samples.append((wall, cpu))
+        record("delta", samples, len(before) + len(after))
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=__location__, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results, baseline_file, threshold):
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+
+    before = {(r["phase"], r["universe"]): r for r in baseline["results"]}
+    regressions = []
+
+    print("\nComparison with %s (%s):" % (baseline_file, baseline.get("revision", "")[:12]))
+
+    for r in results:
+        b = before.get((r["phase"], r["universe"]))
+        if b is None or b["wall_median"] <= 0:
+            continue
+        ratio = r["wall_median"] / b["wall_median"]
+        flag = ""
+        if ratio > 1.0 + threshold and r["wall_median"] - b["wall_median"] > MIN_REGRESSION_SECONDS:
+            flag = "  REGRESSION"
+            regressions.append(r)
+        print("  %-20s %8d names  %9.4fs -> %9.4fs  x%.2f%s" % (r["phase"], r["universe"], b["wall_median"], r["wall_median"], ratio, flag))
+
+    return regressions
+
+
+def main(argv):
+
+    sizes = DEFAULT_SIZES
+    phases = PHASES
+    repeat = 3
+    output_file = ''
+    baseline_file = ''
+    threshold = 0.2
+    settings = {"pipeline": 16, "group_query": False, "latency": 0.0}
+
+    usage = 'rankBenchmark.py [-n <sizes, e.g. 1,20,30,10000>] [--phases <list>] [-r <repeat>] [-p <in flight>] [--group-query] [--latency <s>] [--brokers <n>] [-o <results.json>] [--compare <baseline.json>] [--threshold <fraction>]'
+
+    try:
+        opts, args = getopt.getopt(argv, "hn:r:p:o:", ["help", "sizes=", "phases=", "repeat=", "pipeline=", "group-query", "latency=", "brokers=", "output=", "compare=", "threshold="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-n", "--sizes"):
+            sizes = [int(n) for n in arg.split(",")]
+        elif opt == "--phases":
+            phases = arg.split(",")
+        elif opt in ("-r", "--repeat"):
+            repeat = int(arg)
+        elif opt in ("-p", "--pipeline"):
+            settings["pipeline"] = int(arg)
+        elif opt == "--group-query":
+            settings["group_query"] = True
+        elif opt == "--latency":
+            settings["latency"] = float(arg)
+        elif opt == "--brokers":
+            settings["brokers"] = int(arg)
+        elif opt in ("-o", "--output"):
+            output_file = arg
+        elif opt == "--compare":
+            baseline_file = arg
+        elif opt == "--threshold":
+            threshold = float(arg)
+
+    fakeBlpapi.configure(latency=settings["latency"])
+    if "brokers" in settings:
+        fakeBlpapi.configure(brokers=settings["brokers"])
+
+    session = blpapi.Session(blpapi.SessionOptions())
+    session.start()
+    session.openService("//blp/rankapi")
+    session.openService("//blp/refdata")
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        # keep the report's progress output out of the timings table
+        stdout = sys.stdout
+
+        for size in sizes:
+            print("Universe of %d securities:" % size)
+            sys.stdout = open(os.devnull, "w")
+            try:
+                for result in run_size(session, size, phases, repeat, settings, directory):
+                    results.append(result)
+                    stdout.write("  %-20s %8d names  wall %9.4fs  cpu %9.4fs\n" % (result["phase"], size, result["wall_median"], result["cpu_median"]))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+    session.stop()
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": settings,
+        "repeat": repeat,
+        "results": results,
+    }
+
+    if output_file != '':
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Results written to", output_file)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if baseline_file != '':
+        if compare(results, baseline_file, threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    print("Bloomberg - RANK API Demo Report - rankBenchmark")
+    main(sys.argv[1:])
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -4,36 +4,49 @@ import blpapi
 import sys
 import datetime
 import os
+import getopt
+import threading
+from rankapi.completion import Completion, RequestFailed, ResponseTracker
+from rankapi.workqueue import WorkQueue
+from rankapi.metrics import metrics
+from rankapi.decoder import concat_records
+from rankapi.export import ParquetExport
+from rankapi.spec import group_query_spec, build_request
+from rankapi.store import RankStore, universe_key
+from rankapi.schema import report_schema, decode_group_report_elements
+from rankapi.names import (SESSION_STARTED, SESSION_STARTUP_FAILURE, SESSION_CONNECTION_UP,
+                           SESSION_CONNECTION_DOWN, SESSION_TERMINATED, SERVICE_OPENED,
+                           SERVICE_OPEN_FAILURE, SERVICE_DOWN, SLOW_CONSUMER_WARNING,
+                           SLOW_CONSUMER_WARNING_CLEARED, EXCEPTION, GROUPREPORT)
 
 # for additional DEBUG logging
 #os.environ['BLPAPI_LOGLEVEL'] = 'DEBUG'
 
-SESSION_STARTED                 = blpapi.Name("SessionStarted")
-SESSION_STARTUP_FAILURE         = blpapi.Name("SessionStartupFailure")
-SESSION_CONNECTION_UP           = blpapi.Name("SessionnConnectionUp")
-SESSION_CONNECTION_DOWN         = blpapi.Name("SessionConnectionDown")
-SESSION_TERMINATED              = blpapi.Name("SessionTerminated")
-
-SERVICE_OPENED                  = blpapi.Name("ServiceOpened")
-SERVICE_OPEN_FAILURE            = blpapi.Name("ServiceOpenFailure")
-SERVICE_DOWN                    = blpapi.Name("ServiceDown")
-
-SLOW_CONSUMER_WARNING           = blpapi.Name("SlowConsumerWarning")
-SLOW_CONSUMER_WARNING_CLEARED   = blpapi.Name("SlowConsumerWarningCleared")
-
-EXCEPTION                       = blpapi.Name("Exception")
-GROUPREPORT                     = blpapi.Name("GroupReport")
-  
 # production service
 d_service="//blp/rankapi"
 
 d_host="localhost"
 d_port=8194
-
-bEnd=False
+d_timeout=60 # seconds to wait for the request to complete
+d_workers=2 # threads decoding response messages off the dispatcher thread
+d_queue_depth=64 # messages waiting for a worker before the dispatcher thread is held back
+d_dispatcher_threads=1 # threads blpapi uses to call processEvent; see -t
+d_date=datetime.date(2021, 9, 29)
+d_securities=["IBM US Equity", "MSFT US Equity", "VOD LN Equity"]
 
 class SessionEventHandler():
 
+    def __init__(self):
+        self.completion = Completion()
+        self.lock = threading.Lock()    # guards requestID, response and timer, which any dispatcher thread may read
+        self.requestID = None
+        self.response = None
+        self.timer = None
+        self.export = None              # ParquetExport the records are also written to; see -e
+        self.parts = None               # decoded records of each GroupReport, kept for the RankStore; see -r
+        self.schema = None              # element Names of the service's responses, see rankapi.schema
+        self.work = WorkQueue(d_workers, d_queue_depth, on_error=lambda e: self.completion.fail("Error processing response: %s" % e))
+
     def processEvent(self, event, session):
         try:
             if event.eventType() == blpapi.Event.SESSION_STATUS:
@@ -44,25 +57,31 @@ class SessionEventHandler():
 
             elif event.eventType() == blpapi.Event.RESPONSE or event.eventType() == blpapi.Event.PARTIAL_RESPONSE:
                 self.processResponseEvent(event)
+
+            elif event.eventType() == blpapi.Event.ADMIN:
+                self.processAdminEvents(event)
             
             else:
                 self.processMiscEvents(event)
                 
         except:
             print ("Exception:  %s" % sys.exc_info()[0])
+            self.completion.fail("Exception in event handler: %s" % sys.exc_info()[1])
             
         return False
 
-    # only relevant for subscription service
+    # Slow consumer warnings are raised when blpapi's event queue backs up; no new requests are sent until it clears
     def processAdminEvents(self, event):
             print ("Processing ADMIN event")
 
             for msg in event:
                 if msg.messageType() == SLOW_CONSUMER_WARNING:
-                    print ("Warning: Entered Slow Consumer status")
+                    print ("Warning: Entered Slow Consumer status (%d messages waiting for a worker)" % self.work.depth())
+                    self.work.pause()
 
                 elif msg.messageType() == SLOW_CONSUMER_WARNING_CLEARED:
-                    sys.stderr.write("Slow Consumer status cleared")
+                    print ("Slow Consumer status cleared")
+                    self.work.resume()
                 
                 else:
                     print(msg)                 
@@ -77,10 +96,12 @@ class SessionEventHandler():
                 session.openServiceAsync(d_service)
             
             elif msg.messageType() == SESSION_STARTUP_FAILURE:
-                print >> sys.stderr, ("Error: Session startup failed")
+                print ("Error: Session startup failed", file=sys.stderr)
+                self.completion.fail("Session startup failed")
             
             elif msg.messageType() == SESSION_TERMINATED:
                 print ("Session has been terminated")
+                self.completion.fail("Session terminated")
             
             elif msg.messageType() == SESSION_CONNECTION_UP:
                 print ("Session connection is up")
@@ -101,31 +122,28 @@ class SessionEventHandler():
             if msg.messageType() == SERVICE_OPENED:
                 print ("Service opened...")
                 service = session.getService(d_service)
+                self.schema = report_schema(service)
                 
-                # build request
-                request = service.createRequest("GroupQuery")
-                
-                ### set date/time range
-                request.set("date", datetime.datetime(2021, 9, 29, 0, 0, 0, 0)) 
-                            
-                ### units enum 0=Shares, 1=Local, 2=USD, 3=EUR, 4=GBP
-                request.set("units", "Shares")             
+                # describe the request; rankStore.py builds its GroupQuery requests the same way
+                spec = group_query_spec(
+                    ### securities can be set to Bloomberg tickers
+                    d_securities,
+
+                    ### set date
+                    d_date.isoformat(),
+
+                    ### units enum 0=Shares, 1=Local, 2=USD, 3=EUR, 4=GBP
+                    units="Shares",
 
-                ### source enum 0=Broker Contributed
-                request.set("source", "Broker Contributed")
+                    ### source enum 0=Broker Contributed
+                    source="Broker Contributed")
 
+                request = build_request(service, spec)
 
-                ### exchanges or securities 
-                # exchanges can be set using Bloomberg exchange code 
+                ### exchanges can be set using Bloomberg exchange code instead of securities
                 #exchanges = request.getElement("securityCriteria").setChoice("exchanges")
                 #exchange = exchanges.appendElement()
                 #exchange.setElement("code", "US");
-            
-                ### securities can be set to either Bloomberg ticker or figi
-                securities = request.getElement("securityCriteria").setChoice("securities")
-                securities.appendElement().setElement("ticker", "IBM US Equity")
-                securities.appendElement().setElement("ticker", "MSFT US Equity")
-                securities.appendElement().setElement("ticker", "VOD LN Equity")
 
                 # figi can be used instead of ticker
                 #security.setElement("figi", "BBG000B9XRY4"); # figi for AAPL US Equity
@@ -133,81 +151,144 @@ class SessionEventHandler():
                 print ("Sending Request: %s" % request.toString())
 
                 #self.requestID = session.sendRequest(request)
-                
-                self.requestID = blpapi.CorrelationId()
-                session.sendRequest(request, correlationId=self.requestID)
-                
-                print ("RANK data group request sent.")
+
+                requestID = blpapi.CorrelationId()
+
+                with self.lock:
+                    self.requestID, self.response = requestID, ResponseTracker(self.completion)
+
+                def send(request=request):
+                    with self.lock:
+                        self.timer = metrics.start("GroupQuery")
+                    session.sendRequest(request, correlationId=requestID)
+                    print ("RANK data group request sent.")
+
+                # held back while the session is in Slow Consumer status
+                self.work.when_resumed(send)
 
             elif msg.messageType() == SERVICE_OPEN_FAILURE:
-                print >> sys.stderr, ("Error: Service failed to open")
-                bEnd=True
+                print ("Error: Service failed to open", file=sys.stderr)
+                self.completion.fail("Service failed to open")
 
             elif msg.messageType() == SERVICE_DOWN:
                 print ("Service down")
-                bEnd=True
+                self.completion.fail("Service down")
                 
 
 
     def processResponseEvent(self, event):
         print ("Processing RESPONSE event")
 
+        final = event.eventType() == blpapi.Event.RESPONSE
+
         for msg in event:
             # for printing raw message
             #print(msg)
 
-            if msg.correlationIds()[0].value() == self.requestID.value():
+            # With several dispatcher threads the final message may be handled before earlier ones
+            # have been handed to a worker, so each message is registered as it is looked up.
+            with self.lock:
+                requestID, response, timer = self.requestID, self.response, self.timer
+                if requestID is None or msg.correlationIds()[0].value() != requestID.value():
+                    continue
+                response.enter()
+
+            try:
+                timer.received(final)
+
                 print ("MESSAGE TYPE: %s" % msg.messageType())
 
                 if msg.messageType() == EXCEPTION:
                     print (msg)
                     print ("Exception occured")    
+                    self.completion.fail("Exception occured")
                 
                 elif msg.messageType() == GROUPREPORT:
-                    ts = msg.getElementAsDatetime("timestampUtc")
-                    print ("Timestamp: ", ts)
-                    print ("Message: \n", msg)
-
-                    securities = msg.getElement("securities")
+                    # the records are walked on a worker thread, leaving the dispatcher thread free
+                    self.work.submit(self.processGroupReport, msg, timer)
 
-                    for security in securities.values():
+            finally:
+                if response.leave(final):
+                    response.finish()
                         
-                        ticker = security.getElement("security").getElement("ticker").getValueAsString()
-                        print("Ticker: ", ticker)
 
-                        records = security.getElement("records")
+    def processGroupReport(self, msg, timer):
 
-                        for record in records.values():
+        # Runs on a worker thread. Output is built up and printed in one go, so that reports
+        # handled by different workers do not interleave.
 
-                            brokerAcronym = record.getElement("broker").getElement("acronym").getValueAsString()
-                            brokerName = record.getElement("broker").getElement("name").getValueAsString()
-                            brokerRank = record.getElement("broker").getElement("rank").getValueAsInteger()
+        ts = msg.getElementAsDatetime("timestampUtc")
+        lines = ["Timestamp: %s" % ts, "Message: \n%s" % msg]
 
-                            bought = record.getElementAsFloat("bought")
-                            sold = record.getElementAsFloat("sold")
-                            traded = record.getElementAsFloat("traded")
-                            crossed = record.getElementAsFloat("crossed")
-                            total = record.getElementAsFloat("total")
-                            highTouch = record.getElementAsFloat("highTouch")
-                            lowTouch = record.getElementAsFloat("lowTouch")
-                            numReports = record.getElementAsFloat("numReports")
+        # the element Names were resolved once, when the service opened
+        schema = self.schema
+        layout = schema.values_layout(msg)
+
+        for security in msg.getElement(schema.securities).values():
+            
+            ticker = security.getElement(schema.security).getElementAsString(schema.ticker)
+            lines.append("Ticker: %s" % ticker)
+
+            records = security.getElement(schema.records)
+            timer.decoded(records.numValues())
+
+            for record in records.values():
+
+                broker = record.getElement(schema.broker)
+                brokerAcronym = broker.getElementAsString(schema.acronym)
+                brokerName = broker.getElementAsString(schema.name)
+                brokerRank = broker.getElementAsInteger(schema.rank)
+
+                bought, sold, traded, crossed, total, highTouch, lowTouch, numReports = schema.read_values(record, layout)
+
+                lines.append(f"\tBroker: [{brokerAcronym}] {brokerName} Rank: {brokerRank} Bought: {bought} Sold: {sold} Traded: {traded} Crossed: {crossed} Total: {total} High Touch: {highTouch} Low Touch: {lowTouch} Count: {numReports}")
+
+        if self.export is not None or self.parts is not None:
+            records = decode_group_report_elements(msg, schema)
+            if self.export is not None:
+                self.export.write(records)
+            if self.parts is not None:
+                with self.lock:
+                    self.parts.append(records)
+
+        print ("\n".join(lines))
 
-                            print (f"\tBroker: [{brokerAcronym}] {brokerName} Rank: {brokerRank} Bought: {bought} Sold: {sold} Traded: {traded} Crossed: {crossed} Total: {total} High Touch: {highTouch} Low Touch: {lowTouch} Count: {numReports}")
-                        
-                
-                global bEnd
-                bEnd = True    
-                        
 
     def processMiscEvents(self, event):
-        print ("Processing " + event.eventType() + " event")
+        print ("Processing %s event" % event.eventType())
 
         for msg in event:
 
             print ("MESSAGE: %s" % (msg.toString()))
 
 
-def main():
+def main(argv):
+
+    dispatcherThreads = d_dispatcher_threads
+    metricsFile = ''
+    exportFile = ''
+    storeDir = ''
+
+    usage = 'rankDataGroupRequest.py [-t <dispatcher threads>] [-m <metrics file (.json or Prometheus text)>] [-e <Parquet export file>] [-r <rank store directory>]'
+
+    try:
+        opts, args = getopt.getopt(argv, "ht:m:e:r:", ["help", "dispatcher-threads=", "metrics=", "export=", "store="])
+    except getopt.GetoptError:
+        print (usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print (usage)
+            sys.exit()
+        elif opt in ("-t", "--dispatcher-threads"):
+            dispatcherThreads = int(arg)
+        elif opt in ("-m", "--metrics"):
+            metricsFile = arg
+        elif opt in ("-e", "--export"):
+            exportFile = arg
+        elif opt in ("-r", "--store"):
+            storeDir = arg
 
     # Session options are used to create the connectivity through to Bloomberg.
     sessionOptions = blpapi.SessionOptions()
@@ -218,22 +299,74 @@ def main():
 
     eventHandler = SessionEventHandler() # We are using the asynchronous paradigm in this example, therefore we are using an event handler.
 
-    session = blpapi.Session(sessionOptions, eventHandler.processEvent)
+    if exportFile != '':
+        # each report is added to the file by the worker that decodes it
+        eventHandler.export = ParquetExport(exportFile)
+
+    if storeDir != '':
+        eventHandler.parts = []
+
+    # With more than one dispatcher thread, independent events are handled in parallel.
+    eventDispatcher = blpapi.EventDispatcher(numDispatcherThreads=dispatcherThreads)
+    eventDispatcher.start()
+
+    session = blpapi.Session(sessionOptions, eventHandler.processEvent, eventDispatcher)
 
     if not session.startAsync():
         print ("Failed to start session.")
+        eventDispatcher.stop()
         return
 
-    global bEnd
-    while bEnd==False:
-        pass
+    try:
+        eventHandler.completion.wait(d_timeout)
+        eventHandler.response.wait(d_timeout) # every message has been handed to a worker
+        eventHandler.work.join() # the last messages may still be with the workers
+    except (TimeoutError, RequestFailed) as e:
+        print ("Error: %s" % e, file=sys.stderr)
+
+    print ("Work queue: %s" % eventHandler.work.stats())
+
+    # A worker that fails after the final message has set the completion cannot fail it any more,
+    # so the request only succeeded if no worker failed either.
+    failed = not eventHandler.completion.done() or eventHandler.completion.failed() or eventHandler.work.errors > 0
+
+    if eventHandler.work.errors > 0:
+        print ("Error: %d response messages could not be processed" % eventHandler.work.errors, file=sys.stderr)
+
+    # the request is only over once the workers have decoded every message
+    if eventHandler.timer is not None:
+        eventHandler.timer.finished(failed=failed)
+
+    if eventHandler.export is not None:
+        if not failed:
+            eventHandler.export.close()
+            print ("Exported %d records to %s" % (eventHandler.export.rows, exportFile))
+        else:
+            eventHandler.export.abort()
+
+    if eventHandler.parts is not None:
+        if not failed:
+            # the day's GroupReports become that date's partition of the store
+            count = RankStore(storeDir).append(d_date.isoformat(), concat_records(eventHandler.parts), universe_key(d_securities))
+            print ("Stored %d records for %s in %s" % (count, d_date.isoformat(), storeDir))
+        else:
+            # a partial day is never stored, so that a later sync still fetches it
+            print ("Error: %s not stored in %s" % (d_date.isoformat(), storeDir), file=sys.stderr)
+
+    print ("Request metrics:\n%s" % metrics.summary())
+    if metricsFile != '':
+        metrics.write(metricsFile)
     
     session.stop()
+    eventDispatcher.stop()
+
+    if failed and storeDir != '':
+        sys.exit(2)
     exit()
 
 if __name__ == "__main__":
     print ("Bloomberg - RANK API Example - rankDataGroupRequst")
-    main()
+    main(sys.argv[1:])
 
 
 __copyright__ = """
@@ -256,6 +389,3 @@ IN THE SOFTWARE.
 """
 
 
-
-
-
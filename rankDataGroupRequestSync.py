@@ -1,26 +1,20 @@
 # rankDataGroupRequestSync.py
 
-import blpapi
+'''
+Sends a RANK API GroupQuery on a synchronous session and prints the GroupReport.
+
+run(session) can also be called in-process with any started blpapi session; importing this
+module does not import blpapi or connect to anything.
+'''
+
 import sys
 import datetime
 import os
+import getopt
+from rankapi import names
+from rankapi.decoder import decode_group_report
+from rankapi.metrics import metrics
 
-
-SESSION_STARTED                 = blpapi.Name("SessionStarted")
-SESSION_STARTUP_FAILURE         = blpapi.Name("SessionStartupFailure")
-SESSION_CONNECTION_UP           = blpapi.Name("SessionnConnectionUp")
-SESSION_CONNECTION_DOWN         = blpapi.Name("SessionConnectionDown")
-SESSION_TERMINATED              = blpapi.Name("SessionTerminated")
-
-SERVICE_OPENED                  = blpapi.Name("ServiceOpened")
-SERVICE_OPEN_FAILURE            = blpapi.Name("ServiceOpenFailure")
-SERVICE_DOWN                    = blpapi.Name("ServiceDown")
-
-SLOW_CONSUMER_WARNING           = blpapi.Name("SlowConsumerWarning")
-SLOW_CONSUMER_WARNING_CLEARED   = blpapi.Name("SlowConsumerWarningCleared")
-
-EXCEPTION                       = blpapi.Name("Exception")
-GROUPREPORT                     = blpapi.Name("GroupReport")
   
 # production service
 d_service="//blp/rankapi"
@@ -28,121 +22,163 @@ d_service="//blp/rankapi"
 d_host="localhost"
 d_port=8194
 
-bEnd=False
 
+def build_group_query(service):
 
-print ("Bloomberg - RANK API Example - rankDataGroupRequestSync")
+    request = service.createRequest("GroupQuery")
 
-# Session options are used to create the connectivity through to Bloomberg.
-sessionOptions = blpapi.SessionOptions()
-sessionOptions.setServerHost(d_host) # This represents the chose connectivity method. In this case, we are using Desktop API, so the host is 'localhost'
-sessionOptions.setServerPort(d_port) # The default port is 8194.
-    
-print ("Connecting to %s:%d" % (d_host, d_port))
+    ### set date/time range
+    request.set("date", datetime.datetime(2021, 9, 29, 0, 0, 0, 0)) 
+                
+    ### units enum 0=Shares, 1=Local, 2=USD, 3=EUR, 4=GBP
+    request.set("units", "Shares")             
 
-# Create a Session
-session = blpapi.Session(sessionOptions)
+    ### source enum 0=Broker Contributed
+    request.set("source", "Broker Contributed")
 
-# Start a Session
-if not session.start():
-    print("Failed to start session.")
-    exit(-1)
 
-# Open service 
-if not session.openService("//blp/rankapi"):
-    print("Failed to open RANK API service")
-    exit(-1)
+    ### exchanges or securities 
+    # exchanges can be set using Bloomberg exchange code 
+    #exchanges = request.getElement("securityCriteria").setChoice("exchanges")
+    #exchange = exchanges.appendElement()
+    #exchange.setElement("code", "US");
 
-print ("Service opened...")
-service = session.getService(d_service)
+    ### securities can be set to either Bloomberg ticker or figi
+    securities = request.getElement("securityCriteria").setChoice("securities")
+    securities.appendElement().setElement("ticker", "IBM US Equity")
+    securities.appendElement().setElement("ticker", "MSFT US Equity")
+    securities.appendElement().setElement("ticker", "VOD LN Equity")
 
-# build request
-request = service.createRequest("GroupQuery")
+    # figi can be used instead of ticker
+    #security.setElement("figi", "BBG000B9XRY4"); # figi for AAPL US Equity
 
-### set date/time range
-request.set("date", datetime.datetime(2021, 9, 29, 0, 0, 0, 0)) 
-            
-### units enum 0=Shares, 1=Local, 2=USD, 3=EUR, 4=GBP
-request.set("units", "Shares")             
+    return request
 
-### source enum 0=Broker Contributed
-request.set("source", "Broker Contributed")
 
+def print_group_report(msg):
 
-### exchanges or securities 
-# exchanges can be set using Bloomberg exchange code 
-#exchanges = request.getElement("securityCriteria").setChoice("exchanges")
-#exchange = exchanges.appendElement()
-#exchange.setElement("code", "US");
+    ts = msg.getElementAsDatetime("timestampUtc")
+    print ("Timestamp: ", ts)
+    #print ("Message: \n", msg)
 
-### securities can be set to either Bloomberg ticker or figi
-securities = request.getElement("securityCriteria").setChoice("securities")
-securities.appendElement().setElement("ticker", "IBM US Equity")
-securities.appendElement().setElement("ticker", "MSFT US Equity")
-securities.appendElement().setElement("ticker", "VOD LN Equity")
+    records = decode_group_report(msg)
 
-# figi can be used instead of ticker
-#security.setElement("figi", "BBG000B9XRY4"); # figi for AAPL US Equity
+    ticker = None
+    for security, brokerAcronym, brokerName, brokerRank, bought, sold, traded, crossed, total, highTouch, lowTouch, numReports in records.rows():
 
-print ("Sending Request: %s" % request.toString())
+        if security != ticker:
+            ticker = security
+            print("Ticker: ", ticker)
 
-requestID = session.sendRequest(request)
+        print (f"\tBroker: [{brokerAcronym}] {brokerName} Rank: {brokerRank} Bought: {bought} Sold: {sold} Traded: {traded} Crossed: {crossed} Total: {total} High Touch: {highTouch} Low Touch: {lowTouch} Count: {numReports}")
 
-print ("RANK group request sent.")
+    return records
 
-done = False
-while not done:
-    
-    event = session.nextEvent(1000)
 
-    if event.eventType() == blpapi.Event.RESPONSE:
+def run(session):
 
-        for msg in event:
-            # for printing raw message
-            #print(msg)
+    # Sends the GroupQuery on a started session and prints the response. Returns True on success.
 
-            if msg.correlationIds()[0].value() == requestID.value():
-                print ("MESSAGE TYPE: %s" % msg.messageType())
+    import blpapi
 
-                if msg.messageType() == EXCEPTION:
-                    print (msg)
-                    print ("Exception occured")    
-                    done = True
-                
-                elif msg.messageType() == GROUPREPORT:
-                    ts = msg.getElementAsDatetime("timestampUtc")
-                    print ("Timestamp: ", ts)
-                    #print ("Message: \n", msg)
+    # Open service 
+    if not session.openService(d_service):
+        print("Failed to open RANK API service")
+        return False
+
+    print ("Service opened...")
+    service = session.getService(d_service)
+
+    request = build_group_query(service)
+
+    print ("Sending Request: %s" % request.toString())
+
+    timer = metrics.start("GroupQuery")
+    requestID = session.sendRequest(request)
+
+    print ("RANK group request sent.")
+
+    while True:
+        
+        event = session.nextEvent(1000)
+
+        # a large GroupReport arrives as PARTIAL_RESPONSE messages ahead of the final RESPONSE
+        if event.eventType() in (blpapi.Event.RESPONSE, blpapi.Event.PARTIAL_RESPONSE):
+
+            final = event.eventType() == blpapi.Event.RESPONSE
 
-                    securities = msg.getElement("securities")
+            for msg in event:
+                # for printing raw message
+                #print(msg)
 
-                    for security in securities.values():
-                        
-                        ticker = security.getElement("security").getElement("ticker").getValueAsString()
-                        print("Ticker: ", ticker)
+                if msg.correlationIds()[0].value() == requestID.value():
+                    print ("MESSAGE TYPE: %s" % msg.messageType())
+                    timer.received(final=final)
 
-                        records = security.getElement("records")
+                    if msg.messageType() == names.EXCEPTION:
+                        print (msg)
+                        print ("Exception occured")    
+                        timer.finished(failed=True)
+                        return False
+                    
+                    elif msg.messageType() == names.GROUPREPORT:
+                        timer.decoded(print_group_report(msg))
 
-                        for record in records.values():
+            if final:
+                timer.finished()
+                return True
 
-                            brokerAcronym = record.getElement("broker").getElement("acronym").getValueAsString()
-                            brokerName = record.getElement("broker").getElement("name").getValueAsString()
-                            brokerRank = record.getElement("broker").getElement("rank").getValueAsInteger()
 
-                            bought = record.getElementAsFloat("bought")
-                            sold = record.getElementAsFloat("sold")
-                            traded = record.getElementAsFloat("traded")
-                            crossed = record.getElementAsFloat("crossed")
-                            total = record.getElementAsFloat("total")
-                            highTouch = record.getElementAsFloat("highTouch")
-                            lowTouch = record.getElementAsFloat("lowTouch")
-                            numReports = record.getElementAsFloat("numReports")
+def main(argv):
 
-                            print (f"\tBroker: [{brokerAcronym}] {brokerName} Rank: {brokerRank} Bought: {bought} Sold: {sold} Traded: {traded} Crossed: {crossed} Total: {total} High Touch: {highTouch} Low Touch: {lowTouch} Count: {numReports}")
-                            done = True
+    import blpapi
 
-session.stop()
-exit()
+    metricsFile = ''
+
+    usage = 'rankDataGroupRequestSync.py [-m <metrics file (.json or Prometheus text)>]'
+
+    try:
+        opts, args = getopt.getopt(argv, "hm:", ["help", "metrics="])
+    except getopt.GetoptError:
+        print (usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print (usage)
+            sys.exit()
+        elif opt in ("-m", "--metrics"):
+            metricsFile = arg
+
+    # Session options are used to create the connectivity through to Bloomberg.
+    sessionOptions = blpapi.SessionOptions()
+    sessionOptions.setServerHost(d_host) # This represents the chose connectivity method. In this case, we are using Desktop API, so the host is 'localhost'
+    sessionOptions.setServerPort(d_port) # The default port is 8194.
+        
+    print ("Connecting to %s:%d" % (d_host, d_port))
+
+    # Create a Session
+    session = blpapi.Session(sessionOptions)
+
+    # Start a Session
+    if not session.start():
+        print("Failed to start session.")
+        sys.exit(-1)
+
+    success = run(session)
+
+    session.stop()
+
+    print ("Request metrics:\n%s" % metrics.summary())
+    if metricsFile != '':
+        metrics.write(metricsFile)
+
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    print ("Bloomberg - RANK API Example - rankDataGroupRequestSync")
+    main(sys.argv[1:])
 
 
 __copyright__ = """
@@ -165,6 +201,3 @@ IN THE SOFTWARE.
 """
 
 
-
-
-
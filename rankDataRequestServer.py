@@ -1,35 +1,48 @@
 # rankDataRequestServer.py
 
-import sys
-import blpapi
-import datetime
+'''
+Sends a RANK API Query on behalf of an authorized server-side user.
+
+With -d/--daemon the sample instead stays up as a daemon, keeping the session, the open
+services and the authorized Identity warm, and answers RANK query specs posted to a local
+HTTP endpoint (d_listen, or the host:port given with -l/--listen, which implies -d) with the
+decoded records. Identical specs that arrive while one is already in flight share its
+upstream request:
+
+    python rankDataRequestServer.py -d
+    python rankDataRequestServer.py -l 127.0.0.1:8195
+    curl -d '{"securities": ["IBM US Equity"], "start": "2021-03-01"}' http://127.0.0.1:8195/query
+
+GET /metrics returns the request metrics (see rankapi.metrics) as Prometheus text, or as JSON
+with ?format=json.
+
+The daemon does not try to recover its session: once the session terminates, the RANK service
+goes down or authorization fails, it stops serving and exits with status 1, to be restarted by
+whatever supervises it.
+'''
 
 import blpapi
 import sys
 import datetime
 import os
+import getopt
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rankapi.completion import Completion, RequestFailed, ResponseTracker
+from rankapi.decoder import ROW_FIELDS, RecordEncoder, concat_records, decode_report, decode_group_report
+from rankapi.spec import parse_spec, build_request
+from rankapi.singleflight import SingleFlight
+from rankapi.metrics import metrics
+from rankapi.names import (SESSION_STARTED, SESSION_STARTUP_FAILURE, SESSION_TERMINATED,
+                           SERVICE_OPENED, SERVICE_OPEN_FAILURE, SERVICE_DOWN,
+                           AUTHORIZATION_SUCCESS, AUTHORIZATION_FAILURE, SLOW_CONSUMER_WARNING,
+                           SLOW_CONSUMER_WARNING_CLEARED, REQUEST_FAILURE, EXCEPTION, REPORT,
+                           GROUPREPORT)
 
 # for additional DEBUG logging
 #os.environ['BLPAPI_LOGLEVEL'] = 'DEBUG'
 
-SESSION_STARTED                 = blpapi.Name("SessionStarted")
-SESSION_STARTUP_FAILURE         = blpapi.Name("SessionStartupFailure")
-SESSION_CONNECTION_UP           = blpapi.Name("SessionnConnectionUp")
-SESSION_CONNECTION_DOWN         = blpapi.Name("SessionConnectionDown")
-SESSION_TERMINATED              = blpapi.Name("SessionTerminated")
-
-SERVICE_OPENED                  = blpapi.Name("ServiceOpened")
-SERVICE_OPEN_FAILURE            = blpapi.Name("ServiceOpenFailure")
-SERVICE_DOWN                    = blpapi.Name("ServiceDown")
-
-AUTHORIZATION_SUCCESS           = blpapi.Name("AuthorizationSuccess")
-AUTHORIZATION_FAILURE           = blpapi.Name("AuthorizationFailure")
-
-SLOW_CONSUMER_WARNING           = blpapi.Name("SlowConsumerWarning")
-SLOW_CONSUMER_WARNING_CLEARED   = blpapi.Name("SlowConsumerWarningCleared")
-
-EXCEPTION                       = blpapi.Name("Exception")
-REPORT                          = blpapi.Name("Report")
 
 d_rank = "//blp/rankapi"
 d_auth = "//blp/apiauth"
@@ -37,11 +50,26 @@ d_host = "10.137.23.19"             # IP address of the Trading API Server insta
 d_port = 8194
 d_user = "RANKAPI\\SERVER_API"      # User name of the server-side user.
 d_ip = "1.1.1.1"                    # Any IP address unique for this user.
-
-bEnd=False
+d_timeout = 60                      # Seconds to wait for the request to complete.
+d_listen = "127.0.0.1:8195"         # Address of the daemon's HTTP endpoint, unless -l gives one.
+d_dispatcher_threads = 1            # Threads blpapi uses to call processEvent; see -t.
 
 
 class SessionEventHandler():
+
+    def __init__(self, serve=False):
+        self.completion = Completion()
+        self.ready = Completion()       # set once the Identity is authorized
+        self.serve = serve
+        self.identity = None
+        self.requestID = None
+        self.requestTimer = None
+        self.response = None            # ResponseTracker of the one-shot Query
+        self.authTimer = None
+        self.lock = threading.Lock()
+        self.pending = {}               # correlation id value -> (ResponseTracker, decoded parts, lock, RequestTimer)
+        self.resumed = threading.Event()  # cleared while the session is in Slow Consumer status
+        self.resumed.set()
     
     def sendAuthRequest(self,session):
                 
@@ -53,6 +81,7 @@ class SessionEventHandler():
         
         print ("Sending authorization request: %s" % (authReq))
         
+        self.authTimer = metrics.start("auth")
         session.sendAuthorizationRequest(authReq, self.identity)
         
         print ("Authorization request sent.")
@@ -101,21 +130,114 @@ class SessionEventHandler():
 
         #self.requestID = session.sendRequest(request)
         
-        self.requestID = blpapi.CorrelationId()
+        requestTimer = metrics.start("Query")
+        self.completion.add_done_callback(lambda completion: requestTimer.finished(completion.failed()))
+
+        with self.lock:
+            self.requestID = blpapi.CorrelationId()
+            self.requestTimer = requestTimer
+            self.response = ResponseTracker(self.completion)
+
         session.sendRequest(request, identity=self.identity, correlationId=self.requestID)  #Note the addition of the identity object.
         
         print ("RANK data request sent.")
 
 
+    def sendQuery(self, session, spec):
+
+        # Sends spec with the warm Identity. Returns a Completion that is set to the decoded
+        # RankRecords once the final response arrives.
+
+        completion = Completion()
+        requestID = blpapi.CorrelationId()
+        request = build_request(session.getService(d_rank), spec)
+
+        # Callers are HTTP threads, never the dispatcher thread, so they can wait here.
+        if not self.resumed.wait(d_timeout):
+            completion.fail(RequestFailed("Slow consumer status did not clear"))
+            return completion
+
+        parts = []
+        result = lambda: concat_records(parts) if parts else RecordEncoder().result()
+
+        timer = metrics.start(spec["operation"])
+        completion.add_done_callback(lambda completion: timer.finished(completion.failed()))
+
+        # A request that never completes would otherwise stay pending, and hold its spec in the
+        # SingleFlight, for good.
+        expiry = threading.Timer(d_timeout, self.expireQuery, (session, requestID))
+        expiry.daemon = True
+        completion.add_done_callback(lambda completion: expiry.cancel())
+
+        with self.lock:
+            self.pending[requestID.value()] = (ResponseTracker(completion, result), parts, threading.Lock(), timer)
+
+        try:
+            session.sendRequest(request, identity=self.identity, correlationId=requestID)
+        except Exception as e:
+            with self.lock:
+                self.pending.pop(requestID.value(), None)
+            completion.fail(RequestFailed("Failed to send request: %s" % e))
+            return completion
+
+        expiry.start()
+
+        return completion
+
+
+    def expireQuery(self, session, requestID):
+
+        # Runs on a timer thread once d_timeout has passed without the request completing.
+
+        with self.lock:
+            pending = self.pending.pop(requestID.value(), None)
+
+        if pending is not None:
+            session.cancel(requestID)
+            pending[0].completion.fail(TimeoutError("No response within %s seconds" % d_timeout))
+
+
+    def failQuery(self, requestID, reason):
+
+        # Fails the pending request with this correlation id value; False if there is none.
+
+        with self.lock:
+            pending = self.pending.pop(requestID, None)
+
+        if pending is None:
+            return False
+
+        pending[0].completion.fail(reason)
+        return True
+
+
+    def isReady(self):
+
+        # In daemon mode the completion is only ever signalled by a failure of the session.
+        return self.ready.done() and not self.ready.failed() and not self.completion.done()
+
+
+    def failPending(self, reason):
+
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+
+        for response, _, _, _ in pending:
+            response.completion.fail(reason)
+
+
     def processAdminEvent(self,event):  
         print("Processing ADMIN event")
 
         for msg in event:
             if msg.messageType() == SLOW_CONSUMER_WARNING:
                 print("Warning: Entered Slow Consumer status")
+                self.resumed.clear()
                 
             elif msg.messageType() == SLOW_CONSUMER_WARNING_CLEARED:
                 print("Slow consumer status cleared")
+                self.resumed.set()
                 
             else:
                 print(msg)
@@ -131,6 +253,14 @@ class SessionEventHandler():
                 
             elif msg.messageType() == SESSION_STARTUP_FAILURE:
                 print("Error: Session startup failed", file=sys.stderr)
+                self.completion.fail("Session startup failed")
+                self.ready.fail("Session startup failed")
+
+            elif msg.messageType() == SESSION_TERMINATED:
+                print("Session has been terminated")
+                self.completion.fail("Session terminated")
+                self.ready.fail("Session terminated")
+                self.failPending("Session terminated")
                 
             else:
                 print(msg)
@@ -160,6 +290,13 @@ class SessionEventHandler():
                 
             elif msg.messageType() == SERVICE_OPEN_FAILURE:
                     print("Error: Service Failed to open", file=sys.stderr)
+                    self.completion.fail("Service failed to open")
+                    self.ready.fail("Service failed to open")
+
+            elif msg.messageType() == SERVICE_DOWN:
+                print("Service down")
+                self.completion.fail("Service down")
+                self.failPending("Service down")
                 
                 
     
@@ -173,49 +310,145 @@ class SessionEventHandler():
 
 
                 
+    def processQueryResponse(self, msg, requestID, pending, final):
+
+        # Messages of one response may be handled on several dispatcher threads at once: each is
+        # decoded on its own. The message was registered with the tracker as it was looked up,
+        # and the request stays pending until the tracker has seen the final message and every
+        # message handled alongside it, so that none of them finds the request gone.
+
+        response, parts, lock, timer = pending
+
+        timer.received(final)
+
+        try:
+            if msg.messageType() == EXCEPTION:
+                response.completion.fail("Exception occured: %s" % msg)
+                final = True
+
+            elif msg.messageType() in (REPORT, GROUPREPORT):
+                records = decode_report(msg) if msg.messageType() == REPORT else decode_group_report(msg)
+
+                timer.decoded(records)
+
+                with lock:
+                    parts.append(records)
+
+        finally:
+            with self.lock:
+                done = response.leave(final)
+                if done:
+                    self.pending.pop(requestID, None)
+
+            if done:
+                response.finish()
+
+
+    def processOneShotResponse(self, msg, response, final):
+
+        # The message was registered with the tracker as it was looked up; the completion is set
+        # once the final message, and any handled alongside it, is done.
+
+        try:
+            print("MESSAGE TYPE: %s" % msg.messageType())
+
+            self.requestTimer.received(final)
+
+            if msg.messageType() == EXCEPTION:
+                print (msg)
+                print ("Exception occured")    
+                response.completion.fail("Exception occured")
+            
+            elif msg.messageType() == REPORT:
+                ts = msg.getElementAsDatetime("timestampUtc")
+                print ("Timestamp: ", ts)
+                print(msg)
+                self.requestTimer.decoded(msg.getElement("records").numValues())
+
+        finally:
+            if response.leave(final):
+                response.finish()
+
+
     def processResponseEvent(self, event, session):
-        print("Processing RESPONSE event")
-        
+
+        final = event.eventType() == blpapi.Event.RESPONSE
+
         for msg in event:
-            
+
+            requestID = msg.correlationIds()[0].value()
+
+            # the one-shot Query is registered with its tracker the same way as a daemon query
+            with self.lock:
+                pending = self.pending.get(requestID)
+                if pending is not None:
+                    pending[0].enter()
+                    
+                response = self.response if self.requestID is not None and requestID == self.requestID.value() else None
+                if response is not None:
+                    response.enter()
+
+            if pending is not None:
+                self.processQueryResponse(msg, requestID, pending, final)
+                continue
+
+            if response is not None:
+                self.processOneShotResponse(msg, response, final)
+                continue
+
+            print("Processing RESPONSE event")
             print("MESSAGE: %s" % msg.toString())
             print("CORRELATION ID: %d" % msg.correlationIds()[0].value())
 
             if msg.messageType() == AUTHORIZATION_SUCCESS:
                 print("Authorization successful....")
+                self.authTimer.received(final=True)
+                self.authTimer.finished()
                 print ("SeatType: %s" % (self.identity.getSeatType()))
-                self.sendCreateOrder(session)
+                self.ready.set(self.identity)
+                if not self.serve:
+                    self.sendCreateOrder(session)
 
             elif msg.messageType() == AUTHORIZATION_FAILURE:
                 print("Authorization failed....", file=sys.stderr)
+                self.authTimer.received(final=True)
+                self.authTimer.finished(failed=True)
                 # insert code here to automatically retry authorization...
+                self.completion.fail("Authorization failed")
+                self.ready.fail("Authorization failed")
 
-            elif msg.correlationIds()[0].value() == self.requestID.value():
-                print("MESSAGE TYPE: %s" % msg.messageType())
-                
-                if msg.messageType() == EXCEPTION:
-                    print (msg)
-                    print ("Exception occured")    
-                
-                elif msg.messageType() == REPORT:
-                    ts = msg.getElementAsDatetime("timestampUtc")
-                    print ("Timestamp: ", ts)
-                    print(msg)
-
-                global bEnd
-                bEnd = True            
             else:
                 print ("Unexpected message...")
                 print (msg)
-                    
+
             
+    def processRequestStatusEvent(self, event):
+
+        print("Processing REQUEST_STATUS event")
+
+        for msg in event:
+
+            print("REQUEST_STATUS message: %s" % msg)
+
+            if msg.messageType() != REQUEST_FAILURE:
+                continue
+
+            requestID = msg.correlationIds()[0].value()
+
+            if self.failQuery(requestID, "Request failed: %s" % msg):
+                continue
+
+            if self.requestID is not None and requestID == self.requestID.value():
+                self.completion.fail("Request failed")
+
+
     def processMiscEvents(self, event):
         
-        print("Processing " + event.eventType() + " event")
+        print("Processing %s event" % event.eventType())
         
         for msg in event:
 
-            print("MISC MESSAGE: %s" % (msg.tostring()))
+            print("MISC MESSAGE: %s" % (msg.toString()))
 
 
     def processEvent(self, event, session):
@@ -224,7 +457,7 @@ class SessionEventHandler():
             if event.eventType() == blpapi.Event.ADMIN:
                 self.processAdminEvent(event)
             
-            if event.eventType() == blpapi.Event.SESSION_STATUS:
+            elif event.eventType() == blpapi.Event.SESSION_STATUS:
                 self.processSessionStatusEvent(event,session)
 
             elif event.eventType() == blpapi.Event.SERVICE_STATUS:
@@ -233,19 +466,159 @@ class SessionEventHandler():
             elif event.eventType() == blpapi.Event.AUTHORIZATION_STATUS:
                 self.processAuthorizationStatusEvent(event)
 
-            elif event.eventType() == blpapi.Event.RESPONSE:
+            elif event.eventType() == blpapi.Event.RESPONSE or event.eventType() == blpapi.Event.PARTIAL_RESPONSE:
                 self.processResponseEvent(event,session)
+
+            elif event.eventType() == blpapi.Event.REQUEST_STATUS:
+                self.processRequestStatusEvent(event)
             
             else:
                 self.processMiscEvents(event)
                 
         except:
             print("Exception:  %s" % sys.exc_info()[0])
+            self.completion.fail("Exception in event handler: %s" % sys.exc_info()[1])
             
         return False
 
                 
-def main():
+class QueryRequestHandler(BaseHTTPRequestHandler):
+
+    # POST /query with a JSON spec (see rankapi.spec.parse_spec) returns the decoded records;
+    # GET /health reports whether the session is authorized and ready, and GET /metrics
+    # returns the request metrics.
+
+    def sendJson(self, status, body):
+
+        data = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def sendMetrics(self):
+
+        if self.path.endswith("format=json"):
+            data, contentType = metrics.to_json().encode("utf-8"), "application/json"
+        else:
+            data, contentType = metrics.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+
+        if self.path.split("?")[0] == "/metrics":
+            self.sendMetrics()
+            return
+
+        if self.path != "/health":
+            self.sendJson(404, {"error": "not found"})
+            return
+
+        eventHandler = self.server.eventHandler
+        ready = eventHandler.isReady()
+
+        self.sendJson(200 if ready else 503, {"ready": ready, "slowConsumer": not eventHandler.resumed.is_set(), "pending": len(eventHandler.pending), "requests": self.server.singleFlight.stats()})
+
+    def do_POST(self):
+
+        if self.path != "/query":
+            self.sendJson(404, {"error": "not found"})
+            return
+
+        eventHandler = self.server.eventHandler
+
+        if not eventHandler.isReady():
+            self.sendJson(503, {"error": "session is not ready"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            spec = parse_spec(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            self.sendJson(400, {"error": str(e)})
+            return
+
+        try:
+            # identical specs already in flight share one upstream request
+            completion = self.server.singleFlight.do(spec, lambda spec: eventHandler.sendQuery(self.server.session, spec))
+            records = completion.wait(d_timeout)
+        except TimeoutError as e:
+            self.sendJson(504, {"error": str(e)})
+            return
+        except RequestFailed as e:
+            self.sendJson(502, {"error": str(e)})
+            return
+
+        self.sendJson(200, {"count": len(records), "records": [dict(zip(ROW_FIELDS, row)) for row in records.rows()]})
+
+
+class QueryServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128    # callers tend to arrive in bursts
+
+
+def serve(session, eventHandler, listen):
+
+    host, port = listen.rsplit(":", 1)
+
+    server = QueryServer((host, int(port)), QueryRequestHandler)
+    server.session = session
+    server.eventHandler = eventHandler
+    server.singleFlight = SingleFlight()
+
+    # shutdown() waits for serve_forever to return, so it must not run on the serving thread
+    eventHandler.completion.add_done_callback(lambda completion: threading.Thread(target=server.shutdown, daemon=True).start())
+
+    print("Listening for RANK queries on http://%s:%s/query" % (host, port))
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def write_metrics(metricsFile):
+
+    print("Request metrics:\n%s" % metrics.summary())
+
+    if metricsFile != '':
+        metrics.write(metricsFile)
+
+
+def main(argv):
+
+    listen = ''
+    dispatcherThreads = d_dispatcher_threads
+    metricsFile = ''
+
+    usage = 'rankDataRequestServer.py [-d | -l <host:port>] [-t <dispatcher threads>] [-m <metrics file (.json or Prometheus text)>]'
+
+    try:
+        opts, args = getopt.getopt(argv, "hdl:t:m:", ["help", "daemon", "listen=", "dispatcher-threads=", "metrics="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-d", "--daemon"):
+            listen = listen or d_listen
+        elif opt in ("-l", "--listen"):
+            listen = arg if arg != '' else d_listen
+        elif opt in ("-t", "--dispatcher-threads"):
+            dispatcherThreads = int(arg)
+        elif opt in ("-m", "--metrics"):
+            metricsFile = arg
     
     sessionOptions = blpapi.SessionOptions()
     sessionOptions.setServerHost(d_host)
@@ -253,26 +626,50 @@ def main():
 
     print("Connecting to %s:%d" % (d_host,d_port))
 
-    eventHandler = SessionEventHandler()
+    eventHandler = SessionEventHandler(serve=listen != '')
 
-    session = blpapi.Session(sessionOptions, eventHandler.processEvent)
+    # With more than one dispatcher thread, independent responses are decoded in parallel.
+    eventDispatcher = blpapi.EventDispatcher(numDispatcherThreads=dispatcherThreads)
+    eventDispatcher.start()
+
+    session = blpapi.Session(sessionOptions, eventHandler.processEvent, eventDispatcher)
 
     if not session.startAsync():
         print("Failed to start session.", file=sys.stderr)
+        eventDispatcher.stop()
         return
+
+    if listen != '':
+        try:
+            eventHandler.ready.wait(d_timeout)
+            serve(session, eventHandler, listen)
+            eventHandler.completion.wait()
+        except (TimeoutError, RequestFailed) as e:
+            print("Error: %s" % e, file=sys.stderr)
+        finally:
+            print ("Terminating...")
+            session.stop()
+            eventDispatcher.stop()
+            write_metrics(metricsFile)
+        # serve only returns once the session has failed
+        sys.exit(1)
     
-    global bEnd
-    while bEnd==False:
-        pass
+    try:
+        eventHandler.completion.wait(d_timeout)
+        eventHandler.response.wait(d_timeout) # every message has been handled
+    except (TimeoutError, RequestFailed) as e:
+        print("Error: %s" % e, file=sys.stderr)
     
     print ("Terminating...")
     
     session.stop()
+    eventDispatcher.stop()
+    write_metrics(metricsFile)
 
 if __name__ == "__main__":
     print("Bloomberg - RANK API Example - Server - rankDataRequestServer")
     try:
-        main()
+        main(sys.argv[1:])
     except KeyboardInterrupt:
         print("Ctrl+C pressed. Stopping...")
 
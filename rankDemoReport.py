@@ -9,18 +9,27 @@ universe.
 import sys
 import getopt
 from typing import overload
-import blpapi
 import csv
 from datetime import date, timedelta, datetime
 import os
-from fpdf import FPDF
 import subprocess
-
-EXCEPTION                       = blpapi.Name("Exception")
-REPORT                          = blpapi.Name("Report")
+import multiprocessing
+import atexit
+import numpy as np
+from rankapi.cache import ResponseCache
+from rankapi.export import ParquetExport
+from rankapi.fetch import fetch_records, fetch_chunked, get_reference_data
+from rankapi.metrics import metrics
+from rankapi.planner import ChunkPlanner, merge_broker_records
+from rankapi.profiling import profiler
+from rankapi.ranking import BrokerRanking
+from rankapi.session import RankSession, SessionError
+from rankapi.spec import query_spec, group_query_spec
 
 d_host = 'localhost'
 d_port = 8194
+GROUP_QUERY_CHUNK_SIZE = 500
+REFDATA_FIELDS = ["DS199", "PR088"]
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
 
@@ -33,6 +42,9 @@ def import_securities(sec_file):
         return sec_list
 
 def import_analyst_mappings(analysts_file):
+
+    if analysts_file == '':
+        return []
     
     with open(os.path.join(__location__, analysts_file)) as csv_file:
         af_reader = csv.reader(csv_file, delimiter=',')
@@ -41,114 +53,134 @@ def import_analyst_mappings(analysts_file):
         return af_list
 
 
-def get_rank_data(session, securities, iso_date, broker, analyst_mappings):
+def _collect_ranks(ranks, records, security=None):
 
-    print("Retrieving security rankings...")
+    # Adds the (rank, volume) of each broker in ranks found in records to ranks[broker][ticker].
+    # Only the rows of those brokers are visited. For a per-security Query the records carry
+    # no ticker of their own, so it is passed in as security.
 
-    rank_data = []
+    codes = {records.broker_code(broker): broker for broker in ranks}
+    codes.pop(-1, None)
 
-    data_security = ''
-    data_rank = 0
-    data_volume = 0
-    data_sector = ''
-    data_analyst = ''
-    data_lasttrade = 0.0
+    if not codes:
+        return
 
-    rankapi = session.getService("//blp/rankapi")
-    refdataapi = session.getService("//blp/refdata")
-    
-    i=0
-    
-    for in_sec in securities:
+    data = records.data
 
-        i=i+1
+    for i in np.flatnonzero(np.isin(data["broker_acronym"], list(codes))).tolist():
+        ticker = security if security is not None else records.securities[data["security"][i]]
+        ranks[codes[int(data["broker_acronym"][i])]][ticker] = (int(data["broker_rank"][i]), int(data["total"][i]))
 
-        data_security = in_sec[0]
 
-        s = "Retrieving " + str(i) + " of " + str(len(securities)) + " security rankings (" + data_security + ")                                       "
+def get_broker_ranks(session, securities, iso_date, brokers, max_in_flight=1, cache=None, export=None):
+
+    # One Query per security covering all the brokers, returning {broker: {ticker: (rank, volume)}},
+    # or None on failure. The records are also written to export as they arrive, if given.
+
+    specs = [(in_sec[0], query_spec([in_sec[0]], iso_date, brokers=brokers)) for in_sec in securities]
+
+    def on_records(security, records):
+        s = "Retrieved " + security + " security ranking                                       "
         print(s, end="\r")
-        #print(s)
+        if export is not None:
+            export.write(records, security)
 
-        rank_request = rankapi.createRequest("Query")
+    results = fetch_records(session, specs, max_in_flight, cache, on_records)
 
-        rank_request.set("start", iso_date)
-        rank_request.set("end", iso_date)
+    if results is None:
+        return None
 
-        rank_request.set("units", "Shares")             
-        rank_request.set("source", "Broker Contributed")
-        rank_request.set("groupBy", "Broker")
+    ranks = {broker: {} for broker in brokers}
 
-        sec_el = rank_request.getElement("securityCriteria").setChoice("securities")
-        sec_el.appendElement().setElement("ticker", data_security)
+    for security, records in results.items():
+        _collect_ranks(ranks, records, security)
 
-        bkr_el = rank_request.getElement("brokers").appendElement()
-        bkr_el.setElement("acronym", broker)
+    return ranks
 
-        #print(rank_request)
 
-        session.sendRequest(rank_request)
+def get_broker_ranks_grouped(session, securities, iso_date, brokers, chunk_size=GROUP_QUERY_CHUNK_SIZE, max_in_flight=1, cache=None, export=None):
 
-        done = False
-        while not done:
-            event = session.nextEvent(500)
+    # Same result as get_broker_ranks, but each GroupQuery returns the full broker ranking for a
+    # whole chunk of securities, and the requested brokers are picked out locally.
 
-            if event.eventType() == blpapi.Event.RESPONSE:
+    tickers = [in_sec[0] for in_sec in securities]
+    specs = [(i, group_query_spec(tickers[i:i + chunk_size], iso_date)) for i in range(0, len(tickers), chunk_size)]
 
-                for msg in event:   
-                    
-                    #print(msg)
+    on_records = (lambda key, records: export.write(records)) if export is not None else None
 
-                    if msg.messageType() == EXCEPTION:
-                        print ("Exception occured.")
-                        return [], False    
-                
-                    elif msg.messageType() == REPORT:
+    results = fetch_records(session, specs, max_in_flight, cache, on_records)
 
-                        records = msg.getElement("records")
-                        for record in records.values():
+    if results is None:
+        return None
 
-                            data_rank = record.getElement("broker").getElement("rank").getValueAsInteger()
-                            data_volume = record.getElement("total").getValueAsInteger()
+    ranks = {broker: {} for broker in brokers}
 
-                        done = True
+    for records in results.values():
+        _collect_ranks(ranks, records)
 
-        data_analyst = get_analyst(data_security, analyst_mappings)
+    return ranks
 
-        refdata_request = refdataapi.createRequest("ReferenceDataRequest")
-        refdata_request.append("securities", data_security)
-        refdata_request.append("fields", "DS199")
-        refdata_request.append("fields", "PR088")
 
-        #print(refdata_request)
+def get_rank_dataset(session, securities, iso_date, brokers, analyst_mappings, max_in_flight=1, group_query=False, cache=None, refdata=None, export=None):
 
-        session.sendRequest(refdata_request)
+    # Fetches the per-security ranks of every broker in brokers, and the reference data, once.
+    # Returns ({broker: {ticker: (rank, volume)}}, [[security, sector, analyst, lasttrade], ...]),
+    # or (None, None) on failure. broker_rank_data turns these into one broker's rank_data.
 
-        done = False
-        while not done:
-            event = session.nextEvent(500)
+    print("Retrieving security rankings...")
 
-            if event.eventType() == blpapi.Event.RESPONSE:
-                for msg in event:   
-                    #print(msg)
-                    sec_data = msg.getElement("securityData")
-                    for sd in sec_data.values():
-                        if sd.getElement("fieldData").hasElement("DS199"):
-                            data_sector = sd.getElement("fieldData").getElement("DS199").getValueAsString()
-                        else:
-                            data_sector = "(unknown)"
+    with profiler.phase("get_rank_data/rank"):
+        if group_query:
+            ranks = get_broker_ranks_grouped(session, securities, iso_date, brokers, max_in_flight=max_in_flight, cache=cache, export=export)
+        else:
+            ranks = get_broker_ranks(session, securities, iso_date, brokers, max_in_flight, cache, export)
 
-                        
+    if ranks is None:
+        return None, None
 
-                        data_lasttrade = sd.getElement("fieldData").getElement("PR088").getValueAsFloat()
+    if refdata is None:
+        with profiler.phase("get_rank_data/refdata"):
+            refdata = get_reference_data(session, [in_sec[0] for in_sec in securities], REFDATA_FIELDS, max_in_flight=max_in_flight)
 
-                done = True
+    if refdata is None:
+        return None, None
 
-    
-        rank_data.append([data_security, data_rank, data_volume, data_sector, data_analyst, data_lasttrade])
+    security_data = []
+
+    for in_sec in securities:
+
+        data_security = in_sec[0]
+
+        data_analyst = get_analyst(data_security, analyst_mappings)
+
+        fields = refdata.get(data_security, {})
+        data_sector = fields.get("DS199", "(unknown)")
+        data_lasttrade = fields.get("PR088", 0.0)
+
+        security_data.append([data_security, data_sector, data_analyst, data_lasttrade])
 
     print("Retrieved " + str(len(securities)) + " security rankings")
 
-    return rank_data, True
+    return ranks, security_data
+
+def broker_rank_data(broker_ranks, security_data):
+
+    rank_data = []
+
+    for data_security, data_sector, data_analyst, data_lasttrade in security_data:
+        data_rank, data_volume = broker_ranks.get(data_security, (0, 0))
+        rank_data.append([data_security, data_rank, data_volume, data_sector, data_analyst, data_lasttrade])
+
+    return rank_data
+
+def get_rank_data(session, securities, iso_date, broker, analyst_mappings, max_in_flight=1, group_query=False, cache=None, refdata=None):
+
+    ranks, security_data = get_rank_dataset(session, securities, iso_date, [broker], analyst_mappings, max_in_flight, group_query, cache, refdata)
+
+    if ranks is None:
+        return [], False
+
+    return broker_rank_data(ranks[broker], security_data), True
 
 def get_analyst(sec, analyst_mappings):
 
@@ -159,93 +191,77 @@ def get_analyst(sec, analyst_mappings):
     return ''
 
 
-def get_position_data(session, securities, iso_date, broker):
+def get_broker_ranking(session, securities, iso_date, brokers, cache=None, max_in_flight=1, planner=None):
+
+    # One Query over the whole universe, streamed into a BrokerRanking that tracks every broker
+    # in brokers. Universes larger than one planner chunk are fetched in chunks and merged
+    # first. Returns the BrokerRanking, or None on failure.
 
     print("Retrieving broker rank data...")
 
-    pos_data=[]
-    full_pos_data = []
-    overall_total=0
+    ranking = BrokerRanking(brokers)
 
-    rankapi = session.getService("//blp/rankapi")
+    tickers = [in_sec[0] for in_sec in securities]
+    spec = query_spec(tickers, iso_date)
 
-    rank_request = rankapi.createRequest("Query")
+    if planner is None:
+        planner = ChunkPlanner()
 
-    rank_request.set("start", iso_date)
-    rank_request.set("end", iso_date)
+    if len(tickers) <= planner.next_size():
 
-    rank_request.set("units", "Shares")             
-    rank_request.set("source", "Broker Contributed")
-    rank_request.set("groupBy", "Broker")
+        def on_records(key, records):
+            ranking.update(records)
 
-    sec_el = rank_request.getElement("securityCriteria").setChoice("securities")
-    for in_sec in securities:
-        sec_el.appendElement().setElement("ticker", in_sec[0])
+        # the ranking only needs each message once, so only a cache keeps the whole response
+        if fetch_records(session, [(iso_date, spec)], cache=cache, on_records=on_records, keep=False) is None:
+            return None
 
-    #print(rank_request)
-    
-    session.sendRequest(rank_request)
-
-    done = False
-    while not done:
-        event = session.nextEvent(500)
-
-        if event.eventType() == blpapi.Event.RESPONSE or event.eventType() == blpapi.Event.PARTIAL_RESPONSE:
-
-            for msg in event:   
-                
-                #print(msg)
-
-                if msg.messageType() == EXCEPTION:
-                    print ("Exception occured.")
-                    return [], False    
-            
-                elif msg.messageType() == REPORT:
-
-                    records = msg.getElement("records")
-
-                    for record in records.values():
-                    
-                        #print ("Record: \n", record)
-                        broker_acronym = record.getElement("broker").getElement("acronym").getValueAsString()
-                        broker_name = record.getElement("broker").getElement("name").getValueAsString()
-                        broker_rank = record.getElement("broker").getElement("rank").getValueAsInteger()
-                        total_traded = record.getElementAsFloat("traded")
-
-                        full_pos_data.append([broker_acronym, broker_name, broker_rank, total_traded])
-                        overall_total+=total_traded
-
-                    if event.eventType() == blpapi.Event.RESPONSE:
-                        done = True
-
-        print("Broker ranking retieved...establishing overall ranking")
-        
-        for i in range(0,(len(full_pos_data)-1)):
-            if full_pos_data[i][0] == broker:
-                
-                if i==0: # broker is ranked #1
-                    pos_data.append([])
-                else:
-                    pos_data.append(full_pos_data[i-1])
-                
-                pos_data.append(full_pos_data[i])
-
-                if i < (len(full_pos_data)-1):
-                    pos_data.append(full_pos_data[i+1])
+    else:
+
+        records = cache.get(spec) if cache is not None else None
+
+        if records is None:
+
+            parts = fetch_chunked(session, tickers, lambda chunk: query_spec(chunk, iso_date), planner, max_in_flight)
+
+            if parts is None:
+                return None
+
+            records = merge_broker_records(parts)
+
+            if cache is not None:
+                cache.put(spec, records)
+
+        ranking.update(records)
+
+    print("Broker ranking retieved (" + str(ranking.count) + " brokers)...establishing overall ranking")
+
+    return ranking
+
+def get_position_data(session, securities, iso_date, broker, cache=None, max_in_flight=1):
+
+    ranking = get_broker_ranking(session, securities, iso_date, broker, cache, max_in_flight)
+
+    if ranking is None:
+        return [], 0, False
+
+    pos_data = ranking.position(broker)
 
     print("Overall position established")
 
-    return pos_data, overall_total,True
+    return pos_data, ranking.overall_total, True
 
 def generate_output(output_file, position_data, rank_data, overall_total, iso_date):
 
+    from fpdf import FPDF
+
     print('Generating PDF output file...', end='\r')
 
     fpdf = FPDF(orientation='P', unit="mm", format='A4')
 
     fpdf.add_page()
 
-    fpdf.image(r'C:\Users\CleggRichard\Development\RANK API\RANK-API-Code-Samples\Python\yourlogohere.png', 10, 0, 60, 20)
+    fpdf.image(os.path.join(__location__, 'yourlogohere.png'), 10, 0, 60, 20)
 
     fpdf.set_fill_color(40, 76, 125)
     fpdf.set_draw_color(40, 76, 125)
@@ -334,6 +350,176 @@ def generate_output(output_file, position_data, rank_data, overall_total, iso_da
     print('PDF output file created: ' , of)
 
 
+def connect():
+
+    # Connects to Bloomberg. The RANK API and Reference Data services are opened when first used.
+
+    try:
+        return RankSession(d_host, d_port).start()
+    except SessionError as e:
+        print ("Error: %s" % e)
+        return None
+
+
+def build_report(session, securities, iso_date, brokers, analyst_mappings, output_file, max_in_flight=1, group_query=False, cache=None, refdata=None, export_file=''):
+
+    # The RANK and reference data is fetched once for the universe, then each broker's view of it
+    # is rendered to output_file, with any {broker} in it replaced by the broker's code. The
+    # security rankings are also streamed to the Parquet file export_file, if given.
+
+    export = ParquetExport(export_file) if export_file != '' else None
+
+    try:
+
+        ranks, security_data = get_rank_dataset(session, securities, iso_date, brokers, analyst_mappings, max_in_flight, group_query, cache, refdata, export)
+
+        if ranks is None:
+            if export is not None:
+                export.abort()
+            return False
+
+        if export is not None:
+            export.close()
+            print ("Exported " + str(export.rows) + " records to " + export_file)
+
+        with profiler.phase("get_position_data"):
+            ranking = get_broker_ranking(session, securities, iso_date, brokers, cache, max_in_flight)
+
+    except SessionError as e:
+        print ("Error: %s" % e)
+        if export is not None:
+            export.abort()
+        return False
+
+    if ranking is None:
+        return False
+
+    print ("Overall total: ", ranking.overall_total)
+
+    if cache is not None:
+        print ("Cache: ", cache.stats())
+
+    success = True
+
+    for broker in brokers:
+
+        rank_data = broker_rank_data(ranks[broker], security_data)
+        position_data = ranking.position(broker)
+
+        if len(brokers) == 1:
+            print ("Full Rank data:")
+            for r in rank_data:
+                print(r)
+            print (position_data)
+
+        if position_data==[]:
+            print("Error: broker " + broker + " is not ranked for this universe")
+            success = False
+            continue
+
+        with profiler.phase("generate_output"):
+            generate_output(output_file.replace("{broker}", broker), position_data, rank_data, ranking.overall_total, iso_date)
+
+    return success
+
+
+def business_days(from_date, to_date):
+
+    days = []
+    day = datetime.strptime(from_date, "%Y-%m-%d").date()
+    last = datetime.strptime(to_date, "%Y-%m-%d").date()
+
+    while day <= last:
+        if day.weekday() < 5:
+            days.append(day.isoformat())
+        day += timedelta(days=1)
+
+    return days
+
+
+# Per-process state of a backfill worker: its long-lived session and the shared report settings.
+_backfill_worker = {}
+
+def _init_backfill_worker(settings):
+
+    _backfill_worker.update(settings)
+
+    # a forked worker starts with a copy of the parent's metrics and phases
+    metrics.take()
+    profiler.take()
+
+    if settings["profile"]:
+        dump_file = ''
+        if settings["profile_dump"] != '':
+            root, ext = os.path.splitext(settings["profile_dump"])
+            dump_file = root + "_" + str(os.getpid()) + ext
+        profiler.enable(dump_file)
+        if dump_file != '':
+            multiprocessing.util.Finalize(None, profiler.dump, exitpriority=20)
+
+    # the session connects when the worker's first date needs it
+    _backfill_worker["session"] = session = RankSession(d_host, d_port)
+    _backfill_worker["cache"] = ResponseCache(settings["cache_dir"]) if settings["cache_dir"] != '' else None
+
+    multiprocessing.util.Finalize(None, session.stop, exitpriority=10)
+
+
+def _backfill_date(iso_date):
+
+    w = _backfill_worker
+    output_file = w["output_pattern"].replace("{date}", iso_date)
+    export_file = w["export_pattern"].replace("{date}", iso_date)
+
+    success = build_report(w["session"], w["securities"], iso_date, w["brokers"], w["analyst_mappings"], output_file,
+                           w["max_in_flight"], w["group_query"], w["cache"], w["refdata"], export_file)
+
+    # the parent adds each date's request metrics and phases to its own
+    return iso_date, success, output_file, metrics.take(), profiler.take()
+
+
+def backfill(dates, workers, settings):
+
+    # Fans the dates out over a pool of worker processes, each holding its own session, and
+    # reports each date as soon as its PDF has been written.
+
+    failed = []
+
+    with multiprocessing.Pool(min(workers, len(dates)), _init_backfill_worker, (settings,)) as pool:
+        for iso_date, success, output_file, date_metrics, date_phases in pool.imap_unordered(_backfill_date, dates):
+            metrics.merge(date_metrics)
+            profiler.merge(date_phases)
+            if success:
+                print("Backfill: " + iso_date + " -> " + output_file)
+            else:
+                print("Backfill: " + iso_date + " FAILED")
+                failed.append(iso_date)
+
+        # let the workers exit on their own, so that their finalizers (session.stop, profile dumps) run
+        pool.close()
+        pool.join()
+
+    return failed
+
+
+def write_metrics(metrics_file):
+
+    summary = metrics.summary()
+    if summary != '':
+        print("Request metrics:\n" + summary)
+
+    metrics.write(metrics_file)
+    print("Metrics written to " + metrics_file)
+
+
+def report_profile():
+
+    print("\nPhases:\n" + profiler.report())
+
+    dump_file = profiler.dump()
+    if dump_file is not None:
+        print("cProfile statistics written to " + dump_file)
+
+
 def main(argv):
     
     sec_uni = ''
@@ -341,11 +527,21 @@ def main(argv):
     output_file = ''
     analysts_file = ''
     broker = ''
-
-    usage = 'rankDemoReport.py -s <securities file> -d <ISO date> -a <analyst mapping file> -o <output file>'
+    max_in_flight = 1
+    group_query = False
+    cache_dir = ''
+    from_date = ''
+    to_date = ''
+    workers = 4
+    metrics_file = ''
+    export_file = ''
+    profile = False
+    profile_dump = ''
+
+    usage = 'rankDemoReport.py -s <securities file> -b <broker code[,broker code...]> -d <ISO date> -a <analyst mapping file> -o <output file> -p <max requests in flight> -c <cache directory> [--group-query] [--from <ISO date> --to <ISO date> -w <workers>] [-e <Parquet export file>] [-m <metrics file (.json or Prometheus text)>] [--profile] [--profile-dump <cProfile file>]'
     
     try:
-        opts, args = getopt.getopt(argv,"hs:d:a:o:b:",["help","securities=","date=","analysts=","output=","broker="])
+        opts, args = getopt.getopt(argv,"hs:d:a:o:b:p:c:w:m:e:",["help","securities=","date=","analysts=","output=","broker=","pipeline=","group-query","cache=","from=","to=","workers=","metrics=","export=","profile","profile-dump="])
     except getopt.GetoptError:
         print (usage)
         sys.exit(2)
@@ -363,6 +559,27 @@ def main(argv):
             analysts_file = arg
         elif opt in ("-o", "--output"):
             output_file = arg
+        elif opt in ("-p", "--pipeline"):
+            max_in_flight = int(arg)
+        elif opt == "--group-query":
+            group_query = True
+        elif opt in ("-c", "--cache"):
+            cache_dir = arg
+        elif opt == "--from":
+            from_date = arg
+        elif opt == "--to":
+            to_date = arg
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-e", "--export"):
+            export_file = arg
+        elif opt in ("-m", "--metrics"):
+            metrics_file = arg
+        elif opt == "--profile":
+            profile = True
+        elif opt == "--profile-dump":
+            profile = True
+            profile_dump = arg
    
     if sec_uni == '':
         print("Error: missing security source")
@@ -372,7 +589,20 @@ def main(argv):
         print("Error: missing broker code")
         sys.exit(2)
 
-    if iso_date == '':
+    brokers = [b.strip() for b in broker.split(",") if b.strip() != '']
+
+    if metrics_file != '':
+        # written however the run ends
+        atexit.register(write_metrics, metrics_file)
+
+    if profile:
+        profiler.enable(profile_dump)
+        atexit.register(report_profile)
+
+    if from_date != '' and to_date == '':
+        to_date = (date.today() - timedelta(days = 1)).isoformat()
+
+    if iso_date == '' and from_date == '':
         print("Assuming T-1")
 
         today = date.today()
@@ -382,67 +612,91 @@ def main(argv):
     if analysts_file == '':
         print("No analyst mappings provided")
 
+    if from_date != '':
+        if output_file == '':
+            output_file = "report_{date}.pdf"
+        elif "{date}" not in output_file:
+            root, ext = os.path.splitext(output_file)
+            output_file = root + "_{date}" + ext
+
+    if from_date != '' and export_file != '' and "{date}" not in export_file:
+        root, ext = os.path.splitext(export_file)
+        export_file = root + "_{date}" + ext
+
     if output_file =='':
         print('Defaulting output file')
         output_file = "report_" + iso_date + ".pdf"
 
+    if len(brokers) > 1 and "{broker}" not in output_file:
+        root, ext = os.path.splitext(output_file)
+        output_file = root + "_{broker}" + ext
+
 
     print ('\nSecurities file: ', sec_uni)
-    print ("Broker: ", broker)
-    print ('ISO Date: ', iso_date)
+    print ("Brokers: ", ", ".join(brokers))
+    if from_date != '':
+        print ('ISO Dates: ', from_date, "to", to_date, "with", workers, "workers")
+    else:
+        print ('ISO Date: ', iso_date)
     print ('Analysts: ', "None" if analysts_file=='' else analysts_file)
     print ('Output file:', output_file)
+    print ('Export file:', "None" if export_file=='' else export_file)
+    print ('Requests in flight:', max_in_flight)
+    print ('Rank source:', "GroupQuery" if group_query else "Query")
+    print ('Cache:', "None" if cache_dir=='' else cache_dir)
 
-    # Connect to Bloomberg services
-    sessionOptions = blpapi.SessionOptions()
-    sessionOptions.setServerHost(d_host) # This represents the chose connectivity method. In this case, we are using Desktop API, so the host is 'localhost'
-    sessionOptions.setServerPort(d_port) # The default port is 8194.
-    
-    print ("Connecting to %s:%d" % (d_host, d_port))
+    if cache_dir != '':
+        cache_dir = os.path.join(__location__, cache_dir)
 
-    session = blpapi.Session(sessionOptions)
+    cache = ResponseCache(cache_dir) if cache_dir != '' else None
 
-    if not session.start():
-        print ("Error: Failed to start session.")
-        sys.exit(2)
+    session = connect()
 
-    if not session.openService("//blp/rankapi"):
-        print("Failed to open RANK API service")
+    if session is None:
         sys.exit(2)
 
-    print("RANK API service opened.")
+    with profiler.phase("import_securities"):
+        securities = import_securities(sec_uni)
 
-    if not session.openService("//blp/refdata"):
-        print("Failed to open Reference Data API service")
-        sys.exit(2)
+    with profiler.phase("import_analyst_mappings"):
+        analyst_mappings = import_analyst_mappings(analysts_file)
 
-    print("Reference Data service opened.")
+    if from_date != '':
 
-    securities = import_securities(sec_uni)
+        dates = business_days(from_date, to_date)
 
-    analyst_mappings = import_analyst_mappings(analysts_file)
+        # Sector and last trade do not depend on the report date, so they are fetched once here.
+        try:
+            with profiler.phase("get_rank_data/refdata"):
+                refdata = get_reference_data(session, [in_sec[0] for in_sec in securities], REFDATA_FIELDS, max_in_flight=max_in_flight)
+        except SessionError as e:
+            print ("Error: %s" % e)
+            refdata = None
 
-    rank_data, success = get_rank_data(session, securities, iso_date, broker, analyst_mappings)
+        session.stop()
 
-    if success==False:
-        sys.exit(2)
+        if refdata is None or dates == []:
+            sys.exit(2)
 
-    print ("Full Rank data:")
-    for r in rank_data:
-        print(r)
+        settings = {"securities": securities, "brokers": brokers, "analyst_mappings": analyst_mappings, "refdata": refdata,
+                    "output_pattern": output_file, "export_pattern": export_file, "max_in_flight": max_in_flight, "group_query": group_query, "cache_dir": cache_dir,
+                    "profile": profile, "profile_dump": profile_dump}
 
-    position_data, overall_total, success = get_position_data(session, securities, iso_date, broker)
+        failed = backfill(dates, workers, settings)
 
-    if success==False:
-        sys.exit(2)
+        print("Backfilled " + str(len(dates) - len(failed)) + " of " + str(len(dates)) + " dates.")
 
-    print (position_data)
-    print ("Overall total: ", overall_total)
+        sys.exit(2 if failed else 0)
 
-    generate_output(output_file, position_data, rank_data, overall_total, iso_date)
+    if not build_report(session, securities, iso_date, brokers, analyst_mappings, output_file, max_in_flight, group_query, cache, export_file=export_file):
+        sys.exit(2)
 
     print("Finshed.")
 
+    if len(brokers) > 1:
+        print("Wrote " + str(len(brokers)) + " reports to " + os.path.join(__location__, output_file))
+        sys.exit(0)
+
     of = os.path.join(__location__, output_file)
 
     print("Opening PDF: ", of)
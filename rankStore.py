@@ -0,0 +1,267 @@
+# rankStore.py
+
+'''
+Keeps a local rankapi.store.RankStore of daily RANK snapshots of a security universe in sync,
+and answers rank history questions from it without going back to Bloomberg:
+
+    python rankStore.py -r rankstore -s security_universe_30.csv --from 2021-01-04 --to 2021-12-31
+    python rankStore.py -r rankstore -s security_universe_30.csv
+    python rankStore.py -r rankstore -t "IBM US Equity" -b BK003 -n 250
+    python rankStore.py -r rankstore --delta -b BK003
+
+Only the dates the store is missing for this universe, units and source are fetched, along
+with any date that was still open when it was stored, so a nightly run with no dates given
+(from the first stored date to T-1) pulls just the new day, and an interrupted run picks up at
+the first date it had not committed. --full fetches every date again.
+
+Each date is fetched with GroupQuery requests over chunks of the universe, built by
+rankapi.spec.build_request like rankDataGroupRequest's, decoded by the same columnar decoder as
+the other samples, and committed as one partition of the store once all its chunks are in.
+
+--delta compares a stored date (-d, the latest by default) with the stored date before it, and
+lists where broker -b gained or lost rank, or without -b, which brokers moved most overall.
+'''
+
+import sys
+import getopt
+import time
+from datetime import date, timedelta
+
+from rankapi.decoder import concat_records
+from rankapi.delta import rank_delta
+from rankapi.fetch import fetch_records
+from rankapi.session import RankSession, SessionError
+from rankapi.spec import DEFAULT_UNITS, DEFAULT_SOURCE, group_query_spec, spec_is_open
+from rankapi.store import RankStore, HISTORY_FIELDS, universe_key
+
+d_host = 'localhost'
+d_port = 8194
+GROUP_QUERY_CHUNK_SIZE = 500
+
+
+def load_date(session, store, tickers, iso_date, chunk_size=GROUP_QUERY_CHUNK_SIZE, max_in_flight=1):
+
+    # Fetches the full broker ranking of every ticker on iso_date and commits it to the store.
+    # Returns the number of records stored, or None if a request fails.
+
+    specs = [(i, group_query_spec(tickers[i:i + chunk_size], iso_date, store.units, store.source)) for i in range(0, len(tickers), chunk_size)]
+
+    results = fetch_records(session, specs, max_in_flight)
+
+    if results is None:
+        return None
+
+    return store.append(iso_date, concat_records([results[key] for key, _ in specs]), universe_key(tickers), spec_is_open(specs[0][1]))
+
+
+def sync(session, store, tickers, dates, max_in_flight=1, full=False):
+
+    # Fetches those of dates the store does not yet hold for tickers (all of them if full),
+    # committing each date as it completes. Returns False if a date fails to load.
+
+    todo = dates if full else store.missing(dates, universe_key(tickers))
+
+    print ("Sync: " + str(len(todo)) + " of " + str(len(dates)) + " dates to fetch")
+
+    for iso_date in todo:
+
+        count = load_date(session, store, tickers, iso_date, max_in_flight=max_in_flight)
+
+        if count is None:
+            print ("Error: failed to load " + iso_date)
+            return False
+
+        print ("Stored " + iso_date + ": " + str(count) + " records")
+
+    return True
+
+
+def print_history(store, ticker, broker, days, end):
+
+    start = time.perf_counter()
+    history = store.history(ticker, broker, days, end)
+    elapsed = time.perf_counter() - start
+
+    print ("%s, broker %s: %d dates (%.2f ms)" % (ticker, broker, len(history), elapsed * 1000))
+
+    for row in history.tolist():
+        print ("  %s  " % row[0] + "  ".join("%s: %s" % (field, value) for field, value in zip(HISTORY_FIELDS, row[1:])))
+
+
+def print_delta(store, iso_date, broker, top, column):
+
+    dates = [d for d in store.dates() if iso_date == '' or d <= iso_date]
+
+    if len(dates) < 2:
+        print ("Error: the store needs two dates up to " + (iso_date or "now") + " to compare")
+        return False
+
+    before, after = dates[-2], dates[-1]
+
+    start = time.perf_counter()
+    delta = rank_delta(store.records(before), store.records(after))
+    elapsed = time.perf_counter() - start
+
+    print ("%s -> %s: %d security/broker pairs compared (%.1f ms)" % (before, after, len(delta), elapsed * 1000))
+
+    if broker != '':
+        gainers, losers = delta.movers(top, column, broker)
+        for title, pairs in (("Gained", gainers), ("Lost", losers)):
+            print ("%s (by %s):" % (title, column))
+            for ticker, acronym, name, rank_before, rank_after, rank_change, traded_before, traded_after, traded_change, share_before, share_after, share_change in delta.rows(pairs):
+                print ("  %-20s rank %3d -> %3d  traded %14.0f (%+.0f)  share %6.2f%% (%+.2f)" %
+                       (ticker, rank_before, rank_after, traded_after, traded_change, share_after * 100, share_change * 100))
+    else:
+        gainers, losers = delta.broker_movers(top, column)
+        for title, brokers in (("Gained", gainers), ("Lost", losers)):
+            print ("%s (by %s):" % (title, column))
+            for row in brokers:
+                print ("  %-8s %-30s rank %4d -> %4d  traded %16.0f (%+.0f)  share %6.2f%% (%+.2f)  securities +%d/-%d" %
+                       (delta.broker_acronyms[row["broker_acronym"]], delta.broker_names[row["broker_acronym"]], row["rank_before"], row["rank_after"],
+                        row["traded_after"], row["traded_change"], row["share_after"] * 100, row["share_change"] * 100, row["securities_gained"], row["securities_lost"]))
+
+    return True
+
+
+def main(argv):
+
+    # business_days and import_securities are shared with the report
+    from rankDemoReport import business_days, import_securities
+
+    store_dir = ''
+    sec_uni = ''
+    iso_date = ''
+    from_date = ''
+    to_date = ''
+    max_in_flight = 1
+    ticker = ''
+    broker = ''
+    days = 250
+    end = None
+    units = DEFAULT_UNITS
+    source = DEFAULT_SOURCE
+    full = False
+    delta = False
+    top = 10
+    column = "rank_change"
+
+    usage = 'rankStore.py -r <store directory> [-s <securities file> [-d <ISO date> | --from <ISO date> [--to <ISO date>]] [--units <units>] [--source <source>] [-p <max requests in flight>] [--full]] [-t <ticker> -b <broker code> [-n <days>] [--end <ISO date>]] [--delta [-d <ISO date>] [-b <broker code>] [--top <n>] [--by rank_change|traded_change|share_change]]'
+
+    try:
+        opts, args = getopt.getopt(argv, "hr:s:d:p:t:b:n:", ["help", "store=", "securities=", "date=", "from=", "to=", "pipeline=", "full", "units=", "source=", "ticker=", "broker=", "days=", "end=", "delta", "top=", "by="])
+    except getopt.GetoptError:
+        print (usage)
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print (usage)
+            sys.exit()
+        elif opt in ("-r", "--store"):
+            store_dir = arg
+        elif opt in ("-s", "--securities"):
+            sec_uni = arg
+        elif opt in ("-d", "--date"):
+            iso_date = arg
+        elif opt == "--from":
+            from_date = arg
+        elif opt == "--to":
+            to_date = arg
+        elif opt in ("-p", "--pipeline"):
+            max_in_flight = int(arg)
+        elif opt == "--full":
+            full = True
+        elif opt == "--units":
+            units = arg
+        elif opt == "--source":
+            source = arg
+        elif opt in ("-t", "--ticker"):
+            ticker = arg
+        elif opt in ("-b", "--broker"):
+            broker = arg
+        elif opt in ("-n", "--days"):
+            days = int(arg)
+        elif opt == "--end":
+            end = arg
+        elif opt == "--delta":
+            delta = True
+        elif opt == "--top":
+            top = int(arg)
+        elif opt == "--by":
+            column = arg
+
+    if store_dir == '' or (sec_uni == '' and ticker == '' and not delta):
+        print (usage)
+        sys.exit(2)
+
+    try:
+        store = RankStore(store_dir, units, source)
+    except ValueError as e:
+        print ("Error: %s" % e)
+        sys.exit(2)
+
+    if sec_uni != '':
+
+        yesterday = (date.today() - timedelta(days = 1)).isoformat()
+
+        if iso_date != '':
+            dates = [iso_date]
+        else:
+            if from_date == '':
+                # a nightly sync: everything since the store began, which is normally just T-1
+                stored = store.dates()
+                from_date = stored[0] if stored else yesterday
+            dates = business_days(from_date, to_date if to_date != '' else yesterday)
+
+        tickers = [in_sec[0] for in_sec in import_securities(sec_uni)]
+
+        session = RankSession(d_host, d_port)
+
+        try:
+            success = sync(session, store, tickers, dates, max_in_flight, full)
+        except SessionError as e:
+            print ("Error: %s" % e)
+            success = False
+        finally:
+            session.stop()
+
+        print ("Store: ", store.stats())
+
+        if not success:
+            sys.exit(2)
+
+    if ticker != '':
+
+        if broker == '':
+            print ("Error: missing broker code")
+            sys.exit(2)
+
+        print_history(store, ticker, broker, days, end)
+
+    if delta and not print_delta(store, iso_date, broker, top, column):
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    print ("Bloomberg - RANK API Example - rankStore")
+    main(sys.argv[1:])
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
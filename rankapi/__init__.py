@@ -0,0 +1,75 @@
+# rankapi/__init__.py
+
+'''
+Request building, response decoding and session handling for the Bloomberg RANK API, shared
+by the sample scripts and importable into other processes.
+
+Importing rankapi does not import blpapi, open a session or load any submodule: each name
+below is loaded from its submodule when it is first used, and blpapi only when a session is
+started or a blpapi.Name is needed.
+
+    import rankapi
+
+    with rankapi.RankSession("localhost", 8194) as session:
+        spec = rankapi.query_spec(["IBM US Equity"], "2021-09-29")
+        records = rankapi.fetch_records(session, [("IBM", spec)])["IBM"]
+
+The process-wide metrics and profiler live in rankapi.metrics and rankapi.profiling.
+'''
+
+import importlib
+
+
+_EXPORTS = {
+    "RankSession": "session", "SessionError": "session",
+    "send_pipelined": "fetch", "fetch_records": "fetch", "fetch_chunked": "fetch", "get_reference_data": "fetch",
+    "query_spec": "spec", "group_query_spec": "spec", "parse_spec": "spec", "build_request": "spec", "spec_key": "spec",
+    "RankRecords": "decoder", "RecordEncoder": "decoder", "concat_records": "decoder", "decode_report": "decoder", "decode_group_report": "decoder",
+    "ReportSchema": "schema", "report_schema": "schema", "decode_report_elements": "schema", "decode_group_report_elements": "schema",
+    "ParquetExport": "export",
+    "ResponseCache": "cache",
+    "RankStore": "store",
+    "RankDelta": "delta", "rank_delta": "delta",
+    "Completion": "completion", "RequestFailed": "completion", "ResponseTracker": "completion",
+    "ChunkPlanner": "planner", "merge_broker_records": "planner",
+    "BrokerRanking": "ranking",
+    "SingleFlight": "singleflight",
+    "WorkQueue": "workqueue",
+    "AsyncSession": "aio",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(attr):
+
+    if attr not in _EXPORTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, attr))
+
+    value = getattr(importlib.import_module("." + _EXPORTS[attr], __name__), attr)
+    globals()[attr] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
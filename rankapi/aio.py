@@ -0,0 +1,437 @@
+# rankapi/aio.py
+
+'''
+An asyncio client for the RANK API and Reference Data services.
+
+One blpapi session is shared by every request. Its dispatcher thread decodes each response
+message and hands it to the event loop by correlation ID, so requests are plain awaitables:
+
+    async with AsyncSession() as client:
+        records = await client.rank.query(["IBM US Equity"], "2021-09-29")
+        parts = await asyncio.gather(*(client.rank.group_query([t], "2021-09-29") for t in tickers))
+        refdata = await client.refdata.reference(tickers, ["DS199", "PR088"])
+
+Each partial response can also be consumed as it arrives:
+
+    async for records in client.rank.query(tickers, "2021-09-29"):
+        ...
+'''
+
+import sys
+import getopt
+import asyncio
+import collections
+import itertools
+import threading
+import time
+from . import names
+from .completion import RequestFailed
+from .decoder import RecordEncoder, concat_records, decode_report, decode_group_report
+from .spec import DEFAULT_UNITS, DEFAULT_SOURCE, query_spec, group_query_spec, build_request
+
+RANK_SERVICE = "//blp/rankapi"
+REFDATA_SERVICE = "//blp/refdata"
+
+d_host = "localhost"
+d_port = 8194
+d_max_pending = 10000 # requests the session may have outstanding at once
+
+
+class Response():
+
+    # The result of one request, filled in from the dispatcher thread. Awaiting it returns the
+    # combined result of all its messages; iterating it with async for yields each decoded
+    # message as it arrives.
+
+    def __init__(self, loop, combine):
+        self._loop = loop
+        self._combine = combine
+        self._parts = collections.deque()
+        self._done = False
+        self._error = None
+        self._waiter = None
+
+    def _deliver(self, part, final, error):
+
+        # Always runs on the event loop thread.
+
+        if self._done:
+            return
+
+        if error is not None:
+            self._error = error
+            self._done = True
+        else:
+            if part is not None:
+                self._parts.append(part)
+            self._done = final
+
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+
+        while not self._parts:
+            if self._error is not None:
+                raise self._error
+            if self._done:
+                raise StopAsyncIteration
+            self._waiter = self._loop.create_future()
+            await self._waiter
+
+        return self._parts.popleft()
+
+    async def _collect(self):
+        return self._combine([part async for part in self])
+
+    def __await__(self):
+        return self._collect().__await__()
+
+
+class AsyncSession():
+
+    def __init__(self, host=d_host, port=d_port, max_pending=d_max_pending):
+
+        import blpapi
+
+        self._options = blpapi.SessionOptions()
+        self._options.setServerHost(host)
+        self._options.setServerPort(port)
+        self._options.setMaxPendingRequests(max_pending)
+
+        self._session = None
+        self._loop = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}      # correlation id -> (Response, decode)
+        self._opening = {}      # correlation id -> future of a service open
+        self._started = None
+
+        self.rank = RankService(self)
+        self.refdata = RefdataService(self)
+
+    async def start(self):
+
+        import blpapi
+
+        self._loop = asyncio.get_running_loop()
+        self._started = self._loop.create_future()
+
+        self._session = blpapi.Session(self._options, self.processEvent)
+
+        if not self._session.startAsync():
+            raise RequestFailed("Failed to start session")
+
+        await self._started
+        await asyncio.gather(self._open(RANK_SERVICE), self._open(REFDATA_SERVICE))
+
+        return self
+
+    async def stop(self):
+
+        if self._session is not None:
+            session, self._session = self._session, None
+            await self._loop.run_in_executor(None, session.stop)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _open(self, name):
+
+        import blpapi
+
+        future = self._loop.create_future()
+        cid = next(self._ids)
+
+        with self._lock:
+            self._opening[cid] = future
+
+        self._session.openServiceAsync(name, blpapi.CorrelationId(cid))
+
+        await future
+
+    def send(self, service, request_for, decode, combine):
+
+        # request_for(service) builds the request; decode(msg) runs on the dispatcher thread and
+        # returns the decoded part of one message.
+
+        import blpapi
+
+        request = request_for(self._session.getService(service))
+        response = Response(self._loop, combine)
+        cid = next(self._ids)
+
+        with self._lock:
+            self._pending[cid] = (response, decode)
+
+        try:
+            self._session.sendRequest(request, correlationId=blpapi.CorrelationId(cid))
+        except Exception:
+            with self._lock:
+                self._pending.pop(cid, None)
+            raise
+
+        return response
+
+    # dispatcher thread
+
+    def _call(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass # the event loop has already been closed
+
+    def _resolve(self, future, error=None):
+
+        if future.done():
+            return
+
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    def _fail_all(self, reason):
+
+        with self._lock:
+            pending = list(self._pending.values())
+            opening = list(self._opening.values())
+            self._pending.clear()
+            self._opening.clear()
+
+        for response, _ in pending:
+            self._call(response._deliver, None, True, RequestFailed(reason))
+
+        for future in opening + [self._started]:
+            self._call(self._resolve, future, RequestFailed(reason))
+
+    def processEvent(self, event, session):
+
+        import blpapi
+
+        event_type = event.eventType()
+
+        for msg in event:
+
+            if event_type == blpapi.Event.RESPONSE or event_type == blpapi.Event.PARTIAL_RESPONSE or event_type == blpapi.Event.REQUEST_STATUS:
+                self.processResponse(msg, event_type)
+
+            elif event_type == blpapi.Event.SESSION_STATUS:
+
+                if msg.messageType() == names.SESSION_STARTED:
+                    self._call(self._resolve, self._started)
+
+                elif msg.messageType() == names.SESSION_STARTUP_FAILURE:
+                    self._fail_all("Session startup failed")
+
+                elif msg.messageType() == names.SESSION_TERMINATED:
+                    self._fail_all("Session terminated")
+
+            elif event_type == blpapi.Event.SERVICE_STATUS:
+
+                with self._lock:
+                    future = self._opening.pop(msg.correlationIds()[0].value(), None)
+
+                if future is None:
+                    continue
+
+                if msg.messageType() == names.SERVICE_OPENED:
+                    self._call(self._resolve, future)
+                else:
+                    self._call(self._resolve, future, RequestFailed("Service failed to open: %s" % msg))
+
+        return False
+
+    def processResponse(self, msg, event_type):
+
+        import blpapi
+
+        cid = msg.correlationIds()[0].value()
+        final = event_type != blpapi.Event.PARTIAL_RESPONSE
+
+        with self._lock:
+            entry = self._pending.pop(cid, None) if final else self._pending.get(cid)
+
+        if entry is None:
+            return
+
+        response, decode = entry
+
+        if msg.messageType() == names.EXCEPTION or msg.messageType() == names.REQUEST_FAILURE:
+            with self._lock:
+                self._pending.pop(cid, None)
+            self._call(response._deliver, None, True, RequestFailed("Request failed: %s" % msg))
+            return
+
+        try:
+            part = decode(msg)
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(cid, None)
+            self._call(response._deliver, None, True, RequestFailed("Failed to decode response: %s" % e))
+            return
+
+        self._call(response._deliver, part, final, None)
+
+
+class RankService():
+
+    def __init__(self, client):
+        self._client = client
+
+    def query(self, securities, start, end=None, brokers=None, group_by="Broker", units=DEFAULT_UNITS, source=DEFAULT_SOURCE):
+        return self.send(query_spec(securities, start, end, brokers, group_by, units, source))
+
+    def group_query(self, securities, iso_date, units=DEFAULT_UNITS, source=DEFAULT_SOURCE):
+        return self.send(group_query_spec(securities, iso_date, units, source))
+
+    def send(self, spec):
+        return self._client.send(RANK_SERVICE, lambda rankapi: build_request(rankapi, spec), _decode_rank, _combine_rank)
+
+
+def _decode_rank(msg):
+
+    if msg.messageType() == names.REPORT:
+        return decode_report(msg)
+    if msg.messageType() == names.GROUPREPORT:
+        return decode_group_report(msg)
+
+    return None
+
+
+def _combine_rank(parts):
+    return concat_records(parts) if parts else RecordEncoder().result()
+
+
+class RefdataService():
+
+    def __init__(self, client):
+        self._client = client
+
+    def reference(self, securities, fields):
+
+        # Resolves to {ticker: {field: value}}, leaving out securities with a securityError and
+        # any field missing from fieldData.
+
+        def request_for(refdataapi):
+            request = refdataapi.createRequest("ReferenceDataRequest")
+            for ticker in securities:
+                request.append("securities", ticker)
+            for field in fields:
+                request.append("fields", field)
+            return request
+
+        return self._client.send(REFDATA_SERVICE, request_for, lambda msg: _decode_reference_data(msg, fields), _combine_reference_data)
+
+
+def _decode_reference_data(msg, fields):
+
+    refdata = {}
+
+    for sd in msg.getElement("securityData").values():
+
+        if sd.hasElement("securityError"):
+            continue
+
+        field_data = sd.getElement("fieldData")
+        refdata[sd.getElementAsString("security")] = {field: field_data.getElement(field).getValue() for field in fields if field_data.hasElement(field)}
+
+    return refdata
+
+
+def _combine_reference_data(parts):
+
+    refdata = {}
+    for part in parts:
+        refdata.update(part)
+
+    return refdata
+
+
+async def run(securities, iso_date):
+
+    async with AsyncSession() as client:
+
+        start = time.perf_counter()
+
+        # one Query per security, all in flight together, alongside the reference data
+        results = await asyncio.gather(client.refdata.reference(securities, ["DS199", "PR088"]),
+                                       *(client.rank.query([ticker], iso_date) for ticker in securities))
+
+        refdata, ranks = results[0], results[1:]
+
+        print("Retrieved %d security rankings in %.3fs" % (len(ranks), time.perf_counter() - start))
+
+        for ticker, records in zip(securities, ranks):
+            top = next(records.rows(), None)
+            fields = refdata.get(ticker, {})
+            print("%-20s %-28s top broker: %s" % (ticker, fields.get("DS199", "(unknown)"), "-" if top is None else "%s (%s)" % (top[1], top[3])))
+
+        # the universe ranking, consumed one partial response at a time
+        count = 0
+        async for records in client.rank.query(securities, iso_date):
+            count += len(records)
+            print("Received %d broker rows (%d so far)" % (len(records), count), end="\r")
+
+        print("\nUniverse ranking: %d brokers" % count)
+
+
+def main(argv):
+
+    securities = ["IBM US Equity", "MSFT US Equity", "VOD LN Equity"]
+    iso_date = "2021-09-29"
+
+    usage = 'python -m rankapi.aio [-t <ticker>]... [-d <ISO date>]'
+
+    try:
+        opts, args = getopt.getopt(argv, "ht:d:", ["help", "ticker=", "date="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+
+    tickers = []
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-t", "--ticker"):
+            tickers.append(arg)
+        elif opt in ("-d", "--date"):
+            iso_date = arg
+
+    try:
+        asyncio.run(run(tickers or securities, iso_date))
+    except RequestFailed as e:
+        print("Error: %s" % e, file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    print("Bloomberg - RANK API Example - rankapi.aio")
+    main(sys.argv[1:])
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
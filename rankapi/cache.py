@@ -0,0 +1,204 @@
+# rankapi/cache.py
+
+'''
+A local, content-addressed cache of decoded RANK API responses.
+
+Entries are keyed by the SHA-256 of the normalized request spec (see spec.spec_key)
+and stored as uncompressed .npz files holding the RankRecords columns and dictionaries.
+Requests for finished dates never expire; requests whose dates are still open are kept for
+open_ttl seconds only. The least recently used entries are evicted once the cache grows
+beyond max_entries or max_bytes. The size of the cache is tracked in memory, from one scan
+of the directory when first needed, so a put() does not walk the directory; it is scanned
+again only when a limit is exceeded, to pick up what other processes sharing it have stored,
+and is then trimmed to EVICT_TO of the limits so that the next scan is some puts away.
+'''
+
+import os
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from .decoder import RankRecords
+from .spec import spec_key, spec_is_open
+
+
+EVICT_TO = 0.9
+
+
+class ResponseCache():
+
+    def __init__(self, directory, max_entries=10000, max_bytes=1024*1024*1024, open_ttl=300):
+
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.stores = 0
+
+        self._lock = threading.Lock()
+        self._entries = None            # path -> [last used, size], loaded by the first put()
+        self._bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, spec):
+
+        path = self._path(spec_key(spec))
+
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+
+                expires = float(entry["expires"])
+
+                if expires and expires < time.time():
+                    records = None
+                else:
+                    records = RankRecords(entry["data"], entry["securities"].tolist(), entry["brokers"].tolist(), entry["broker_names"].tolist())
+
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # A damaged entry is treated as a miss and dropped.
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if records is None:
+            self._remove(path)
+            with self._lock:
+                self.expired += 1
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path) # mark as recently used
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+            if self._entries is not None and path in self._entries:
+                self._entries[path][0] = time.time()
+
+        return records
+
+    def put(self, spec, records):
+
+        if spec_is_open(spec):
+            if self.open_ttl <= 0:
+                return
+            expires = time.time() + self.open_ttl
+        else:
+            expires = 0.0
+
+        path = self._path(spec_key(spec))
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+
+        with open(tmp_path, "wb") as f:
+            np.savez(f,
+                     data=records.data,
+                     securities=np.array(records.securities, dtype=str),
+                     brokers=np.array(records.brokers, dtype=str),
+                     broker_names=np.array(records.broker_names, dtype=str),
+                     expires=np.float64(expires))
+
+        os.replace(tmp_path, path)
+
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self.stores += 1
+            if self._entries is None:
+                self._scan()
+            else:
+                self._bytes += size - self._entries.get(path, (0, 0))[1]
+                self._entries[path] = [time.time(), size]
+            full = len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+
+        if full:
+            self._evict()
+
+    def _remove(self, path):
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+        with self._lock:
+            if self._entries is not None and path in self._entries:
+                self._bytes -= self._entries.pop(path)[1]
+
+    def _scan(self):
+
+        # Rebuilds the index from the directory. Called with the lock held.
+
+        entries = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries[entry.path] = [st.st_mtime, st.st_size]
+
+        self._entries = entries
+        self._bytes = sum(size for _, size in entries.values())
+
+    def _evict(self):
+
+        with self._lock:
+            self._scan()
+            count = len(self._entries)
+            total = self._bytes
+            entries = sorted((used, size, path) for path, (used, size) in self._entries.items())
+
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        for _, size, path in entries:
+            if count <= self.max_entries * EVICT_TO and total <= self.max_bytes * EVICT_TO:
+                break
+            self._remove(path)
+            count -= 1
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "expired": self.expired, "evictions": self.evictions, "stores": self.stores}
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,155 @@
+# rankapi/completion.py
+
+'''
+A one-shot completion, used by the asynchronous samples to wait for the blpapi dispatcher
+thread to finish a request instead of spinning on a global flag.
+'''
+
+import threading
+from contextlib import contextmanager
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class Completion():
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def set(self, result=None):
+        return self._complete(result, None)
+
+    def fail(self, error):
+        if not isinstance(error, BaseException):
+            error = RequestFailed(error)
+        return self._complete(None, error)
+
+    def _complete(self, result, error):
+
+        # Only the first call wins; later signals (e.g. SessionTerminated after the report) are ignored.
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._result = result
+            self._error = error
+            self._event.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for callback in callbacks:
+            callback(self)
+
+        return True
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def forward(self, other):
+        # Completes other with this completion's result or error, once there is one.
+        self.add_done_callback(lambda completion: other._complete(completion._result, completion._error))
+
+    def done(self):
+        return self._event.is_set()
+
+    def failed(self):
+        return self._event.is_set() and self._error is not None
+
+    def wait(self, timeout=None):
+
+        if not self._event.wait(timeout):
+            raise TimeoutError("No response within %s seconds" % timeout)
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+    result = wait
+
+
+class ResponseTracker():
+
+    # With several dispatcher threads the messages of one response can be handled at the same
+    # time and finish in any order. The completion is set only once the final message, and
+    # every message that was being handled alongside it, is done; its result is then result(),
+    # if given. message() covers the usual case; enter() and leave() let a caller register a
+    # message under its own lock, e.g. together with looking up the request it belongs to.
+
+    def __init__(self, completion, result=None):
+        self.completion = completion
+        self._result = result
+        self._idle = threading.Condition()
+        self._active = 0
+        self._final = False
+
+    def enter(self):
+        with self._idle:
+            self._active += 1
+
+    def leave(self, final=False):
+
+        # Returns True once the final message and every message handled alongside it are done.
+
+        with self._idle:
+            self._active -= 1
+            self._final = self._final or final
+            if self._active == 0:
+                self._idle.notify_all()
+            return self._final and self._active == 0
+
+    def finish(self):
+        self.completion.set(self._result() if self._result is not None else None)
+
+    @contextmanager
+    def message(self, final):
+
+        self.enter()
+
+        try:
+            yield
+        finally:
+            if self.leave(final):
+                self.finish()
+
+    def wait(self, timeout=None):
+
+        # Waits for the completion, and then for any message still being handled to have handed
+        # off its work, so that a work queue joined afterwards has been given every message.
+
+        result = self.completion.wait(timeout)
+
+        with self._idle:
+            if not self._idle.wait_for(lambda: self._active == 0, timeout):
+                raise TimeoutError("Messages still being handled after %s seconds" % timeout)
+
+        return result
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,206 @@
+# rankapi/decoder.py
+
+'''
+Columnar decoding of RANK API Report and GroupReport messages.
+
+Rather than walking each record with getElement(...) calls, a whole message is converted in
+one toPy() call and its records are packed into a NumPy structured array. The security and
+broker_acronym columns are dictionary encoded: they hold integer codes into the securities
+and brokers lists of the decoded RankRecords.
+'''
+
+import numpy as np
+
+
+VALUE_FIELDS = ["bought", "sold", "traded", "crossed", "total", "highTouch", "lowTouch", "numReports"]
+
+# field names of the tuples yielded by RankRecords.rows()
+ROW_FIELDS = ["security", "brokerAcronym", "brokerName", "brokerRank"] + VALUE_FIELDS
+
+RECORD_DTYPE = np.dtype([("security", np.int32), ("broker_acronym", np.int32), ("broker_rank", np.int32)] +
+                        [(field, np.float64) for field in VALUE_FIELDS])
+
+
+class RankRecords():
+
+    def __init__(self, data, securities, brokers, broker_names, timestamp=None):
+        self.data = data                    # structured array of RECORD_DTYPE
+        self.securities = securities        # security code -> ticker
+        self.brokers = brokers              # broker code -> acronym
+        self.broker_names = broker_names    # broker code -> name
+        self.timestamp = timestamp          # timestampUtc of the (last) message decoded, if known
+        self._security_codes = None
+        self._broker_codes = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, column):
+        return self.data[column]
+
+    def security_code(self, ticker):
+        if self._security_codes is None:
+            self._security_codes = {ticker: code for code, ticker in enumerate(self.securities)}
+        return self._security_codes.get(ticker, -1)
+
+    def broker_code(self, acronym):
+        if self._broker_codes is None:
+            self._broker_codes = {acronym: code for code, acronym in enumerate(self.brokers)}
+        return self._broker_codes.get(acronym, -1)
+
+    def strings(self, column):
+        if column == "security":
+            return np.array(self.securities, dtype=object)[self.data["security"]]
+        if column == "broker_acronym":
+            return np.array(self.brokers, dtype=object)[self.data["broker_acronym"]]
+        if column == "broker_name":
+            return np.array(self.broker_names, dtype=object)[self.data["broker_acronym"]]
+        raise KeyError(column)
+
+    def rows(self):
+
+        # Yields one decoded tuple per record: (security, acronym, name, rank, bought, ..., numReports)
+        for row in self.data.tolist():
+            yield (self.securities[row[0]], self.brokers[row[1]], self.broker_names[row[1]]) + row[2:]
+
+
+class RecordEncoder():
+
+    # Accumulates records from any number of messages into shared dictionaries.
+
+    def __init__(self):
+        self._security_codes = {}
+        self._broker_codes = {}
+        self.securities = []
+        self.brokers = []
+        self.broker_names = []
+        self.timestamp = None
+        self._rows = []
+
+    def _security(self, ticker):
+        code = self._security_codes.get(ticker)
+        if code is None:
+            code = self._security_codes[ticker] = len(self.securities)
+            self.securities.append(ticker)
+        return code
+
+    def _broker(self, broker):
+        return self._broker_code(broker.get("acronym", ""), broker.get("name", ""))
+
+    def _broker_code(self, acronym, name):
+        code = self._broker_codes.get(acronym)
+        if code is None:
+            code = self._broker_codes[acronym] = len(self.brokers)
+            self.brokers.append(acronym)
+            self.broker_names.append(name)
+        return code
+
+    def add_row(self, ticker, acronym, name, rank, values):
+        # One record read field by field, e.g. through a rankapi.schema.ReportSchema; values in VALUE_FIELDS order.
+        self._rows.append((self._security(ticker), self._broker_code(acronym, name), rank) + tuple(values))
+
+    def recode(self, records):
+
+        # A copy of the data of another RankRecords, with its security and broker_acronym codes
+        # moved into this encoder's dictionaries (which gain any names they lack).
+
+        security_map = np.array([self._security(ticker) for ticker in records.securities], dtype=np.int32)
+        broker_map = np.array([self._broker_code(acronym, name) for acronym, name in zip(records.brokers, records.broker_names)], dtype=np.int32)
+
+        data = np.array(records.data, dtype=RECORD_DTYPE)
+        if len(data):
+            data["security"] = security_map[data["security"]]
+            data["broker_acronym"] = broker_map[data["broker_acronym"]]
+
+        return data
+
+    def add_records(self, records, ticker=None):
+
+        rows = self._rows
+        fixed_security = self._security(ticker) if ticker is not None else None
+
+        for record in records:
+
+            if fixed_security is None:
+                security = self._security(record.get("security", {}).get("ticker", ""))
+            else:
+                security = fixed_security
+
+            broker = record.get("broker", {})
+
+            rows.append((security, self._broker(broker), broker.get("rank", 0),
+                         record.get("bought", 0.0), record.get("sold", 0.0), record.get("traded", 0.0), record.get("crossed", 0.0),
+                         record.get("total", 0.0), record.get("highTouch", 0.0), record.get("lowTouch", 0.0), record.get("numReports", 0.0)))
+
+    def add_report(self, msg):
+        py = _to_py(msg)
+        self.timestamp = py.get("timestampUtc", self.timestamp)
+        self.add_records(py.get("records", []))
+
+    def add_group_report(self, msg):
+        py = _to_py(msg)
+        self.timestamp = py.get("timestampUtc", self.timestamp)
+        for security in py.get("securities", []):
+            self.add_records(security.get("records", []), security.get("security", {}).get("ticker", ""))
+
+    def result(self):
+        data = np.array(self._rows, dtype=RECORD_DTYPE)
+        return RankRecords(data, list(self.securities), list(self.brokers), list(self.broker_names), self.timestamp)
+
+
+def _to_py(msg):
+    return msg if isinstance(msg, dict) else msg.toPy()
+
+
+def concat_records(parts):
+
+    # Joins several RankRecords (e.g. one per partial response) into one, merging their
+    # dictionaries and re-coding the security and broker_acronym columns.
+
+    if len(parts) == 1:
+        return parts[0]
+
+    encoder = RecordEncoder()
+    arrays = []
+
+    for part in parts:
+        if part.timestamp is not None:
+            encoder.timestamp = part.timestamp
+
+        arrays.append(encoder.recode(part))
+
+    data = np.concatenate(arrays) if arrays else np.array([], dtype=RECORD_DTYPE)
+
+    return RankRecords(data, encoder.securities, encoder.brokers, encoder.broker_names, encoder.timestamp)
+
+
+def decode_report(msg):
+    encoder = RecordEncoder()
+    encoder.add_report(msg)
+    return encoder.result()
+
+
+def decode_group_report(msg):
+    encoder = RecordEncoder()
+    encoder.add_group_report(msg)
+    return encoder.result()
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
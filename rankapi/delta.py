@@ -0,0 +1,246 @@
+# rankapi/delta.py
+
+'''
+Day-over-day changes in broker rank, traded volume and share of total volume, computed from two
+days of decoded Query or GroupQuery results (RankRecords, e.g. two RankStore snapshots).
+
+    delta = rank_delta(store.records("2021-09-28"), store.records("2021-09-29"))
+    gainers, losers = delta.movers(10, broker="BK003")
+    for row in delta.rows(gainers): ...
+
+Both days are keyed by (security, broker) and joined with one sort, and every change and
+aggregate is a whole-array operation, so universes of 10,000+ securities and 1,000+ brokers
+take a fraction of a second. Rank changes are positive when a broker moved up. A broker with no
+record on one of the days counts as ranked just below the last broker ranked that day (or, if
+the security had no ranked brokers that day, just below the last one ranked on the other day),
+so that entering or dropping out of a security's ranking shows as a gain or a loss.
+'''
+
+import numpy as np
+
+from .decoder import RecordEncoder
+
+
+PAIR_DTYPE = np.dtype([("security", np.int32), ("broker_acronym", np.int32)] +
+                      [(name + suffix, dtype) for name, dtype in (("rank", np.int32), ("traded", np.float64), ("share", np.float64))
+                       for suffix in ("_before", "_after", "_change")])
+
+BROKER_DTYPE = np.dtype([("broker_acronym", np.int32)] +
+                        [(name + suffix, dtype) for name, dtype in (("rank", np.int32), ("traded", np.float64), ("share", np.float64))
+                         for suffix in ("_before", "_after", "_change")] +
+                        [("securities_gained", np.int32), ("securities_lost", np.int32)])
+
+SECURITY_DTYPE = np.dtype([("security", np.int32), ("total_before", np.float64), ("total_after", np.float64), ("total_change", np.float64)])
+
+
+class RankDelta():
+
+    def __init__(self, columns, brokers, securities, security_names, broker_acronyms, broker_names):
+        self.columns = columns              # PAIR_DTYPE field -> array: one entry per (security, broker) seen on either day
+        self.brokers = brokers              # BROKER_DTYPE: one row per broker, over the whole universe
+        self.securities = securities        # SECURITY_DTYPE: one row per security
+        self.security_names = security_names
+        self.broker_acronyms = broker_acronyms
+        self.broker_names = broker_names
+        self._broker_codes = None
+        self._pairs = None
+
+    def __len__(self):
+        return len(self.columns["security"])
+
+    @property
+    def pairs(self):
+
+        # All the pairs as one PAIR_DTYPE array, built when first asked for; movers only
+        # gathers the rows it returns.
+
+        if self._pairs is None:
+            self._pairs = self.take(slice(None))
+        return self._pairs
+
+    def take(self, index):
+
+        pairs = np.empty(len(self.columns["security"][index]), dtype=PAIR_DTYPE)
+        for name, column in self.columns.items():
+            pairs[name] = column[index]
+        return pairs
+
+    def broker_code(self, acronym):
+        if self._broker_codes is None:
+            self._broker_codes = {acronym: code for code, acronym in enumerate(self.broker_acronyms)}
+        return self._broker_codes.get(acronym, -1)
+
+    def movers(self, n=10, column="rank_change", broker=None):
+
+        # The n pairs (of broker's, if given) with the largest gain and the largest loss in
+        # column, best first, as (gainers, losers). Pairs with no change are left out.
+
+        values = self.columns[column]
+        if broker is not None:
+            selected = np.flatnonzero(self.columns["broker_acronym"] == self.broker_code(broker))
+        else:
+            selected = np.arange(len(values))
+
+        return (self.take(selected[_top(values[selected], n)]),
+                self.take(selected[_top(-values[selected], n)]))
+
+    def broker_movers(self, n=10, column="rank_change"):
+        values = self.brokers[column]
+        return self.brokers[_top(values, n)], self.brokers[_top(-values, n)]
+
+    def rows(self, pairs):
+
+        # Yields each pair as (ticker, acronym, name, rank_before, ..., share_change)
+
+        for row in pairs.tolist():
+            yield (self.security_names[row[0]], self.broker_acronyms[row[1]], self.broker_names[row[1]]) + row[2:]
+
+
+def _top(values, n):
+
+    # Indices of the n largest positive values, largest first.
+
+    candidates = np.flatnonzero(values > 0)
+
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-values[candidates], n)[:n]]
+
+    return candidates[np.argsort(-values[candidates], kind="stable")]
+
+
+def _day(data, n_securities, n_brokers):
+
+    # Per-record keys and shares of the security's total, and per-security totals and counts
+    # of ranked brokers, for one day.
+
+    security = data["security"].astype(np.int64)
+    keys = security * n_brokers + data["broker_acronym"]
+
+    security_total = np.bincount(security, weights=data["total"], minlength=n_securities)
+    share = np.zeros(len(data))
+    np.divide(data["total"], security_total[security], out=share, where=security_total[security] > 0)
+
+    ranked = np.bincount(security, weights=data["broker_rank"] > 0, minlength=n_securities)
+
+    return keys, share, security_total, ranked
+
+
+def _overall_rank(traded, present):
+
+    # 1 for the broker with the most traded volume, 0 for brokers not seen that day
+
+    order = np.lexsort((np.arange(len(traded)), -traded))
+    rank = np.empty(len(traded), dtype=np.int32)
+    rank[order] = np.arange(1, len(traded) + 1)
+    rank[~present] = 0
+
+    return rank
+
+
+def rank_delta(before, after):
+
+    # Compares two RankRecords, before and after. Their dictionaries need not match: unless both
+    # share the same ones (as RankStore snapshots do), after is re-coded into before's.
+
+    if before.securities is after.securities and before.brokers is after.brokers:
+        data_before, data_after = before.data, after.data
+        security_names, broker_acronyms, broker_names = before.securities, before.brokers, before.broker_names
+    else:
+        encoder = RecordEncoder()
+        data_before, data_after = encoder.recode(before), encoder.recode(after)
+        security_names, broker_acronyms, broker_names = encoder.securities, encoder.brokers, encoder.broker_names
+
+    n_securities = len(security_names)
+    n_brokers = max(len(broker_acronyms), 1)
+
+    keys_before, share_before, total_before, ranked_before = _day(data_before, n_securities, n_brokers)
+    keys_after, share_after, total_after, ranked_after = _day(data_after, n_securities, n_brokers)
+
+    # the join: every (security, broker) key of either day, and where each day's records land in
+    # it, from one sort of both days' keys
+    both = np.concatenate([keys_before, keys_after])
+    order = np.argsort(both)
+    ordered = both[order]
+    first = np.empty(len(both), dtype=bool)
+    first[:1] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=first[1:])
+
+    at = np.empty(len(both), dtype=np.int64)
+    at[order] = np.cumsum(first) - 1
+    at_before, at_after = at[:len(keys_before)], at[len(keys_before):]
+    keys = ordered[first]
+
+    n = len(keys)
+    columns = {}
+
+    for at, data, share, suffix in ((at_before, data_before, share_before, "_before"), (at_after, data_after, share_after, "_after")):
+        for name, values, dtype in (("rank", data["broker_rank"], np.int32), ("traded", data["traded"], np.float64), ("share", share, np.float64)):
+            column = columns[name + suffix] = np.zeros(n, dtype=dtype)
+            column[at] = values
+
+    security = keys // n_brokers
+    broker = keys % n_brokers
+
+    # a security with no ranked brokers on one day takes its count from the other day, so that
+    # brokers entering (or leaving) it are not all ranked first on the day it is missing
+    floor_before = np.where(ranked_before > 0, ranked_before, ranked_after)[security] + 1
+    floor_after = np.where(ranked_after > 0, ranked_after, ranked_before)[security] + 1
+
+    rank_before = np.where(columns["rank_before"] > 0, columns["rank_before"], floor_before)
+    rank_after = np.where(columns["rank_after"] > 0, columns["rank_after"], floor_after)
+
+    columns["rank_change"] = rank_before - rank_after
+    columns["traded_change"] = columns["traded_after"] - columns["traded_before"]
+    columns["share_change"] = columns["share_after"] - columns["share_before"]
+
+    columns["security"] = security.astype(np.int32)
+    columns["broker_acronym"] = broker.astype(np.int32)
+
+    # per broker, over the whole universe
+    brokers = np.zeros(n_brokers, dtype=BROKER_DTYPE)
+    brokers["broker_acronym"] = np.arange(n_brokers)
+
+    for data, suffix, universe_total in ((data_before, "_before", total_before.sum()), (data_after, "_after", total_after.sum())):
+        present = np.bincount(data["broker_acronym"], minlength=n_brokers) > 0
+        traded = np.bincount(data["broker_acronym"], weights=data["traded"], minlength=n_brokers)
+        total = np.bincount(data["broker_acronym"], weights=data["total"], minlength=n_brokers)
+        brokers["traded" + suffix] = traded
+        brokers["share" + suffix] = total / universe_total if universe_total > 0 else 0.0
+        brokers["rank" + suffix] = _overall_rank(traded, present)
+
+    overall_before = np.where(brokers["rank_before"] > 0, brokers["rank_before"], n_brokers + 1)
+    overall_after = np.where(brokers["rank_after"] > 0, brokers["rank_after"], n_brokers + 1)
+
+    brokers["rank_change"] = overall_before - overall_after
+    brokers["traded_change"] = brokers["traded_after"] - brokers["traded_before"]
+    brokers["share_change"] = brokers["share_after"] - brokers["share_before"]
+    brokers["securities_gained"] = np.bincount(broker, weights=columns["rank_change"] > 0, minlength=n_brokers)
+    brokers["securities_lost"] = np.bincount(broker, weights=columns["rank_change"] < 0, minlength=n_brokers)
+
+    securities = np.zeros(n_securities, dtype=SECURITY_DTYPE)
+    securities["security"] = np.arange(n_securities)
+    securities["total_before"] = total_before
+    securities["total_after"] = total_after
+    securities["total_change"] = total_after - total_before
+
+    return RankDelta(columns, brokers, securities, security_names, broker_acronyms, broker_names)
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
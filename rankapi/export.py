@@ -0,0 +1,182 @@
+# rankapi/export.py
+
+'''
+Streaming export of decoded RANK API records to Parquet.
+
+Each RankRecords written (typically one per Report or GroupReport message, as each partial
+response arrives) becomes one Arrow record batch. The security, broker_acronym and broker_name
+columns are Arrow dictionary arrays over the integer codes the decoder already produced, so
+each ticker and broker is stored once per batch rather than once per row, and reads back as a
+categorical column. Batches are held only until row_group_size rows are pending, and then
+written out as one Parquet row group, so an exchange-wide pull never sits in memory whole:
+
+    with ParquetExport("ranks.parquet") as export:
+        fetch_records(session, specs, on_records=lambda key, records: export.write(records))
+
+The file is written under a temporary name and only appears at its path once it is complete.
+pyarrow is only imported when the first batch is written.
+'''
+
+import os
+import threading
+
+import numpy as np
+
+from .decoder import VALUE_FIELDS
+
+
+ROW_GROUP_SIZE = 1 << 16
+
+
+def arrow_schema():
+
+    import pyarrow as pa
+
+    text = pa.dictionary(pa.int32(), pa.string())
+
+    return pa.schema([("security", text), ("broker_acronym", text), ("broker_name", text), ("broker_rank", pa.int32())] +
+                     [(field, pa.float64()) for field in VALUE_FIELDS] +
+                     [("timestampUtc", pa.timestamp("us", tz="UTC"))])
+
+
+def record_batch(records, security=None):
+
+    # One RankRecords as an Arrow record batch. Records of a per-security Query carry no ticker
+    # of their own, so it is passed in as security.
+
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    data = records.data
+    n = len(data)
+
+    if security is not None:
+        securities = pa.DictionaryArray.from_arrays(np.zeros(n, dtype=np.int32), pa.array([security], pa.string()))
+    else:
+        securities = pa.DictionaryArray.from_arrays(np.ascontiguousarray(data["security"]), pa.array(records.securities, pa.string()))
+
+    brokers = np.ascontiguousarray(data["broker_acronym"])
+
+    columns = [securities,
+               pa.DictionaryArray.from_arrays(brokers, pa.array(records.brokers, pa.string())),
+               pa.DictionaryArray.from_arrays(brokers, pa.array(records.broker_names, pa.string())),
+               pa.array(data["broker_rank"], pa.int32())]
+
+    columns += [pa.array(data[field], pa.float64()) for field in VALUE_FIELDS]
+
+    timestamp_type = schema.field("timestampUtc").type
+    if records.timestamp is None:
+        columns.append(pa.nulls(n, timestamp_type))
+    else:
+        columns.append(pa.repeat(pa.scalar(records.timestamp, timestamp_type), n))
+
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class ParquetExport():
+
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE, compression="snappy"):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.rows = 0
+        self.row_groups = 0
+        self._tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        self._writer = None
+        self._pending = []
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+
+    def write(self, records, security=None):
+
+        # Adds one RankRecords to the file. Safe to call from several threads.
+
+        if len(records) == 0:
+            return
+
+        batch = record_batch(records, security)
+
+        with self._lock:
+            self._pending.append(batch)
+            self._pending_rows += batch.num_rows
+            self.rows += batch.num_rows
+
+            if self._pending_rows >= self.row_group_size:
+                self._flush()
+
+    def _open(self):
+
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._tmp_path, arrow_schema(), compression=self.compression)
+
+        return self._writer
+
+    def _flush(self):
+
+        import pyarrow as pa
+
+        writer = self._open()
+
+        if self._pending:
+            # batches decoded from different messages have different dictionaries
+            table = pa.Table.from_batches(self._pending).unify_dictionaries().combine_chunks()
+            writer.write_table(table, row_group_size=max(self.row_group_size, table.num_rows))
+            self.row_groups += 1
+
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self):
+
+        # Writes the last row group and the footer, and moves the file into place.
+
+        with self._lock:
+            self._flush()
+            self._writer.close()
+            self._writer = None
+
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._pending = []
+
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
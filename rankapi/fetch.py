@@ -0,0 +1,322 @@
+# rankapi/fetch.py
+
+'''
+Pipelined fetching of RANK API and Reference Data responses over a synchronous session.
+
+send_pipelined keeps several requests in flight on one session, each tagged with its own
+correlation ID, and hands every response message back by key. fetch_records, fetch_chunked
+and get_reference_data build on it to return decoded RankRecords and reference data. The
+session can be a blpapi.Session with the services already open, or a RankSession, which
+opens them as they are first used.
+'''
+
+import itertools
+import time
+
+from . import names
+from .decoder import RecordEncoder, concat_records, decode_report, decode_group_report
+from .metrics import metrics
+from .spec import build_request
+
+
+REFDATA_CHUNK_SIZE = 100
+CHUNK_RETRIES = 2
+
+# correlation IDs for sessions without a counter of their own (see RankSession), unique across
+# the process, so that calls on the same session never reuse an ID
+_correlation_ids = itertools.count(1)
+
+
+def send_pipelined(session, requests, on_message, max_in_flight=1, on_complete=None, on_error=None):
+
+    # Sends each (key, request) pair tagged with its own correlation ID, keeping at most
+    # max_in_flight outstanding, and hands every response message to on_message(key, msg).
+    # on_complete(key) is called once the final response for a key has arrived.
+    # Returns False if any request fails, unless on_error(key, msg) is given, in which case
+    # the failed request is reported to it and the others carry on. on_message may return the
+    # RankRecords (or number of records) it decoded, which is added to the request's metrics.
+
+    import blpapi
+
+    pending = iter(requests)
+    in_flight = {}
+    timers = {}
+    ids = getattr(session, "correlation_ids", _correlation_ids)
+
+    def send_next():
+        for key, request in pending:
+            cid = next(ids)
+            in_flight[cid] = key
+            timers[cid] = metrics.start(str(request.asElement().name()))
+            session.sendRequest(request, correlationId=blpapi.CorrelationId(cid))
+            return
+
+    def failed(cid, msg):
+        if on_error is None or cid not in in_flight:
+            return False
+        timers.pop(cid).finished(failed=True)
+        on_error(in_flight.pop(cid), msg)
+        send_next()
+        return True
+
+    def abandon():
+        # the requests still outstanding are cancelled, so that nothing more arrives for them
+        for cid in in_flight:
+            session.cancel(blpapi.CorrelationId(cid))
+        for timer in timers.values():
+            timer.finished(failed=True)
+        return False
+
+    for _ in range(max(1, max_in_flight)):
+        send_next()
+
+    while in_flight:
+        event = session.nextEvent(500)
+
+        if event.eventType() == blpapi.Event.REQUEST_STATUS:
+            for msg in event:
+                if msg.messageType() == names.REQUEST_FAILURE:
+                    if failed(msg.correlationIds()[0].value(), msg):
+                        continue
+                    print ("Request failed: %s" % msg)
+                    return abandon()
+
+        elif event.eventType() == blpapi.Event.RESPONSE or event.eventType() == blpapi.Event.PARTIAL_RESPONSE:
+
+            completed = set()
+
+            for msg in event:
+
+                cid = msg.correlationIds()[0].value()
+                if cid not in in_flight:
+                    continue
+
+                final = event.eventType() == blpapi.Event.RESPONSE
+                timers[cid].received(final)
+
+                if msg.messageType() == names.EXCEPTION:
+                    if failed(cid, msg):
+                        continue
+                    print ("Exception occured.")
+                    return abandon()
+
+                decoded = on_message(in_flight[cid], msg)
+                if decoded is not None:
+                    timers[cid].decoded(decoded)
+
+                if final:
+                    completed.add(cid)
+
+            for cid in completed:
+                timers.pop(cid).finished()
+                key = in_flight.pop(cid)
+                if on_complete is not None:
+                    on_complete(key)
+                send_next()
+
+    return True
+
+
+def fetch_records(session, specs, max_in_flight=1, cache=None, on_records=None, keep=True):
+
+    # Fetches the decoded records for each (key, spec) pair, answering from the cache where it
+    # can. on_records(key, records) is called for every decoded message (or cache hit) as it
+    # arrives. Returns {key: RankRecords}, or None if a request fails. With keep=False the
+    # records are only handed to on_records and the result maps each key to its number of
+    # records, so a caller that streams them holds one message at a time; they are still
+    # gathered when a cache needs them to store the response.
+
+    rankapi = session.getService("//blp/rankapi")
+
+    results = {}
+    parts = {}
+    counts = {}
+    pending = {}
+    gather = keep or cache is not None
+
+    for key, spec in specs:
+
+        records = cache.get(spec) if cache is not None else None
+
+        if records is None:
+            pending[key] = spec
+            parts[key] = []
+            counts[key] = 0
+        else:
+            results[key] = records if keep else len(records)
+            if on_records is not None:
+                on_records(key, records)
+
+    def on_message(key, msg):
+
+        if msg.messageType() == names.REPORT:
+            records = decode_report(msg)
+        elif msg.messageType() == names.GROUPREPORT:
+            records = decode_group_report(msg)
+        else:
+            return
+
+        counts[key] += len(records)
+        if gather:
+            parts[key].append(records)
+
+        if on_records is not None:
+            on_records(key, records)
+
+        return records
+
+    def on_complete(key):
+
+        if not gather:
+            results[key] = counts[key]
+            return
+
+        records = concat_records(parts.pop(key)) if parts[key] else RecordEncoder().result()
+
+        if cache is not None:
+            cache.put(pending[key], records)
+
+        results[key] = records if keep else counts[key]
+
+    requests = ((key, build_request(rankapi, spec)) for key, spec in pending.items())
+
+    if not send_pipelined(session, requests, on_message, max_in_flight, on_complete):
+        return None
+
+    return results
+
+
+def get_reference_data(session, tickers, fields, chunk_size=REFDATA_CHUNK_SIZE, max_in_flight=1):
+
+    # Enriches the whole universe with a few multi-security ReferenceDataRequests rather than
+    # one request per security. Returns {ticker: {field: value}}, leaving out any field that
+    # is missing from fieldData, or None if a request fails.
+
+    refdataapi = session.getService("//blp/refdata")
+
+    refdata = {}
+
+    def build_refdata_requests():
+        for i in range(0, len(tickers), chunk_size):
+            refdata_request = refdataapi.createRequest("ReferenceDataRequest")
+            for ticker in tickers[i:i + chunk_size]:
+                refdata_request.append("securities", ticker)
+            for field in fields:
+                refdata_request.append("fields", field)
+            yield i, refdata_request
+
+    def on_refdata_message(chunk, msg):
+
+        sec_data = msg.getElement("securityData")
+        for sd in sec_data.values():
+
+            ticker = sd.getElementAsString("security")
+
+            if sd.hasElement("securityError"):
+                print ("Security error for " + ticker)
+                continue
+
+            field_data = sd.getElement("fieldData")
+            values = refdata.setdefault(ticker, {})
+
+            for field in fields:
+                if field_data.hasElement(field):
+                    values[field] = field_data.getElement(field).getValue()
+
+        return sec_data.numValues()
+
+    if not send_pipelined(session, build_refdata_requests(), on_refdata_message, max_in_flight):
+        return None
+
+    return refdata
+
+
+def fetch_chunked(session, tickers, make_spec, planner, max_in_flight=1, retries=CHUNK_RETRIES):
+
+    # Fetches make_spec(chunk) for successive chunks of tickers, sized by the planner as the
+    # earlier chunks complete. A chunk that fails is split in two and sent again, up to
+    # retries times. Returns the decoded RankRecords of every chunk, or None on failure.
+
+    rankapi = session.getService("//blp/rankapi")
+
+    parts = []
+    chunks = {}
+    failed = []
+    offset = 0
+    key = 0
+
+    def build_requests(queued):
+
+        nonlocal offset, key
+
+        while queued or offset < len(tickers):
+
+            if queued:
+                chunk = queued.pop()
+            else:
+                chunk = tickers[offset:offset + planner.next_size()]
+                offset += len(chunk)
+
+            key += 1
+            chunks[key] = [chunk, time.perf_counter(), []]
+            yield key, build_request(rankapi, make_spec(chunk))
+
+    def on_message(key, msg):
+        if msg.messageType() == names.REPORT:
+            records = decode_report(msg)
+            chunks[key][2].append(records)
+            return records
+
+    def on_complete(key):
+        chunk, sent, chunk_parts = chunks.pop(key)
+        planner.observe(len(chunk), time.perf_counter() - sent, sum(len(part) for part in chunk_parts))
+        parts.extend(chunk_parts)
+        print("Retrieved broker rank data for " + str(len(chunk)) + " securities (next chunk " + str(planner.next_size()) + ")", end="\r")
+
+    def on_error(key, msg):
+        # nothing is kept from a chunk that failed, so it can be sent again
+        print ("Chunk of " + str(len(chunks[key][0])) + " securities failed: %s" % msg)
+        failed.append(chunks.pop(key)[0])
+
+    queued = []
+
+    for attempt in range(retries + 1):
+
+        if not send_pipelined(session, build_requests(queued), on_message, max_in_flight, on_complete, on_error):
+            return None
+
+        if not failed:
+            return parts
+
+        queued = []
+        for chunk in failed:
+            half = (len(chunk) + 1) // 2
+            queued.extend(c for c in (chunk[:half], chunk[half:]) if c)
+        failed.clear()
+
+    print ("Error: " + str(len(queued)) + " chunks still failing after " + str(retries) + " retries")
+    return None
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
+
+
+
+
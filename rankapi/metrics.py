@@ -0,0 +1,292 @@
+# rankapi/metrics.py
+
+'''
+Per-request latency and throughput metrics for the RANK API samples.
+
+Each request is timed from the moment it is sent: start(operation) returns a RequestTimer,
+which is told about every response message as it arrives (received), about the records
+decoded from them (decoded), and finally that the request is over (finished). From these the
+registry keeps, per operation (Query, GroupQuery, ReferenceDataRequest, auth), histograms of
+
+    ttfb_seconds        time from sendRequest to the first response message
+    latency_seconds     time from sendRequest to the final response message
+    records             records per response
+    in_flight           requests of the operation outstanding when one is sent
+
+together with request and failure counts. Bytes decoded are deliberately not measured: blpapi
+does not expose the wire size of a message, and the size of the decoded arrays follows from
+the record count. The registry can be written out as JSON, or as Prometheus text for scraping:
+
+    metrics.write("metrics.json")
+    metrics.write("metrics.prom")
+'''
+
+import json
+import threading
+import time
+
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+RECORD_BUCKETS = [1, 10, 100, 1000, 10000, 100000, 1000000]
+IN_FLIGHT_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+HISTOGRAMS = {
+    "ttfb_seconds": LATENCY_BUCKETS,
+    "latency_seconds": LATENCY_BUCKETS,
+    "records": RECORD_BUCKETS,
+    "in_flight": IN_FLIGHT_BUCKETS,
+}
+
+HELP = {
+    "ttfb_seconds": "Time from sendRequest to the first response message.",
+    "latency_seconds": "Time from sendRequest to the final response message.",
+    "records": "Records per response.",
+    "in_flight": "Requests of the operation outstanding when one is sent.",
+}
+
+
+class Histogram():
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # the last one counts values above every bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+
+        # Upper bound of the bucket holding the q-th quantile; None if empty or beyond the last bucket.
+
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+
+        return None
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class RequestTimer():
+
+    # One request, from sendRequest to its final response. Not shared between requests.
+
+    def __init__(self, metrics, operation):
+        self.metrics = metrics
+        self.operation = operation
+        self.sent = time.perf_counter()
+        self.first = None
+        self.last = None
+        self.records = 0
+        self._finished = False
+
+    def received(self, final=False):
+
+        # Called as each response message arrives, before it is decoded.
+
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        if final:
+            self.last = now
+
+    def decoded(self, records):
+
+        # records is a RankRecords, or a plain count where nothing is decoded into one.
+
+        n = records if isinstance(records, int) else len(records)
+
+        with self.metrics.lock:
+            self.records += n
+
+    def finished(self, failed=False):
+
+        # Latency runs to the final message if one was seen, else to now. Only the first call counts.
+
+        if self.last is None:
+            self.last = time.perf_counter()
+
+        self.metrics._finish(self, failed)
+
+
+class RequestMetrics():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}        # operation -> {name: Histogram}
+        self.requests = {}          # operation -> requests sent
+        self.failures = {}          # operation -> requests failed
+        self.in_flight = {}         # operation -> requests outstanding
+
+    def _histograms(self, operation):
+        if operation not in self.histograms:
+            self.histograms[operation] = {name: Histogram(buckets) for name, buckets in HISTOGRAMS.items()}
+            self.requests[operation] = 0
+            self.failures[operation] = 0
+            self.in_flight[operation] = 0
+        return self.histograms[operation]
+
+    def start(self, operation):
+
+        # Called just before sendRequest.
+
+        timer = RequestTimer(self, operation)
+
+        with self.lock:
+            histograms = self._histograms(operation)
+            self.requests[operation] += 1
+            self.in_flight[operation] += 1
+            histograms["in_flight"].observe(self.in_flight[operation])
+
+        return timer
+
+    def _finish(self, timer, failed):
+
+        with self.lock:
+
+            if timer._finished:
+                return
+            timer._finished = True
+
+            histograms = self._histograms(timer.operation)
+            self.in_flight[timer.operation] -= 1
+
+            if failed:
+                self.failures[timer.operation] += 1
+                return
+
+            if timer.first is not None:
+                histograms["ttfb_seconds"].observe(timer.first - timer.sent)
+            histograms["latency_seconds"].observe(timer.last - timer.sent)
+            histograms["records"].observe(timer.records)
+
+    def to_dict(self):
+        with self.lock:
+            return {operation: dict({"requests": self.requests[operation], "failures": self.failures[operation], "in_flight_now": self.in_flight[operation]},
+                                    **{name: h.to_dict() for name, h in histograms.items()})
+                    for operation, histograms in self.histograms.items()}
+
+    def take(self):
+
+        # Returns to_dict() and starts afresh, so that a worker process can hand its metrics
+        # to the parent (see merge) without counting anything twice.
+
+        snapshot = self.to_dict()
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+            self.failures.clear()
+            self.in_flight.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+
+        # Adds a to_dict() snapshot, e.g. from another process, to these metrics.
+
+        with self.lock:
+            for operation, m in snapshot.items():
+                histograms = self._histograms(operation)
+                self.requests[operation] += m["requests"]
+                self.failures[operation] += m["failures"]
+                for name, h in histograms.items():
+                    h.counts = [a + b for a, b in zip(h.counts, m[name]["buckets"].values())]
+                    h.count += m[name]["count"]
+                    h.sum += m[name]["sum"]
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix="rank_request"):
+
+        lines = []
+
+        with self.lock:
+
+            for name, kind, counts, help in [("total", "counter", self.requests, "Requests sent."),
+                                             ("failures_total", "counter", self.failures, "Requests that failed."),
+                                             ("in_flight_now", "gauge", self.in_flight, "Requests outstanding.")]:
+                lines.append("# HELP %s_%s %s" % (prefix, name, help))
+                lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+                for operation, n in counts.items():
+                    lines.append('%s_%s{operation="%s"} %d' % (prefix, name, operation, n))
+
+            for name in HISTOGRAMS:
+                metric = "%s_%s" % (prefix, name)
+                lines.append("# HELP %s %s" % (metric, HELP[name]))
+                lines.append("# TYPE %s histogram" % metric)
+                for operation, histograms in self.histograms.items():
+                    h = histograms[name]
+                    cumulative = 0
+                    for bound, n in zip([repr(b) for b in h.buckets] + ["+Inf"], h.counts):
+                        cumulative += n
+                        lines.append('%s_bucket{operation="%s",le="%s"} %d' % (metric, operation, bound, cumulative))
+                    lines.append('%s_sum{operation="%s"} %r' % (metric, operation, h.sum))
+                    lines.append('%s_count{operation="%s"} %d' % (metric, operation, h.count))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+
+        # JSON for a .json file, Prometheus text for anything else.
+
+        with open(path, "w") as f:
+            f.write(self.to_json() if path.endswith(".json") else self.to_prometheus())
+
+    def summary(self):
+
+        # One line per operation, for printing at the end of a run.
+
+        def bound(h, q):
+            if h["count"] == 0:
+                return "n/a"
+            if h[q] is None:
+                return "> %ss" % LATENCY_BUCKETS[-1]
+            return "<= %ss" % h[q]
+
+        lines = []
+        for operation, m in self.to_dict().items():
+            lines.append("%s: %d requests (%d failed), latency p50 %s p99 %s, ttfb p50 %s, %d records"
+                         % (operation, m["requests"], m["failures"], bound(m["latency_seconds"], "p50"), bound(m["latency_seconds"], "p99"),
+                            bound(m["ttfb_seconds"], "p50"), m["records"]["sum"]))
+        return "\n".join(lines)
+
+
+# Shared by everything in the process, so that one file covers every request path.
+metrics = RequestMetrics()
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,75 @@
+# rankapi/names.py
+
+'''
+The blpapi.Name constants shared by the RANK API samples.
+
+The names are created the first time each one is used, so importing this module (or anything
+in rankapi) does not import blpapi:
+
+    from rankapi import names
+    if msg.messageType() == names.REPORT:
+        ...
+
+A from-import creates the name there and then, which suits the sample scripts:
+
+    from rankapi.names import SESSION_STARTED, REPORT
+'''
+
+
+_NAMES = {
+    "SESSION_STARTED":                  "SessionStarted",
+    "SESSION_STARTUP_FAILURE":          "SessionStartupFailure",
+    "SESSION_CONNECTION_UP":            "SessionConnectionUp",
+    "SESSION_CONNECTION_DOWN":          "SessionConnectionDown",
+    "SESSION_TERMINATED":               "SessionTerminated",
+
+    "SERVICE_OPENED":                   "ServiceOpened",
+    "SERVICE_OPEN_FAILURE":             "ServiceOpenFailure",
+    "SERVICE_DOWN":                     "ServiceDown",
+
+    "AUTHORIZATION_SUCCESS":            "AuthorizationSuccess",
+    "AUTHORIZATION_FAILURE":            "AuthorizationFailure",
+
+    "SLOW_CONSUMER_WARNING":            "SlowConsumerWarning",
+    "SLOW_CONSUMER_WARNING_CLEARED":    "SlowConsumerWarningCleared",
+
+    "REQUEST_FAILURE":                  "RequestFailure",
+    "EXCEPTION":                        "Exception",
+    "REPORT":                           "Report",
+    "GROUPREPORT":                      "GroupReport",
+}
+
+
+def __getattr__(attr):
+
+    if attr not in _NAMES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, attr))
+
+    import blpapi
+
+    name = globals()[attr] = blpapi.Name(_NAMES[attr])
+    return name
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_NAMES))
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,103 @@
+# rankapi/planner.py
+
+'''
+Splitting of large securityCriteria lists into chunks for the RANK API.
+
+A ChunkPlanner decides how many securities go into the next request. It starts from
+initial_size and, as each chunk completes, rescales towards the size that would take
+target_latency seconds, while keeping the expected number of records per response under
+max_records. The size never moves by more than a factor of two per observation.
+
+merge_broker_records joins the per-chunk results of a Query grouped by Broker: each broker's
+values are summed across the chunks and the brokers are ranked again by traded.
+'''
+
+import threading
+
+import numpy as np
+
+from .decoder import VALUE_FIELDS, RankRecords, RecordEncoder, concat_records
+
+
+class ChunkPlanner():
+
+    def __init__(self, initial_size=1000, min_size=50, max_size=20000, target_latency=2.0, max_records=250000):
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_records = max_records
+
+        self.size = max(min_size, min(max_size, initial_size))
+        self.observations = 0
+
+        self._lock = threading.Lock()
+
+    def next_size(self):
+        with self._lock:
+            return self.size
+
+    def observe(self, size, seconds, records):
+
+        # size securities were answered in seconds, with records records in the response
+
+        if size <= 0:
+            return
+
+        scale = self.target_latency / seconds if seconds > 0 else 2.0
+        target = size * max(0.5, min(2.0, scale))
+
+        if records > 0:
+            target = min(target, self.max_records * size / records)
+
+        with self._lock:
+            # blend with the current size so that chunks completing out of order do not make it jump about
+            self.size = int(max(self.min_size, min(self.max_size, (self.size + target) / 2)))
+            self.observations += 1
+
+
+def merge_broker_records(parts):
+
+    # Re-aggregates Report records of a Query grouped by Broker, one RankRecords per chunk.
+
+    records = concat_records(parts) if parts else RecordEncoder().result()
+
+    if len(records) == 0:
+        return records
+
+    data = records.data
+    codes, first, inverse = np.unique(data["broker_acronym"], return_index=True, return_inverse=True)
+
+    merged = np.zeros(len(codes), dtype=data.dtype)
+    merged["broker_acronym"] = codes
+    merged["security"] = data["security"][first]
+
+    for field in VALUE_FIELDS:
+        merged[field] = np.bincount(inverse, weights=data[field], minlength=len(codes))
+
+    # highest traded first; equal volumes keep the order in which the brokers were first seen
+    order = np.lexsort((first, -merged["traded"]))
+    merged = merged[order]
+    merged["broker_rank"] = np.arange(1, len(merged) + 1)
+
+    return RankRecords(merged, records.securities, records.brokers, records.broker_names, records.timestamp)
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
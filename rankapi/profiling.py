@@ -0,0 +1,132 @@
+# rankapi/profiling.py
+
+'''
+Phase-level wall and CPU time for the RANK API report.
+
+Code marks out its phases with the shared profiler:
+
+    with profiler.phase("import_securities"):
+        securities = import_securities(sec_file)
+
+Nothing is recorded until enable() is called, so the phases cost next to nothing in a normal
+run. Once enabled, each phase's calls, wall time and CPU time are added up by name, and
+report() formats them as a table. CPU time is time.process_time(), so it includes the blpapi
+and worker threads of the process as well as the thread running the phase. A wall time well
+above the CPU time means the phase is mostly waiting, usually on the network.
+
+enable(dump_file) also runs cProfile over the whole process, for a function-level view of
+the same run; the dump can be read with pstats or snakeviz.
+'''
+
+import cProfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PhaseProfiler():
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = {}            # name -> [calls, wall seconds, cpu seconds], in first-seen order
+        self._lock = threading.Lock()
+        self._started = None
+        self._profile = None
+        self._dump_file = ''
+
+    def enable(self, dump_file=''):
+
+        self.enabled = True
+        self._started = (time.perf_counter(), time.process_time())
+
+        if dump_file != '':
+            self._dump_file = dump_file
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    @contextmanager
+    def phase(self, name):
+
+        if not self.enabled:
+            yield
+            return
+
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, name, wall, cpu, calls=1):
+        with self._lock:
+            totals = self.phases.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+
+    def take(self):
+
+        # Returns the phases and starts afresh, so that a worker process can hand them to the
+        # parent (see merge) without counting anything twice.
+
+        with self._lock:
+            phases = self.phases
+            self.phases = {}
+        return phases
+
+    def merge(self, phases):
+        for name, (calls, wall, cpu) in phases.items():
+            self.add(name, wall, cpu, calls)
+
+    def dump(self):
+
+        # Writes the cProfile statistics, if enable() was given a dump file. Returns its name.
+
+        if self._profile is None:
+            return None
+
+        self._profile.disable()
+        self._profile.dump_stats(self._dump_file)
+        self._profile = None
+
+        return self._dump_file
+
+    def report(self):
+
+        lines = ["%-32s %7s %10s %10s %6s" % ("Phase", "Calls", "Wall (s)", "CPU (s)", "CPU %")]
+
+        with self._lock:
+            phases = list(self.phases.items())
+
+        if self._started is not None:
+            phases.append(("total", [1, time.perf_counter() - self._started[0], time.process_time() - self._started[1]]))
+
+        for name, (calls, wall, cpu) in phases:
+            lines.append("%-32s %7d %10.3f %10.3f %5.0f%%" % (name, calls, wall, cpu, 100.0 * cpu / wall if wall > 0 else 0.0))
+
+        return "\n".join(lines)
+
+
+# Shared by everything in the process; disabled until enable() is called.
+profiler = PhaseProfiler()
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,95 @@
+# rankapi/ranking.py
+
+'''
+Streaming overall broker ranking for a RANK API Query grouped by Broker.
+
+Report records arrive in rank order, spread over any number of PARTIAL_RESPONSE messages.
+BrokerRanking consumes them one decoded message at a time. It keeps the running traded
+total, the number of brokers seen, and, for each tracked broker, its row plus the rows
+directly above and below it. Memory stays constant however large the league table is.
+'''
+
+import numpy as np
+
+
+class BrokerRanking():
+
+    def __init__(self, brokers):
+
+        if isinstance(brokers, str):
+            brokers = [brokers]
+
+        self.overall_total = 0.0
+        self.count = 0
+
+        self._positions = {broker: None for broker in brokers}
+        self._previous = []
+        self._awaiting_below = []
+
+    def update(self, records):
+
+        # records is a RankRecords decoded from one Report message
+
+        data = records.data
+        n = len(data)
+
+        if n == 0:
+            return
+
+        self.overall_total += float(data["traded"].sum())
+
+        if self._awaiting_below:
+            first = _row(records, 0)
+            for position in self._awaiting_below:
+                position[2] = first
+            self._awaiting_below = []
+
+        codes = [code for code in (records.broker_code(broker) for broker in self._positions) if code >= 0]
+
+        if codes:
+            for i in np.flatnonzero(np.isin(data["broker_acronym"], codes)).tolist():
+
+                above = _row(records, i - 1) if i > 0 else self._previous
+                row = _row(records, i)
+                position = [above, row, []]
+
+                if i + 1 < n:
+                    position[2] = _row(records, i + 1)
+                else:
+                    self._awaiting_below.append(position)
+
+                self._positions[row[0]] = position
+
+        self._previous = _row(records, n - 1)
+        self.count += n
+
+    def position(self, broker):
+
+        # [row above or [], broker row, row below or []], or [] if the broker was not ranked.
+        # Each row is [acronym, name, rank, traded].
+        return self._positions.get(broker) or []
+
+
+def _row(records, i):
+    code = int(records.data["broker_acronym"][i])
+    return [records.brokers[code], records.broker_names[code], int(records.data["broker_rank"][i]), float(records.data["traded"][i])]
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
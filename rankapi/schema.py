@@ -0,0 +1,191 @@
+# rankapi/schema.py
+
+'''
+Name-interned access to the elements of RANK API Report and GroupReport messages.
+
+Looking an element up by string makes blpapi turn the string into a Name on every call, for
+every field of every record. A ReportSchema resolves the blpapi.Name of each element once,
+and reads from each message type's own definition which record fields it defines and which of
+those are optional:
+
+    schema = report_schema(session.getService("//blp/rankapi"))    # once per service
+    records = decode_group_report_elements(msg, schema)             # per message
+
+A required field that is missing from a record raises blpapi.NotFoundException rather than
+reading as zero; optional fields that are absent, and fields the message type does not define
+at all, read as 0.0, as they do in the toPy based decoders. No speedup from interning is shown:
+rankBenchmark only runs against fakeBlpapi, where making a Name from a string costs next to
+nothing, so its decode_interned phase says nothing about the real library. The decoders in
+rankapi.decoder remain the way to decode a whole message; these are for code that walks the
+elements itself. Schemas are cached by service name.
+'''
+
+import threading
+
+from .decoder import VALUE_FIELDS, RecordEncoder
+
+
+_schemas = {}
+_lock = threading.Lock()
+
+# where the records sit in each message type
+RECORD_PATHS = {"Report": ["records"], "GroupReport": ["securities", "records"]}
+
+
+class ReportSchema():
+
+    def __init__(self):
+
+        import blpapi
+
+        self.securities = blpapi.Name("securities")
+        self.security = blpapi.Name("security")
+        self.ticker = blpapi.Name("ticker")
+        self.records = blpapi.Name("records")
+        self.broker = blpapi.Name("broker")
+        self.acronym = blpapi.Name("acronym")
+        self.name = blpapi.Name("name")
+        self.rank = blpapi.Name("rank")
+        self.timestamp = blpapi.Name("timestampUtc")
+        self._layouts = {}          # message type -> value layout, see values_layout
+
+    def values_layout(self, msg):
+
+        # (Name, optional) of each value field in VALUE_FIELDS order for msg's message type, read
+        # from its definition the first time the type is seen. The Name is None where the type
+        # does not define the field.
+
+        message_type = str(msg.messageType())
+        layout = self._layouts.get(message_type)
+
+        if layout is None:
+
+            import blpapi
+
+            fields = _record_fields(msg, RECORD_PATHS.get(message_type, ["records"]))
+            layout = []
+            for field in VALUE_FIELDS:
+                if fields is None:
+                    layout.append((blpapi.Name(field), False))      # no definition: every field required
+                elif field in fields:
+                    layout.append((blpapi.Name(field), fields[field]))
+                else:
+                    layout.append((None, True))
+
+            self._layouts[message_type] = layout
+
+        return layout
+
+    def read_values(self, record, layout):
+
+        # The value fields of one record element, for a layout from values_layout. Optional
+        # fields read as 0.0 when absent; a missing required field raises NotFoundException.
+
+        import blpapi
+
+        values = []
+        for name, optional in layout:
+            if name is None:
+                values.append(0.0)
+            elif not optional:
+                values.append(record.getElementAsFloat(name))
+            else:
+                try:
+                    values.append(record.getElementAsFloat(name))
+                except blpapi.NotFoundException:
+                    values.append(0.0)
+        return values
+
+
+def _record_fields(msg, path):
+
+    # Walks msg's own definition down path to the record type and returns {field: optional}
+    # for the elements defined there, or None if the definition is not available.
+
+    import blpapi
+
+    try:
+        type_def = msg.asElement().elementDefinition().typeDefinition()
+
+        for element in path:
+            type_def = type_def.getElementDefinition(element).typeDefinition()
+
+        definitions = [type_def.getElementDefinition(i) for i in range(type_def.numElementDefinitions())]
+
+        return {str(definition.name()): definition.minValues() == 0 for definition in definitions}
+
+    except (AttributeError, blpapi.Exception):
+        return None
+
+
+def report_schema(service=None):
+
+    key = str(service.name()) if service is not None else None
+
+    with _lock:
+        schema = _schemas.get(key)
+        if schema is None:
+            schema = _schemas[key] = ReportSchema()
+
+    return schema
+
+
+def _add_records(encoder, records, schema, layout, ticker=None):
+
+    s = schema
+
+    for record in records.values():
+
+        if ticker is None:
+            security = record.getElement(s.security).getElementAsString(s.ticker) if record.hasElement(s.security) else ""
+        else:
+            security = ticker
+
+        broker = record.getElement(s.broker)
+
+        encoder.add_row(security, broker.getElementAsString(s.acronym), broker.getElementAsString(s.name),
+                        broker.getElementAsInteger(s.rank), s.read_values(record, layout))
+
+
+def _timestamp(msg, schema):
+    return msg.getElementAsDatetime(schema.timestamp) if msg.hasElement(schema.timestamp) else None
+
+
+def decode_report_elements(msg, schema):
+    encoder = RecordEncoder()
+    encoder.timestamp = _timestamp(msg, schema)
+    _add_records(encoder, msg.getElement(schema.records), schema, schema.values_layout(msg))
+    return encoder.result()
+
+
+def decode_group_report_elements(msg, schema):
+
+    encoder = RecordEncoder()
+    encoder.timestamp = _timestamp(msg, schema)
+    layout = schema.values_layout(msg)
+
+    for security in msg.getElement(schema.securities).values():
+        ticker = security.getElement(schema.security).getElementAsString(schema.ticker)
+        _add_records(encoder, security.getElement(schema.records), schema, layout, ticker)
+
+    return encoder.result()
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
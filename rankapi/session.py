@@ -0,0 +1,130 @@
+# rankapi/session.py
+
+'''
+A synchronous blpapi session that starts, and opens each service, the first time it is used.
+
+    session = RankSession("localhost", 8194)
+    records = fetch_records(session, [(key, spec)])     # connects and opens //blp/rankapi
+    session.stop()
+
+RankSession offers the part of blpapi.Session that the fetch functions use (getService,
+sendRequest, cancel and nextEvent), so a process only connects when it actually sends
+something, and only opens the services it needs. Failures to start or to open a service raise
+SessionError. Correlation IDs are drawn from the session's own counter, so a late response to
+an abandoned request can never be taken for one of a later request on the same session.
+'''
+
+import itertools
+import threading
+
+from .profiling import profiler
+
+
+d_host = "localhost"
+d_port = 8194
+
+
+class SessionError(Exception):
+    pass
+
+
+class RankSession():
+
+    def __init__(self, host=d_host, port=d_port):
+        self.host = host
+        self.port = port
+        self._session = None
+        self._services = {}
+        self._lock = threading.Lock()
+        self.correlation_ids = itertools.count(1)
+
+    def start(self):
+
+        with self._lock:
+
+            if self._session is not None:
+                return self
+
+            import blpapi
+
+            sessionOptions = blpapi.SessionOptions()
+            sessionOptions.setServerHost(self.host)
+            sessionOptions.setServerPort(self.port)
+
+            print ("Connecting to %s:%d" % (self.host, self.port))
+
+            session = blpapi.Session(sessionOptions)
+
+            with profiler.phase("session_start"):
+                started = session.start()
+
+            if not started:
+                raise SessionError("Failed to start session.")
+
+            self._session = session
+
+        return self
+
+    def getService(self, name):
+
+        self.start()
+
+        with self._lock:
+
+            if name not in self._services:
+
+                with profiler.phase("open_service " + name):
+                    opened = self._session.openService(name)
+
+                if not opened:
+                    raise SessionError("Failed to open service " + name)
+
+                print ("Service opened: " + name)
+                self._services[name] = self._session.getService(name)
+
+            return self._services[name]
+
+    def sendRequest(self, request, *args, **kwargs):
+        return self.start()._session.sendRequest(request, *args, **kwargs)
+
+    def cancel(self, correlationId):
+        if self._session is not None:
+            self._session.cancel(correlationId)
+
+    def nextEvent(self, timeout=0):
+        return self.start()._session.nextEvent(timeout)
+
+    def stop(self):
+
+        with self._lock:
+            session, self._session = self._session, None
+            self._services.clear()
+
+        if session is not None:
+            session.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
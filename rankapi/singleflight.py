@@ -0,0 +1,82 @@
+# rankapi/singleflight.py
+
+'''
+Coalescing of identical in-flight RANK API requests.
+
+SingleFlight.do(spec, send) sends a request only if no request for an equivalent spec (same
+spec.spec_key) is already in flight. Otherwise the caller is attached to the request
+that is, and every caller is handed the same response, so a burst of identical queries costs
+one upstream request. The time of day is part of the key, so intraday Queries over different
+windows are never merged. Nothing is kept once a request completes; that is what the cache module is for.
+'''
+
+import threading
+
+from .completion import Completion
+from .spec import spec_key
+
+
+class SingleFlight():
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.sent = 0
+        self.coalesced = 0
+
+    def do(self, spec, send):
+
+        # send(spec) sends the request and returns a Completion for its result. Returns a
+        # Completion shared by every caller of an equivalent spec while it is in flight.
+
+        key = spec_key(spec)
+
+        with self._lock:
+            shared = self._calls.get(key)
+            if shared is not None:
+                self.coalesced += 1
+                return shared
+            shared = self._calls[key] = Completion()
+            self.sent += 1
+
+        shared.add_done_callback(lambda completion: self._forget(key, completion))
+
+        try:
+            send(spec).forward(shared)
+        except Exception as e:
+            shared.fail(e)
+
+        return shared
+
+    def _forget(self, key, completion):
+        with self._lock:
+            if self._calls.get(key) is completion:
+                del self._calls[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {"sent": self.sent, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,164 @@
+# rankapi/spec.py
+
+'''
+RANK API requests described as plain dictionaries ("specs"), so that the same request can be
+built, compared, hashed and cached without holding on to a blpapi Request object.
+'''
+
+import hashlib
+import json
+from datetime import date, datetime
+
+
+DEFAULT_UNITS = "Shares"
+DEFAULT_SOURCE = "Broker Contributed"
+
+
+def query_spec(securities, start, end=None, brokers=None, group_by="Broker", units=DEFAULT_UNITS, source=DEFAULT_SOURCE):
+
+    spec = {
+        "operation": "Query",
+        "start": start,
+        "end": end if end is not None else start,
+        "groupBy": group_by,
+        "units": units,
+        "source": source,
+        "securities": list(securities),
+    }
+
+    if brokers:
+        spec["brokers"] = list(brokers)
+
+    return spec
+
+
+def group_query_spec(securities, iso_date, units=DEFAULT_UNITS, source=DEFAULT_SOURCE):
+
+    return {
+        "operation": "GroupQuery",
+        "date": iso_date,
+        "units": units,
+        "source": source,
+        "securities": list(securities),
+    }
+
+
+def parse_spec(obj):
+
+    # Builds a spec from a decoded JSON object, e.g. {"securities": [...], "start": "2021-09-29"}.
+    # Raises ValueError if it does not describe a Query or GroupQuery.
+
+    if not isinstance(obj, dict):
+        raise ValueError("spec must be an object")
+
+    operation = obj.get("operation", "Query")
+    securities = obj.get("securities")
+
+    if not isinstance(securities, list) or not securities or not all(isinstance(ticker, str) for ticker in securities):
+        raise ValueError("securities must be a non-empty list of tickers")
+
+    units = obj.get("units", DEFAULT_UNITS)
+    source = obj.get("source", DEFAULT_SOURCE)
+
+    if operation == "Query":
+        if "start" not in obj:
+            raise ValueError("Query needs a start date")
+        return query_spec(securities, obj["start"], obj.get("end"), obj.get("brokers"), obj.get("groupBy", "Broker"), units, source)
+
+    if operation == "GroupQuery":
+        if "date" not in obj:
+            raise ValueError("GroupQuery needs a date")
+        return group_query_spec(securities, obj["date"], units, source)
+
+    raise ValueError("unknown operation '%s'" % operation)
+
+
+def build_request(rankapi, spec):
+
+    request = rankapi.createRequest(spec["operation"])
+
+    for name in ("start", "end", "date", "units", "source", "groupBy"):
+        if name in spec:
+            request.set(name, spec[name])
+
+    sec_el = request.getElement("securityCriteria").setChoice("securities")
+    for ticker in spec["securities"]:
+        sec_el.appendElement().setElement("ticker", ticker)
+
+    for acronym in spec.get("brokers", []):
+        request.getElement("brokers").appendElement().setElement("acronym", acronym)
+
+    return request
+
+
+DATE_FIELDS = ("start", "end", "date")
+
+
+def _iso(value):
+
+    # A date, datetime or ISO string as a full ISO datetime string, so that the same instant
+    # always reads the same: an intraday Query keeps its time of day.
+
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+
+    return value.isoformat()
+
+
+def normalize_spec(spec):
+
+    # Order of securities and brokers does not change the answer, so they are sorted
+    # and de-duplicated; dates are reduced to ISO strings.
+
+    normalized = {}
+
+    for name, value in spec.items():
+        if name in ("securities", "brokers"):
+            value = sorted(set(value))
+        elif name in DATE_FIELDS and value is not None:
+            value = _iso(value)
+        normalized[name] = value
+
+    return normalized
+
+
+def spec_key(spec):
+    canonical = json.dumps(normalize_spec(spec), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def spec_is_open(spec, today=None):
+
+    # A request whose last date is today or later can still change.
+
+    today = (today or date.today()).isoformat()
+    normalized = normalize_spec(spec)
+    last = normalized.get("end") or normalized.get("date") or ""
+
+    return last[:10] >= today
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,294 @@
+# rankapi/store.py
+
+'''
+A local, append-only store of daily RANK snapshots, for time-series questions that would
+otherwise take a fresh Query per day.
+
+Each date is one partition: a file of raw RECORD_DTYPE rows sorted by security and broker,
+read back memory-mapped, with a small index of where each security's rows start. The files have
+no header of their own (the layout is recorded once in store.json), so opening a partition is
+one mmap call, and a query over a year of dates answers in milliseconds even when cold. The security
+and broker dictionaries are shared by every partition and only ever grow, so a code means the
+same ticker or broker on every date and a lookup is resolved once per query:
+
+    store = RankStore("rankstore")
+    store.append("2021-09-29", records)                     # e.g. the decoded GroupReports
+    history = store.history("IBM US Equity", "BK003", days=250)
+    history["date"], history["broker_rank"], history["traded"]
+
+A store holds one units and source. Each partition also records the universe it was fetched
+for and whether its date was still open, so that missing() can tell a sync which dates need
+fetching again. A partition is never rewritten in place: each append writes a new generation
+of its files, and store.json (written under a temporary name and moved into place) switches to
+it in one step, so a reader never sees half a partition, or the rows of one generation with the
+index of another, and a sync that is interrupted resumes at the first date it had not
+committed. One process should write to a store at a time.
+'''
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from .decoder import RECORD_DTYPE, RankRecords
+from .spec import DEFAULT_UNITS, DEFAULT_SOURCE
+
+
+STORE_FILE = "store.json"
+HISTORY_FIELDS = ("broker_rank", "traded")
+
+INDEX_DTYPE = np.dtype([("security", np.int32), ("start", np.int64)])
+
+
+def universe_key(tickers):
+
+    # Identifies a universe independently of the order of its tickers.
+
+    canonical = "\n".join(sorted(set(tickers)))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _layout():
+    # as it reads back from store.json
+    return {"rows": [list(field) for field in RECORD_DTYPE.descr], "index": [list(field) for field in INDEX_DTYPE.descr]}
+
+
+class RankStore():
+
+    def __init__(self, directory, units=DEFAULT_UNITS, source=DEFAULT_SOURCE):
+
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._partitions = {}           # date -> (data, index), opened as first used
+
+        os.makedirs(os.path.join(directory, "partitions"), exist_ok=True)
+
+        try:
+            with open(os.path.join(directory, STORE_FILE)) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {"units": units, "source": source, "layout": _layout(), "securities": [], "brokers": [], "broker_names": [], "partitions": {}}
+
+        if state["units"] != units or state["source"] != source:
+            raise ValueError("store %s holds %s / %s, not %s / %s" % (directory, state["units"], state["source"], units, source))
+
+        if state["layout"] != _layout():
+            raise ValueError("store %s was written with a different record layout" % directory)
+
+        self.units = units
+        self.source = source
+        self.securities = state["securities"]
+        self.brokers = state["brokers"]
+        self.broker_names = state["broker_names"]
+        self.partitions = state["partitions"]      # date -> {"rows", "timestamp", "updated", "universe", "open", "generation"}
+
+        self._security_codes = {ticker: code for code, ticker in enumerate(self.securities)}
+        self._broker_codes = {acronym: code for code, acronym in enumerate(self.brokers)}
+
+    def _path(self, iso_date, suffix=".rows", generation=None):
+
+        # Stores written before partitions had generations have them as <date>.rows and .index,
+        # which is generation 0.
+
+        if generation is None:
+            generation = self.partitions[iso_date].get("generation", 0)
+
+        name = "%s.%d" % (iso_date, generation) if generation else iso_date
+        return os.path.join(self.directory, "partitions", name + suffix)
+
+    def dates(self):
+        return sorted(self.partitions)
+
+    def __contains__(self, iso_date):
+        return iso_date in self.partitions
+
+    def security_code(self, ticker):
+        return self._security_codes.get(ticker, -1)
+
+    def broker_code(self, acronym):
+        return self._broker_codes.get(acronym, -1)
+
+    def _code(self, codes, values, key, names=None, name=None):
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(values)
+            values.append(key)
+            if names is not None:
+                names.append(name)
+        return code
+
+    def missing(self, dates, universe, today=None):
+
+        # Those of dates that have no partition for universe (see universe_key), or whose
+        # partition was written while the date was still open.
+
+        today = (today or date.today()).isoformat()
+
+        def current(iso_date):
+            partition = self.partitions.get(iso_date)
+            return partition is not None and partition.get("universe") == universe and not partition.get("open") and iso_date < today
+
+        return [iso_date for iso_date in dates if not current(iso_date)]
+
+    def append(self, iso_date, records, universe=None, is_open=False):
+
+        # Writes records (which must carry their own tickers, as GroupReport records do) as the
+        # partition for iso_date, replacing any earlier one. Returns the number of rows written.
+
+        with self._lock:
+
+            security_map = np.array([self._code(self._security_codes, self.securities, ticker) for ticker in records.securities], dtype=np.int32)
+            broker_map = np.array([self._code(self._broker_codes, self.brokers, acronym, self.broker_names, name)
+                                   for acronym, name in zip(records.brokers, records.broker_names)], dtype=np.int32)
+
+            data = np.array(records.data, dtype=RECORD_DTYPE)
+            if len(data):
+                data["security"] = security_map[data["security"]]
+                data["broker_acronym"] = broker_map[data["broker_acronym"]]
+                data = data[np.lexsort((data["broker_acronym"], data["security"]))]
+
+            securities, starts = np.unique(data["security"], return_index=True)
+            index = np.empty(len(securities) + 1, dtype=INDEX_DTYPE)
+            index["security"][:-1] = securities
+            index["start"][:-1] = starts
+            index[-1] = (-1, len(data))
+
+            previous = self.partitions.get(iso_date)
+            generation = previous.get("generation", 0) + 1 if previous is not None else 1
+
+            # the new generation's files are not listed anywhere until store.json names them
+            for suffix, array in ((".rows", data), (".index", index)):
+                with open(self._path(iso_date, suffix, generation), "wb") as f:
+                    array.tofile(f)
+
+            timestamp = records.timestamp.isoformat() if records.timestamp is not None else None
+            self.partitions[iso_date] = {"rows": len(data), "timestamp": timestamp, "updated": time.time(), "universe": universe, "open": is_open,
+                                         "generation": generation}
+            self._write_state()
+            self._partitions.pop(iso_date, None)
+
+            if previous is not None:
+                for suffix in (".rows", ".index"):
+                    try:
+                        os.remove(self._path(iso_date, suffix, previous.get("generation", 0)))
+                    except OSError:
+                        pass    # e.g. still mapped, on Windows
+
+        return len(data)
+
+    def _write_state(self):
+
+        path = os.path.join(self.directory, STORE_FILE)
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+
+        with open(tmp_path, "w") as f:
+            json.dump({"units": self.units, "source": self.source, "layout": _layout(), "securities": self.securities, "brokers": self.brokers,
+                       "broker_names": self.broker_names, "partitions": self.partitions}, f)
+
+        os.replace(tmp_path, path)
+
+    def _open(self, iso_date):
+
+        partition = self._partitions.get(iso_date)
+
+        if partition is None:
+            with open(self._path(iso_date), "rb") as f:
+                if self.partitions[iso_date]["rows"]:
+                    data = np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=RECORD_DTYPE)
+                else:
+                    data = np.empty(0, dtype=RECORD_DTYPE)
+            index = np.fromfile(self._path(iso_date, ".index"), dtype=INDEX_DTYPE)
+            partition = self._partitions[iso_date] = (data, index)
+
+        return partition
+
+    def records(self, iso_date):
+
+        # The snapshot for iso_date as RankRecords over the store's dictionaries, or None. The
+        # data stays memory-mapped.
+
+        if iso_date not in self.partitions:
+            return None
+
+        data, _ = self._open(iso_date)
+        timestamp = self.partitions[iso_date]["timestamp"]
+
+        return RankRecords(data, self.securities, self.brokers, self.broker_names,
+                           datetime.fromisoformat(timestamp) if timestamp is not None else None)
+
+    def rows(self, iso_date, security):
+
+        # The rows of one security on iso_date, sorted by broker code.
+
+        data, index = self._open(iso_date)
+
+        i = np.searchsorted(index["security"][:-1], security)
+        if i == len(index) - 1 or index["security"][i] != security:
+            return data[:0]
+
+        return data[index["start"][i]:index["start"][i + 1]]
+
+    def history(self, security, broker, days=250, end=None, fields=HISTORY_FIELDS):
+
+        # fields of broker's record for security on each of the last days stored dates up to
+        # end (all of them by default), as a structured array with a "date" column. Dates on
+        # which the broker has no record for the security are left out.
+
+        dates = self.dates()
+        if end is not None:
+            dates = [d for d in dates if d <= end]
+        dates = dates[-days:] if days else dates
+
+        result = np.empty(len(dates), dtype=[("date", "datetime64[D]")] + [(field, RECORD_DTYPE[field]) for field in fields])
+
+        security_code = self.security_code(security)
+        broker_code = self.broker_code(broker)
+
+        if security_code < 0 or broker_code < 0:
+            return result[:0]
+
+        n = 0
+
+        for iso_date in dates:
+
+            rows = self.rows(iso_date, security_code)
+
+            j = np.searchsorted(rows["broker_acronym"], broker_code)
+            if j == len(rows) or rows["broker_acronym"][j] != broker_code:
+                continue
+
+            result["date"][n] = iso_date
+            for field in fields:
+                result[field][n] = rows[field][j]
+            n += 1
+
+        return result[:n]
+
+    def stats(self):
+        return {"partitions": len(self.partitions), "rows": sum(p["rows"] for p in self.partitions.values()),
+                "securities": len(self.securities), "brokers": len(self.brokers)}
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
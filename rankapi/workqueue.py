@@ -0,0 +1,164 @@
+# rankapi/workqueue.py
+
+'''
+A bounded hand-off queue between the blpapi dispatcher thread and a pool of worker threads.
+
+The event handler only submits each response message; decoding and any other per-record work
+runs on the workers. When the workers fall behind, submit() blocks once max_depth messages are
+waiting, so the backlog builds up in blpapi's own event queue (which then raises
+SlowConsumerWarning) rather than being dropped. pause() and resume(), driven by
+SlowConsumerWarning and SlowConsumerWarningCleared, hold back new requests until the backlog
+has cleared: senders on the dispatcher thread hand the send to when_resumed(), which never
+blocks; other threads may call wait_until_resumed() instead.
+'''
+
+import queue
+import threading
+import time
+
+
+_STOP = object()
+
+
+class WorkQueue():
+
+    def __init__(self, workers=2, max_depth=64, on_error=None):
+
+        self._queue = queue.Queue(max_depth)
+        self._on_error = on_error
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._lock = threading.Lock()
+
+        self.max_depth = max_depth
+        self.submitted = 0
+        self.processed = 0
+        self.errors = 0
+        self.peak_depth = 0
+        self.blocked_seconds = 0.0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self._paused_at = None
+        self._deferred = []
+
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name="rank-worker-%d" % i, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn, *args):
+
+        # Called on the dispatcher thread. Blocks while the queue is full.
+
+        start = time.perf_counter()
+        self._queue.put((fn, args))
+        waited = time.perf_counter() - start
+
+        with self._lock:
+            self.submitted += 1
+            self.blocked_seconds += waited
+            self.peak_depth = max(self.peak_depth, self._queue.qsize())
+
+    def _work(self):
+
+        while True:
+
+            item = self._queue.get()
+
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            fn, args = item
+
+            try:
+                fn(*args)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                if self._on_error is not None:
+                    self._on_error(e)
+                else:
+                    print("Error in worker: %s" % e)
+            finally:
+                with self._lock:
+                    self.processed += 1
+                self._queue.task_done()
+
+    def pause(self):
+        with self._lock:
+            if self._resumed.is_set():
+                self._resumed.clear()
+                self.pauses += 1
+                self._paused_at = time.perf_counter()
+
+    def resume(self):
+
+        with self._lock:
+            if self._resumed.is_set():
+                return
+            self.paused_seconds += time.perf_counter() - self._paused_at
+            self._paused_at = None
+            self._resumed.set()
+            deferred = self._deferred
+            self._deferred = []
+
+        for fn in deferred:
+            fn()
+
+    def when_resumed(self, fn):
+
+        # Runs fn now, or from resume() if the queue is paused.
+
+        with self._lock:
+            if not self._resumed.is_set():
+                self._deferred.append(fn)
+                return
+
+        fn()
+
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def wait_until_resumed(self, timeout=None):
+        return self._resumed.wait(timeout)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def join(self):
+        # Waits until every submitted item has been processed.
+        self._queue.join()
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join()
+
+    def stats(self):
+        with self._lock:
+            return {"depth": self._queue.qsize(), "max_depth": self.max_depth, "peak_depth": self.peak_depth,
+                    "submitted": self.submitted, "processed": self.processed, "errors": self.errors, "blocked_seconds": self.blocked_seconds,
+                    "paused": not self._resumed.is_set(), "deferred": len(self._deferred), "pauses": self.pauses, "paused_seconds": self.paused_seconds}
+
+
+__copyright__ = """
+Copyright 2022. Bloomberg Finance L.P.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
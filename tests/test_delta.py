@@ -0,0 +1,61 @@
+# tests/test_delta.py
+
+'''
+Tests for rankapi.delta.rank_delta.
+'''
+
+from rankapi.decoder import RecordEncoder, VALUE_FIELDS
+from rankapi.delta import rank_delta
+
+
+def records(rows):
+
+    # rows: (ticker, acronym, rank, traded)
+
+    encoder = RecordEncoder()
+    for ticker, acronym, rank, traded in rows:
+        values = dict.fromkeys(VALUE_FIELDS, 0.0)
+        values["traded"] = values["total"] = traded
+        encoder.add_row(ticker, acronym, acronym + " Securities", rank, [values[field] for field in VALUE_FIELDS])
+    return encoder.result()
+
+
+def changes(delta, pairs):
+    return {(ticker, acronym): rank_change for ticker, acronym, name, rank_before, rank_after, rank_change, *rest in delta.rows(pairs)}
+
+
+def test_rank_change_within_security():
+
+    delta = rank_delta(records([("A", "X", 1, 300.0), ("A", "Y", 2, 200.0)]),
+                       records([("A", "X", 2, 200.0), ("A", "Y", 1, 300.0)]))
+
+    gainers, losers = delta.movers()
+
+    assert changes(delta, gainers) == {("A", "Y"): 1}
+    assert changes(delta, losers) == {("A", "X"): -1}
+
+
+def test_security_missing_on_one_day():
+
+    # B has no records before, so its brokers all enter it: each ranks just below the last
+    # broker ranked after, and gains, rather than losing against a rank of 1.
+
+    delta = rank_delta(records([("A", "X", 1, 300.0), ("A", "Y", 2, 200.0)]),
+                       records([("A", "X", 1, 300.0), ("A", "Y", 2, 200.0),
+                                ("B", "X", 1, 300.0), ("B", "Y", 2, 200.0), ("B", "Z", 3, 100.0)]))
+
+    gainers, losers = delta.movers()
+
+    assert changes(delta, gainers) == {("B", "X"): 3, ("B", "Y"): 2, ("B", "Z"): 1}
+    assert len(losers) == 0
+
+
+def test_security_missing_after():
+
+    delta = rank_delta(records([("A", "X", 1, 300.0), ("B", "X", 1, 300.0), ("B", "Y", 2, 200.0)]),
+                       records([("A", "X", 1, 300.0)]))
+
+    gainers, losers = delta.movers()
+
+    assert len(gainers) == 0
+    assert changes(delta, losers) == {("B", "Y"): -1, ("B", "X"): -2}